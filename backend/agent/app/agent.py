@@ -1,257 +1,651 @@
 import json
 import sys
 import os
+import time
+import logging
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config import REDIS_CHANNEL, SLACK_CHANNEL
-from redis_client import get_redis_client, create_message_listener
-from db import get_incident, update_incident_status, insert_audit_log, init_connection_pool, close_connection_pool, get_conn, return_conn
-from llm_client import ask_llm
+from config import (
+    REDIS_CHANNEL, SLACK_CHANNEL, SEMANTIC_SEARCH_URL, AGENT_MODE, AGENT_WORKERS, AGENT_QUEUE_SIZE,
+    PIPELINE_CONCURRENCY, PIPELINE_QUEUE_SIZE, PIPELINE_STATS_INTERVAL, FETCH_BATCH_SIZE,
+    COALESCE_WINDOW, COALESCE_MAX_GROUP, PRIORITY_SCHEDULING, PRIORITY_WEIGHTS, PRIORITY_AGING_RATE,
+    SHED_CHEAP_MODEL, SHED_CHEAP_MAX_TOKENS, REDIS_TRANSPORT
+)
+from redis_client import get_redis_client, create_message_listener, acknowledge, publish_many
+from db import get_incident, get_incidents, upsert_memory_item, upsert_memory_items, update_incident_status, insert_audit_log, UnitOfWork, UnitOfWorkError, unit_of_work, init_connection_pool, close_connection_pool, get_conn, return_conn, pool_stats
+from llm_client import ask_llm, skipped_analysis
 from notifier import send_incident_message
 from incident_router import notify_incident
+from worker_pool import IncidentWorkerPool
+from pipeline import PipelineStage, StagedPipeline, HELD
+from messages import parse_incident_id, embedded_incident
+from semantic_search import search_similar_incidents, to_related_items
+from http_client import get_http_client, close_http_client
+from audit_sink import close_audit_sink, audit_sink_stats
+from dedupe import get_deduplicator
+from retry import get_retry_scheduler
+from sweeper import get_incident_sweeper
+from coalescer import IncidentCoalescer
+from priority import priority_score
+from load_shedder import build_load_shedder
+from metrics import observe, timed, register_stats, start_metrics_server, INCIDENT_SOURCE
+from structured_logging import get_logger, setup_logging
 
+logger = get_logger("agent")
 redis_client = get_redis_client()
+# Set up in listen_loop() once the database pool is ready (None when disabled)
+deduplicator = None
+coalescer = None
+load_shedder = None
+retry_scheduler = None
+incident_sweeper = None
 
-def handle_incident_message(data):
-    try:
-        print(f"📥 Raw message received: {type(data)} - {str(data)[:100]}...")
-        
-        if not isinstance(data, dict):
-            print(f"⚠️ Invalid message format: expected dict, got {type(data)}")
-            print(f"📄 Message content: {data}")
-            return
-            
-        if "incident_id" not in data:
-            print("Missing incident_id in message")
-            return
-            
-        incident_id_raw = data.get("incident_id")
-        try:
-            incident_id = int(incident_id_raw)
-        except (ValueError, TypeError):
-            print(f"Invalid incident_id format: {incident_id_raw}")
-            return
-            
-        if incident_id <= 0:
-            print(f"Invalid incident_id value: {incident_id}")
-            return
+@observe("semantic_search_http")
+def _search_via_http(query_text):
+    """Semantic search through a remote FastAPI /semantic-search endpoint"""
+    logger.debug("🔗 Calling semantic search at: %s", SEMANTIC_SEARCH_URL)
+    response = get_http_client().post(
+        SEMANTIC_SEARCH_URL,
+        json={"query": query_text, "limit": 3, "similarity_threshold": 0.5},
+        headers={"Content-Type": "application/json"}
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"semantic search returned {response.status_code}: {response.text[:200]}")
+    return to_related_items(response.json().get('incidents', []))
+
+@observe("semantic_search_fallback_sql")
+def _find_similar_by_service(incident):
+    """Fallback to basic similarity search - only show incidents with solutions"""
+    related = []
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            service = incident.get('evidence', {}).get('service') if isinstance(incident.get('evidence'), dict) else 'unknown'
+            cursor.execute("""
+                SELECT id, summary, labels, service, incident_type, solution
+                FROM memory_item 
+                WHERE solution IS NOT NULL
+                AND (service = %s OR labels && %s)
+                ORDER BY id DESC
+                LIMIT 3
+            """, (service, incident.get('labels', [])))
             
-        print("Agent received incident:", incident_id)
-        incident = get_incident(incident_id)
-        if not incident:
-            print("No incident row for id", incident_id)
-            return
+            rows = cursor.fetchall()
+            for row in rows:
+                related.append({
+                    'memory_id': row[0],
+                    'summary': row[1],
+                    'labels': row[2] or [],
+                    'service': row[3],
+                    'incident_type': row[4],
+                    'solution': row[5],
+                    'similarity': 0.6  # Lower similarity for basic match
+                })
+    return related
 
-        print(f"📋 Processing incident {incident_id}: {incident.get('summary', '')[:100]}...")
-        
-        # Enable semantic search with pgvector via FastAPI
-        print(f"🔍 Searching for similar incidents...")
-        related = []
-        try:
-            query_text = incident.get('summary_text', incident.get('summary', ''))
-            if query_text:
-                # Use FastAPI semantic search endpoint for summary-based matching
-                print(f"🔍 Running semantic search for: {query_text[:50]}...")
-                
-                try:
-                    # Call FastAPI semantic search endpoint
-                    import requests as req
-                    
-                    semantic_search_url = "http://127.0.0.1:8001/semantic-search"
-                    print(f"🔗 Calling semantic search at: {semantic_search_url}")
-                    
-                    response = req.post(
-                        semantic_search_url,
-                        json={"query": query_text, "limit": 3, "similarity_threshold": 0.5},
-                        headers={"Content-Type": "application/json"},
-                        timeout=30
-                    )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        api_incidents = result.get('incidents', [])
-                        
-                        # Convert API response format to match expected format
-                        for incident_data in api_incidents:
-                            related.append({
-                                'memory_id': incident_data.get('incident_id'),
-                                'summary': incident_data.get('summary'),
-                                'labels': incident_data.get('labels', []),
-                                'service': incident_data.get('service'),
-                                'incident_type': incident_data.get('incident_type'),
-                                'solution': incident_data.get('solution'),
-                                'similarity': incident_data.get('similarity', 0)
-                            })
-                        
-                        print(f"🎯 FastAPI semantic search found {len(related)} similar incidents")
-                    else:
-                        print(f"❌ FastAPI semantic search failed: {response.status_code}")
-                        print(f"Response: {response.text}")
-                        
-                except Exception as api_error:
-                    print(f"⚠️ FastAPI call failed, falling back to basic search: {api_error}")
-                    print(f"🔍 Attempted URL: {semantic_search_url}")
-                    print(f"🔍 Query data: {{'query': '{query_text[:30]}...', 'limit': 3, 'similarity_threshold': 0.5}}")
-                    
-                    # Fallback to basic similarity search - only show incidents with solutions
-                    with get_conn() as conn:
-                        with conn.cursor() as cursor:
-                            service = incident.get('evidence', {}).get('service') if isinstance(incident.get('evidence'), dict) else 'unknown'
-                            cursor.execute("""
-                                SELECT id, summary, labels, service, incident_type, solution
-                                FROM memory_item 
-                                WHERE solution IS NOT NULL
-                                AND (service = %s OR labels && %s)
-                                ORDER BY id DESC
-                                LIMIT 3
-                            """, (service, incident.get('labels', [])))
-                            
-                            rows = cursor.fetchall()
-                            for row in rows:
-                                related.append({
-                                    'memory_id': row[0],
-                                    'summary': row[1],
-                                    'labels': row[2] or [],
-                                    'service': row[3],
-                                    'incident_type': row[4],
-                                    'solution': row[5],
-                                    'similarity': 0.6  # Lower similarity for basic match
-                                })
-                        
-                if related:
-                    print(f"📚 Found {len(related)} similar incidents with solutions:")
-                    for item in related:
-                        solution_status = "✅ Has solution" if item.get('solution') else "⚠️ No solution"
-                        similarity = item.get('similarity', 0)
-                        print(f"  - ID: {item['memory_id']} | Similarity: {similarity} | {solution_status}")
-                        print(f"    Summary: {item['summary'][:60]}...")
-                        if item.get('solution'):
-                            print(f"    Solution: {item['solution'][:80]}...")
+def find_similar_incidents(incident):
+    """Semantic search for similar past incidents, falling back to a service/label match"""
+    related = []
+    try:
+        query_text = incident.get('summary_text', incident.get('summary', ''))
+        if query_text:
+            logger.debug("🔍 Running semantic search for: %.50s...", query_text)
+            
+            try:
+                # Search pgvector in-process unless a remote search endpoint is configured
+                if SEMANTIC_SEARCH_URL:
+                    related = _search_via_http(query_text)
                 else:
-                    print(f"📚 No similar incidents found")
-            else:
-                print(f"⚠️ No summary text for similarity search")
-        except Exception as e:
-            print(f"⚠️ Semantic search failed: {e}")
-            related = []
-        
-        # Step 3: Get AI analysis with similar incidents context
-        print(f"🤖 Starting LLM analysis with similar incidents context...")
-        ai_result = ask_llm(incident, related)
-        
-        if not ai_result:
-            print(f"❌ Failed to get AI result for incident {incident_id}")
-            return
-        
-        print(f"✅ AI analysis completed with {len(related)} similar incidents")
-        if related:
-            print(f"📚 Similar incidents included in analysis:")
-            for item in related:
-                solution_info = f" (Solution: {item.get('solution', 'None')[:30]}...)" if item.get('solution') else " (No solution)"
-                print(f"  - ID {item['memory_id']}: {item['summary'][:40]}...{solution_info}")
-        else:
-            print(f"📚 No similar incidents found for context")
-        
-        # Save incident to pgvector memory with analysis
-        print(f"💾 Saving incident to vector memory...")
-        try:
-            # Save incident data to memory_item table
-            with get_conn() as conn:
-                with conn.cursor() as cursor:
-                    memory_id = str(incident_id)  # Convert to string for database
-                    summary = incident.get('summary', '')
-                    service = incident.get('evidence', {}).get('service') if isinstance(incident.get('evidence'), dict) else 'unknown'
-                    labels = incident.get('labels', [])
+                    related = to_related_items(search_similar_incidents(query_text, limit=3, similarity_threshold=0.5))
+                logger.debug("🎯 Semantic search found %d similar incidents", len(related))
                     
-                    # Check if incident already exists
-                    cursor.execute("SELECT id FROM memory_item WHERE id = %s", (memory_id,))
-                    if cursor.fetchone():
-                        # Update existing (don't overwrite solution if it exists)
-                        cursor.execute("""
-                            UPDATE memory_item 
-                            SET summary = %s, labels = %s, service = %s, incident_type = %s
-                            WHERE id = %s
-                        """, (summary, labels, service, 'incident', memory_id))
-                        print(f"✅ Updated incident {incident_id} in memory")
-                    else:
-                        # Insert new (solution starts as null)
-                        cursor.execute("""
-                            INSERT INTO memory_item 
-                            (id, summary, labels, service, incident_type, model, dim, solution)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (memory_id, summary, labels, service, 'incident',
-                             'text-embedding-3-small', 1536, None))
-                        print(f"✅ Saved incident {incident_id} to memory")
+            except Exception as search_error:
+                logger.warning("⚠️ Semantic search failed, falling back to basic search: %s (query: %.30s...)",
+                               search_error, query_text)
+                related = _find_similar_by_service(incident)
                     
-                    conn.commit()
-        except Exception as e:
-            print(f"⚠️ Failed to save to vector memory: {e}")
-            
-        print(f"📤 Sending notifications via routing system...")
-        
-        # Use the new notification routing system
+            if related and logger.isEnabledFor(logging.DEBUG):
+                for item in related:
+                    logger.debug("📚 Similar incident %s | similarity=%s | solution=%s | %.60s",
+                                 item['memory_id'], item.get('similarity', 0), bool(item.get('solution')), item['summary'])
+        else:
+            logger.warning("⚠️ No summary text for similarity search")
+    except Exception as e:
+        logger.warning("⚠️ Semantic search failed: %s", e)
+        related = []
+    return related
+
+def analyze_incident(incident_id, incident, related, model=None, max_tokens=400):
+    """Get AI analysis with similar incidents context"""
+    ai_result = ask_llm(incident, related, model=model, max_tokens=max_tokens)
+    
+    if not ai_result:
+        logger.error("❌ Failed to get AI result", extra={"incident_id": incident_id})
+        return None
+    
+    logger.debug("✅ AI analysis completed with %d similar incidents", len(related), extra={"incident_id": incident_id})
+    return ai_result
+
+def save_incident_memory(incident_id, incident):
+    """Save incident to pgvector memory, keeping any existing solution"""
+    if not upsert_memory_item(incident_id, incident):
+        logger.warning("⚠️ Failed to save incident to vector memory", extra={"incident_id": incident_id})
+
+def send_notifications(incident, ai_result, related):
+    """Notify the owning team through the routing system and log the outcome"""
+    # Use the new notification routing system
+    with timed("notify_incident"):
         notification_results = notify_incident(
             incident=incident,
             ai_result=ai_result,
             similar_incidents=related
         )
-        
-        # Log notification results
-        print(f"📊 Notification Results:")
-        print(f"   - Incident Type: {notification_results.get('incident_type')}")
-        print(f"   - Team Assigned: {notification_results.get('team_assigned')}")
-        print(f"   - Slack Success: {notification_results.get('slack_success')}")
-        print(f"   - Email Success: {notification_results.get('email_success')}")
-        print(f"   - Total Sent: {notification_results.get('notifications_sent')}/2")
-        
-        if notification_results.get('errors'):
-            print(f"   - Errors: {notification_results['errors']}")
-        
-        print(f"💾 Updating incident status...")
-        update_incident_status(incident_id, "ack")  # Use 'ack' instead of 'notified'
-        insert_audit_log(incident_id, "agent", "acknowledged", {
-            "ai_summary": ai_result.get("summary",""),
-            "notification_results": notification_results,
-            "notifications_sent": True
+    
+    # Log notification results
+    logger.info("📊 Notifications sent: %s/2 (type=%s, team=%s, slack=%s, email=%s)",
+                notification_results.get('notifications_sent'), notification_results.get('incident_type'),
+                notification_results.get('team_assigned'), notification_results.get('slack_success'),
+                notification_results.get('email_success'), extra={"incident_id": incident.get('id')})
+    if notification_results.get('errors'):
+        logger.warning("Notification errors: %s", notification_results['errors'], extra={"incident_id": incident.get('id')})
+    return notification_results
+
+def finalize_incident(incident_id, ai_result, notification_results, coalesced_ids=None):
+    """Mark the incident acknowledged and record the agent's work in the audit log"""
+    update_incident_status(incident_id, "ack")  # Use 'ack' instead of 'notified'
+    details = {
+        "ai_summary": ai_result.get("summary",""),
+        "notification_results": notification_results,
+        "notifications_sent": True
+    }
+    if coalesced_ids:
+        details["coalesced_with"] = coalesced_ids
+    insert_audit_log(incident_id, "agent", "acknowledged", details)
+
+# Pipeline stages: each takes the incident context dict and returns it to continue,
+# or None to stop. handle_incident_message runs them in order on one thread;
+# staged mode gives each its own queue and workers.
+
+def claim_incident(ctx, incident_id):
+    """Take the incident's lease. False if another consumer has it or it was already processed."""
+    if deduplicator is not None:
+        token = deduplicator.claim(incident_id)
+        if token is None:
+            return False
+        ctx["lease"] = token
+        ctx["lease_at"] = time.monotonic()
+    return True
+
+def renew_incident(ctx):
+    """
+    Extend the leases of the incidents in ctx once a third of DEDUPE_LEASE_MS has
+    passed since they were taken or last renewed; called before each stage.
+
+    An incident whose lease expired may be in another consumer's hands by now:
+    it is dropped from ctx without being acked or recorded as processed, and
+    False is returned when nothing is left to process.
+    """
+    if deduplicator is None:
+        return True
+    now = time.monotonic()
+    lost = set()
+    for member in _members(ctx):
+        if member.get("lease") and now - member["lease_at"] >= deduplicator.lease_ms / 3000:
+            if deduplicator.renew(member["incident_id"], member["lease"]):
+                member["lease_at"] = now
+            else:
+                member.pop("lease")
+                lost.add(id(member))
+    if not lost:
+        return True
+    logger.warning("⚠️ Stopped processing %d incident(s) whose lease was lost", len(lost),
+                   extra={"incident_id": ctx.get("incident_id")})
+    if ctx.get("members"):
+        # A coalesced group carries on with the incidents it still holds
+        ctx["members"] = [member for member in ctx["members"] if id(member) not in lost]
+        return bool(ctx["members"])
+    return False
+
+def _members(ctx):
+    """Incident contexts covered by ctx: every member of a coalesced group, or ctx itself"""
+    return ctx.get("members") or [ctx]
+
+def release_incident(ctx, processed=False):
+    """Release the leases taken by claim_incident, recording the incidents as processed if done"""
+    if deduplicator is None:
+        return
+    for member in _members(ctx):
+        if "lease" in member:
+            deduplicator.release(member["incident_id"], member.pop("lease"), processed=processed)
+
+def ack_message(ctx):
+    """Acknowledge the messages behind ctx (stream transport); they will not be redelivered"""
+    for member in _members(ctx):
+        acknowledge(member.get("data"))
+
+def fail_incident(ctx, exc):
+    """
+    Hand the messages behind a failed ctx to the retry scheduler (delayed retry
+    or dead letter); each is acknowledged once the scheduler has stored it
+    """
+    if retry_scheduler is None:
+        return
+    for member in _members(ctx):
+        data = member.get("data")
+        if "notification_results" in ctx and isinstance(data, dict):
+            # Notifications already went out: record that, so the retry does not send them again
+            retry = data.get("retry") if isinstance(data.get("retry"), dict) else {}
+            data = {**data, "retry": {**retry, "notified": ctx["notification_results"]}}
+        if retry_scheduler.fail(data, exc):
+            acknowledge(member.get("data"))
+
+def _accept_message(ctx):
+    """Parse the message and claim its incident; False means skip it"""
+    data = ctx["data"]
+    logger.debug("📥 Raw message received: %.100s", data)
+    
+    incident_id = parse_incident_id(data)
+    if incident_id is not None:
+        ctx["incident_id"] = incident_id
+        if claim_incident(ctx, incident_id):
+            return True
+    # Invalid, duplicate or already processed: nothing left to do for this message
+    ack_message(ctx)
+    return False
+
+def _attach_incident(ctx, incident):
+    incident_id = ctx["incident_id"]
+    if not incident:
+        logger.warning("No incident row for id %s", incident_id, extra={"incident_id": incident_id})
+        release_incident(ctx)
+        ack_message(ctx)
+        return None
+
+    logger.info("📋 Processing incident %s: %.100s", incident_id, incident.get('summary', ''),
+                extra={"incident_id": incident_id})
+    ctx["incident"] = incident
+    return ctx
+
+def _embedded_incident(ctx):
+    """The incident carried by a version 2 message, or None when it must be read from the DB"""
+    incident = embedded_incident(ctx["data"], ctx["incident_id"])
+    INCIDENT_SOURCE.labels("db" if incident is None else "embedded").inc()
+    return incident
+
+def fetch_stage(ctx):
+    if not _accept_message(ctx):
+        return None
+    
+    incident = _embedded_incident(ctx)
+    return _attach_incident(ctx, incident if incident is not None else get_incident(ctx["incident_id"]))
+
+def fetch_batch_stage(batch):
+    """Fetch stage for a micro-batch: one incidents query for every message without an embedded incident"""
+    accepted = [ctx for ctx in batch if _accept_message(ctx)]
+    if not accepted:
+        return []
+    
+    incidents = {}
+    for ctx in accepted:
+        incident = _embedded_incident(ctx)
+        if incident is not None:
+            incidents[ctx["incident_id"]] = incident
+    
+    incident_ids = [ctx["incident_id"] for ctx in accepted if ctx["incident_id"] not in incidents]
+    logger.debug("Agent received %d incidents, %d to read: %s", len(accepted), len(incident_ids), incident_ids)
+    if incident_ids:
+        fetched = get_incidents(incident_ids)
+        if fetched is None:
+            # Bulk query failed; fall back to one query per message
+            fetched = {incident_id: get_incident(incident_id) for incident_id in incident_ids}
+        incidents.update(fetched)
+    
+    ready = [_attach_incident(ctx, incidents.get(ctx["incident_id"])) for ctx in accepted]
+    return [ctx for ctx in ready if ctx]
+
+def coalesce_stage(ctx):
+    """Hand the incident to the coalescer, which passes its group on when the window closes"""
+    if coalescer is None:
+        return ctx
+    coalescer.add(ctx)
+    return HELD
+
+def apply_load_policy(ctx):
+    """Ask the load shedder whether to degrade this incident, and audit the decision"""
+    if load_shedder is None:
+        return None
+    members = _members(ctx)
+    # A coalesced group matters as much as its most anomalous member and is as old as its oldest
+    incident = max((member["incident"] for member in members),
+                   key=lambda item: priority_score(item, {"anomaly_score": 1.0}))
+    received = [member["received_at"] for member in members if member.get("received_at")]
+    decision = load_shedder.decide(incident, min(received) if received else None)
+    if decision:
+        logger.warning("🪫 Degrading incident (%s): %s", decision['reason'], decision['actions'],
+                       extra={"incident_id": ctx['incident_id']})
+        for member in members:
+            insert_audit_log(member["incident_id"], "agent", "degraded", decision)
+    ctx["degraded"] = decision
+    return decision
+
+def _degraded_actions(ctx):
+    return (ctx.get("degraded") or {}).get("actions", [])
+
+def search_stage(ctx):
+    # Search is the first costly step, so the load policy is applied here
+    apply_load_policy(ctx)
+    if "skip_search" in _degraded_actions(ctx):
+        logger.info("⏭️ Skipping semantic search (degraded)", extra={"incident_id": ctx['incident_id']})
+        ctx["related"] = []
+    else:
+        ctx["related"] = find_similar_incidents(ctx["incident"])
+    return ctx
+
+def analyze_stage(ctx):
+    actions = _degraded_actions(ctx)
+    if "no_llm" in actions:
+        ai_result = skipped_analysis(ctx["incident"], "agent under load")
+    elif "cheap_model" in actions:
+        ai_result = analyze_incident(ctx["incident_id"], ctx["incident"], [],
+                                     model=SHED_CHEAP_MODEL or None, max_tokens=SHED_CHEAP_MAX_TOKENS)
+    else:
+        ai_result = analyze_incident(ctx["incident_id"], ctx["incident"], ctx["related"])
+    if not ai_result:
+        return None
+    if "compact_slack" in actions:
+        ai_result["compact"] = True
+    ctx["ai_result"] = ai_result
+    return ctx
+
+def memory_stage(ctx):
+    if len(_members(ctx)) > 1:
+        return memory_batch_stage([ctx])[0]
+    save_incident_memory(ctx["incident_id"], ctx["incident"])
+    return ctx
+
+def memory_batch_stage(batch):
+    """Upsert the memory rows of every queued incident (and group member) in one statement"""
+    members = [member for ctx in batch for member in _members(ctx)]
+    saved = upsert_memory_items((member["incident_id"], member["incident"]) for member in members)
+    if saved:
+        logger.debug("💾 Saved %d incident(s) to vector memory", saved)
+    else:
+        logger.warning("⚠️ Failed to save %d incident(s) to vector memory", len(members))
+    # Memory is best-effort: notify and finalize still run if the upsert failed
+    return batch
+
+# Notify and finalize share one unit of work, carried in the context so it
+# survives the hand-off between stage threads: the Slack message, audit rows
+# and status update for an incident are written with a single commit.
+
+def _notified_before(ctx):
+    """Notification results an earlier attempt recorded for every incident in ctx, or None"""
+    results = []
+    for member in _members(ctx):
+        data = member.get("data")
+        retry = data.get("retry") if isinstance(data, dict) else None
+        if not isinstance(retry, dict) or "notified" not in retry:
+            return None
+        results.append(retry["notified"])
+    return results[0]
+
+def notify_stage(ctx):
+    notified = _notified_before(ctx)
+    if notified is not None:
+        logger.info("⏭️ Notifications were sent before the retry, not sending again",
+                    extra={"incident_id": ctx.get("incident_id")})
+        ctx["notification_results"] = notified
+        return ctx
+    with unit_of_work(ctx.setdefault("writes", UnitOfWork()), commit=False):
+        ctx["notification_results"] = send_notifications(ctx["incident"], ctx["ai_result"], ctx["related"])
+    return ctx
+
+def finalize_stage(ctx):
+    coalesced_ids = ctx["incident"].get("coalesced_ids")
+    writes = ctx.pop("writes", None) or UnitOfWork()
+    with unit_of_work(writes, commit=False):
+        for member in _members(ctx):
+            finalize_incident(member["incident_id"], ctx["ai_result"], ctx["notification_results"], coalesced_ids)
+    if not writes.commit():
+        # Not recorded: fail the stage so the lease is released unprocessed, the message
+        # stays unacked and the retry scheduler takes it (notifications are not resent)
+        raise UnitOfWorkError("status and audit writes for the incident could not be applied")
+    # Only now is the incident done: record it in the dedupe ledger and ack its message
+    release_incident(ctx, processed=True)
+    ack_message(ctx)
+    if retry_scheduler is not None:
+        # Retried incidents are done: the sweeper may look at them again
+        retry_scheduler.resolve([member["incident_id"] for member in _members(ctx)
+                                 if isinstance(member.get("data"), dict) and member["data"].get("retry")])
+    for member in _members(ctx):
+        # duration_ms is end to end: from receipt of the message to the final commit
+        logger.info("✅ Successfully processed incident %s", member["incident_id"], extra={
+            "incident_id": member["incident_id"], "stage": "finalize",
+            "duration_ms": round((time.time() - member.get("received_at", time.time())) * 1000, 1)
         })
+    return ctx
+
+INCIDENT_STAGES = [
+    ("fetch", fetch_stage),
+    ("coalesce", coalesce_stage),
+    ("search", search_stage),
+    ("analyze", analyze_stage),
+    ("memory", memory_stage),
+    ("notify", notify_stage),
+    ("finalize", finalize_stage),
+]
+
+def _stages_after(name):
+    names = [stage_name for stage_name, _ in INCIDENT_STAGES]
+    return INCIDENT_STAGES[names.index(name) + 1:]
+
+def _run_stages(ctx, stages):
+    current = ctx
+    held = False
+    try:
+        for name, stage in stages:
+            started = time.perf_counter()
+            if not renew_incident(current):
+                return
+            current = stage(current)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Stage %s done", name, extra={
+                    "incident_id": ctx.get("incident_id"), "stage": name,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+                })
+            if current is HELD:
+                # The coalescer owns the incident now and runs the remaining stages
+                held = True
+                return
+            if current is None:
+                return
         
-        print(f"✅ Successfully processed incident {incident_id}")
-        
     except Exception as e:
-        print(f"❌ Error handling incident message: {e}")
-        import traceback
-        traceback.print_exc()
-        # Log the error but don't crash the entire service
+        logger.exception("❌ Error handling incident message: %s", e, extra={"incident_id": ctx.get("incident_id")})
+        # Don't crash the service: retry the incident later (or dead-letter it)
+        fail_incident(ctx, e)
+    finally:
+        # Dropped or failed incidents give up their lease so a re-delivery can retry
+        if not held:
+            release_incident(ctx)
+
+def handle_incident_message(data):
+    _run_stages({"data": data, "received_at": time.time()}, INCIDENT_STAGES)
+
+def handle_incident_batch(messages):
+    """Process a micro-batch of messages, fetching all their incidents in one query"""
+    received_at = time.time()
+    batch = [{"data": data, "received_at": received_at} for data in messages]
+    try:
+        contexts = fetch_batch_stage(batch)
+    except Exception as e:
+        logger.exception("❌ Error fetching incident batch: %s", e)
+        for ctx in batch:
+            release_incident(ctx)
+        for data in messages:
+            handle_incident_message(data)
+        return
+    
+    for ctx in contexts:
+        _run_stages(ctx, INCIDENT_STAGES[1:])
+
+def run_coalesced_group(group):
+    """Run the stages after coalescing for a group emitted by the coalescer"""
+    _run_stages(group, _stages_after("coalesce"))
+
+def start_coalescer(emit):
+    """Start coalescing (if COALESCE_WINDOW is set) with emit receiving each closed group"""
+    global coalescer
+    if COALESCE_WINDOW <= 0:
+        return None
+    coalescer = IncidentCoalescer(emit, window_seconds=COALESCE_WINDOW, max_group_size=COALESCE_MAX_GROUP)
+    coalescer.start()
+    return coalescer
+
+# Stages whose queues are served by incident priority when PRIORITY_SCHEDULING is on
+PRIORITY_STAGES = ("search", "analyze")
+
+def incident_priority(ctx):
+    """Scheduling priority of an incident context; a coalesced group ranks as its most severe member"""
+    return max(priority_score(member["incident"], PRIORITY_WEIGHTS) for member in _members(ctx))
+
+def _renewing(handler, batch_size):
+    """Stage handler that renews the leases of its incidents first (staged mode)"""
+    def run(item):
+        if batch_size > 1:
+            # Contexts left out of the result are discarded by the pipeline
+            held = [ctx for ctx in item if renew_incident(ctx)]
+            return handler(held) if held else []
+        return handler(item) if renew_incident(item) else None
+    return run
+
+def build_incident_pipeline():
+    """Staged pipeline with per-stage concurrency from PIPELINE_CONCURRENCY"""
+    stages = [
+        PipelineStage("fetch", fetch_batch_stage, concurrency=PIPELINE_CONCURRENCY.get("fetch", 1),
+                      queue_size=PIPELINE_QUEUE_SIZE, batch_size=FETCH_BATCH_SIZE)
+    ]
+    for name, handler in INCIDENT_STAGES[1:]:
+        batch_size = 1
+        if name == "memory":
+            handler, batch_size = memory_batch_stage, FETCH_BATCH_SIZE
+        priority = incident_priority if PRIORITY_SCHEDULING and name in PRIORITY_STAGES else None
+        handler = _renewing(handler, batch_size)
+        stage = PipelineStage(name, handler, concurrency=PIPELINE_CONCURRENCY.get(name, 1),
+                              queue_size=PIPELINE_QUEUE_SIZE, batch_size=batch_size,
+                              priority=priority, aging_rate=PRIORITY_AGING_RATE)
+        if name == "coalesce" and start_coalescer(stage.forward):
+            # Flush open groups into the search stage before it shuts down
+            stage.on_stop = coalescer.stop
+        stages.append(stage)
+    return StagedPipeline(stages, stats_interval=PIPELINE_STATS_INTERVAL, on_discard=release_incident,
+                          on_error=fail_incident)
 
 def listen_loop():
-    print("🚀 Starting reliability agent...")
-    print("🔌 Initializing database connection pool...")
+    logger.info("🚀 Starting reliability agent...")
+    logger.info("🔌 Initializing database connection pool...")
     init_connection_pool()
     
-    print("🔍 Semantic search enabled with pgvector")
+    # The postgres transport can run without Redis; then only the features built on it are off
+    redis_available = REDIS_TRANSPORT != "postgres" or redis_client.ping()
+    if not redis_available:
+        logger.warning("⚠️ Redis is not reachable: running without dedupe, retries and the sweeper")
+    
+    global deduplicator, retry_scheduler
+    deduplicator = get_deduplicator(redis_client) if redis_available else None
+    retry_scheduler = get_retry_scheduler(redis_client, publish_many) if redis_available else None
+    if retry_scheduler is not None:
+        retry_scheduler.start()
+    
+    logger.info("🔍 Semantic search enabled with pgvector (%s)", 'via ' + SEMANTIC_SEARCH_URL if SEMANTIC_SEARCH_URL else 'in-process')
     
-    print(f"📡 Creating message listener for channel: {REDIS_CHANNEL}")
+    logger.info("📡 Creating message listener for channel: %s", REDIS_CHANNEL)
     listener = create_message_listener(REDIS_CHANNEL)
-    print("🎧 Starting to listen for messages...")
+    
+    # In pool and staged modes the listener only enqueues; workers run the handlers concurrently
+    pool = None
+    callback = handle_incident_message
+    if AGENT_MODE == "pool":
+        pool = IncidentWorkerPool(handle_incident_message, num_workers=AGENT_WORKERS, queue_size=AGENT_QUEUE_SIZE,
+                                  batch_handler=handle_incident_batch, batch_size=FETCH_BATCH_SIZE)
+    elif AGENT_MODE == "staged":
+        pool = build_incident_pipeline()
+    if PRIORITY_SCHEDULING and AGENT_MODE != "staged":
+        # Worker pool shards and the serial loop are FIFO; only stage queues can reorder
+        logger.warning("⚠️ PRIORITY_SCHEDULING only applies to AGENT_MODE=staged; %s mode handles "
+                       "incidents in arrival order", AGENT_MODE)
+    if pool is not None:
+        pool.start()
+        callback = pool.submit
+    
+    global load_shedder
+    load_shedder = build_load_shedder(pool.backlog if pool is not None else lambda: 0)
+    
+    # Outside staged mode, coalesced groups run on their own workers once their window closes
+    group_pool = None
+    if COALESCE_WINDOW > 0 and AGENT_MODE != "staged":
+        group_pool = IncidentWorkerPool(run_coalesced_group, num_workers=AGENT_WORKERS if pool else 1,
+                                        queue_size=AGENT_QUEUE_SIZE)
+        group_pool.start()
+        start_coalescer(group_pool.submit)
+    
+    # Per-stage timings are recorded by the pipeline itself; the rest is read from stats() at scrape time
+    start_metrics_server()
+    register_stats("db_pool", "psycopg connection pool statistics", pool_stats)
+    register_stats("audit_sink", "Background audit writer statistics", audit_sink_stats)
+    if AGENT_MODE == "pool":
+        register_stats("worker_pool", "Incident worker pool statistics", pool.stats)
+    if deduplicator is not None:
+        register_stats("dedupe", "Duplicate suppression counters", deduplicator.stats)
+    if coalescer is not None:
+        register_stats("coalescer", "Incident coalescing statistics", coalescer.stats)
+    if load_shedder is not None:
+        register_stats("load_shedder", "Load shedding decisions", load_shedder.stats)
+    if retry_scheduler is not None:
+        register_stats("retry", "Retry scheduler and dead-letter statistics", retry_scheduler.stats)
+    
+    global incident_sweeper
+    incident_sweeper = get_incident_sweeper(redis_client, publish_many, retry_scheduler) if redis_available else None
+    if incident_sweeper is not None:
+        incident_sweeper.start()
+        register_stats("sweeper", "Missed-incident sweeper statistics", incident_sweeper.stats)
+    
+    logger.info("🎧 Starting to listen for messages (%s mode)...", AGENT_MODE)
     
     try:
-        listener.listen(handle_incident_message)
+        listener.listen(callback)
     except KeyboardInterrupt:
-        print("\n🛑 Agent stopped by user")
+        logger.info("🛑 Agent stopped by user")
     except Exception as e:
-        print(f"❌ Listener error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Listener error: %s", e)
     finally:
+        # Let workers finish in-flight incidents before the pool goes away
+        if pool is not None:
+            logger.info("⏳ Draining %s workers...", AGENT_MODE)
+            pool.stop()
+        if group_pool is not None:
+            coalescer.stop()
+            group_pool.stop()
+        if retry_scheduler is not None:
+            retry_scheduler.stop()
+        if incident_sweeper is not None:
+            incident_sweeper.stop()
+        
+        # Report connection reuse and close pooled HTTP connections
+        close_http_client()
+        
+        # Flush buffered audit rows while the database pool is still open
+        close_audit_sink()
+        
         # Clean up database connections
         try:
             close_connection_pool()
         except Exception as e:
-            print(f"⚠️ Error closing database pool: {e}")
+            logger.warning("⚠️ Error closing database pool: %s", e)
 
 if __name__ == "__main__":
-    print("🔧 Initializing reliability agent...")
+    setup_logging()
+    logger.info("🔧 Initializing reliability agent...")
     try:
         listen_loop()
     except KeyboardInterrupt:
-        print("\n🛑 Agent stopped")
+        logger.info("🛑 Agent stopped")
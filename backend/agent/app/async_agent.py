@@ -0,0 +1,343 @@
+"""
+Asyncio implementation of the reliability agent
+
+Runs the same incident pipeline as agent.py (fetch incident, semantic search,
+LLM analysis, memory save, Slack notification, status and audit writes) but
+every stage awaits instead of blocking:
+
+- redis.asyncio pub/sub for incident_ready messages
+- psycopg_pool.AsyncConnectionPool for Postgres (see async_db.py)
+- httpx.AsyncClient for the OpenAI embedding and chat calls
+- slack_sdk AsyncWebClient for Slack
+
+A single process keeps up to ASYNC_MAX_IN_FLIGHT incidents in flight. Messages
+for the same incident_id are still processed one at a time and in order.
+
+Email notifications are only sent by the sync agent (incident_router); this
+agent routes and posts to Slack only.
+
+Failed incidents take the same path as in the sync agent: with RETRY_ENABLED
+they go to the RetryScheduler (delayed retry or dead letter, see retry.py),
+whose re-published retries arrive on the channel this agent listens to.
+
+Usage:
+    python app/async_agent.py
+
+The sync agent (python app/agent.py) remains the fallback entry point and is
+required for Upstash REST deployments, which have no async pub/sub.
+"""
+
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+import redis.asyncio as aioredis
+from slack_sdk.web.async_client import AsyncWebClient
+
+from config import (
+    REDIS_URL, REDIS_CHANNEL, UPSTASH_REDIS_REST_URL, OPENAI_API_KEY, OPENAI_BASE_URL,
+    SEMANTIC_SEARCH_URL, SLACK_BOT_TOKEN, SLACK_API_URL, SLACK_CHANNEL, ASYNC_MAX_IN_FLIGHT, LLM_MODEL
+)
+import async_db
+from llm_client import build_analysis_prompt, parse_analysis_response
+from notifier import build_blocks
+from email_notifier import load_routing_config, classify_incident_type
+from messages import parse_incident_id, embedded_incident, decode_message
+from semantic_search import embedding_request, to_related_items
+from redis_client import get_redis_client, publish_many
+from retry import get_retry_scheduler, TransientError, PermanentError
+from structured_logging import get_logger, setup_logging
+
+logger = get_logger("async_agent")
+
+
+class AsyncIncidentAgent:
+    """Processes incident_ready messages concurrently on one event loop"""
+
+    def __init__(self, http: httpx.AsyncClient, slack: AsyncWebClient, max_in_flight: int = ASYNC_MAX_IN_FLIGHT,
+                 retries=None):
+        self.http = http
+        self.slack = slack
+        # RetryScheduler for failed incidents, or None to only log them
+        self.retries = retries
+        self.max_in_flight = max(1, max_in_flight)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._tasks = set()
+        # Per-incident locks keep ordering for re-deliveries of the same incident
+        self._incident_locks = {}
+        self._incident_lock_users = {}
+
+    async def search_similar(self, incident: dict) -> list:
+        """Semantic search in-process (or via SEMANTIC_SEARCH_URL), falling back to a service/label match"""
+        query_text = incident.get('summary_text', incident.get('summary', ''))
+        if not query_text:
+            logger.warning("⚠️ No summary text for similarity search")
+            return []
+
+        try:
+            if SEMANTIC_SEARCH_URL:
+                response = await self.http.post(
+                    SEMANTIC_SEARCH_URL,
+                    json={"query": query_text, "limit": 3, "similarity_threshold": 0.5}
+                )
+                if response.status_code != 200:
+                    raise RuntimeError(f"semantic search returned {response.status_code}")
+                return to_related_items(response.json().get('incidents', []))
+
+            url, headers, body = embedding_request(query_text)
+            response = await self.http.post(url, headers=headers, json=body)
+            if response.status_code != 200:
+                raise RuntimeError(f"Embedding API error: {response.text}")
+            query_embedding = response.json()['data'][0]['embedding']
+            results = await async_db.find_similar_by_embedding(query_embedding, limit=3, similarity_threshold=0.5)
+            return to_related_items(results)
+        except Exception as search_error:
+            logger.warning("⚠️ Semantic search failed, falling back to basic search: %s", search_error)
+            try:
+                evidence = incident.get('evidence')
+                service = evidence.get('service') if isinstance(evidence, dict) else 'unknown'
+                return await async_db.find_similar_by_service(service, incident.get('labels', []))
+            except Exception as e:
+                logger.warning("⚠️ Semantic search failed: %s", e)
+                return []
+
+    async def analyze(self, incident: dict, related: list) -> dict:
+        """
+        Ask OpenAI for a summary and root causes
+
+        API failures are raised (TransientError for rate limits and server
+        errors, PermanentError for other rejections) so the incident is
+        retried rather than posted with a canned analysis, as in ask_llm().
+        """
+        prompt = build_analysis_prompt(incident, related)
+        try:
+            response = await self.http.post(
+                f"{OPENAI_BASE_URL}/chat/completions",
+                headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+                json={
+                    "model": LLM_MODEL,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": 0.0,
+                    "max_tokens": 400
+                }
+            )
+            if response.status_code != 200:
+                # Timeouts, rate limits and server errors may pass; other rejections will not
+                transient = response.status_code in (408, 429) or response.status_code >= 500
+                error = TransientError if transient else PermanentError
+                raise error(f"OpenAI API error: {response.status_code} - {response.text[:500]}")
+            text = response.json()['choices'][0]['message']['content'].strip()
+        except Exception as api_error:
+            logger.error("❌ OpenAI API call failed: %s", api_error)
+            raise
+        return parse_analysis_response(text)
+
+    async def notify(self, incident: dict, ai_result: dict, related: list) -> dict:
+        """Route the incident to its team channel and post the Slack message"""
+        incident_id = incident.get('incident_id', incident.get('id'))
+        results = {
+            "incident_type": None,
+            "team_assigned": None,
+            "slack_success": False,
+            "email_success": False,
+            "notifications_sent": 0,
+            "errors": []
+        }
+
+        try:
+            config = load_routing_config()
+            incident_type = classify_incident_type(incident)
+            routing_info = config['incident_routing'].get(incident_type, config['fallback'])
+            channel = routing_info['slack_channel']
+            results["incident_type"] = incident_type
+            results["team_assigned"] = routing_info['team_name']
+
+            enhanced_ai_result = dict(ai_result, team_assigned=routing_info['team_name'], incident_type=incident_type)
+        except Exception as e:
+            logger.error("❌ Failed to route Slack message: %s", e, extra={"incident_id": incident_id})
+            results["errors"].append(f"routing: {e}")
+            channel = SLACK_CHANNEL
+            enhanced_ai_result = ai_result
+
+        blocks = build_blocks(incident, enhanced_ai_result, related)
+        try:
+            resp = await self.slack.chat_postMessage(channel=channel, blocks=blocks, text=f"Incident {incident_id} notification")
+            results["slack_success"] = True
+            results["notifications_sent"] = 1
+
+            await asyncio.gather(
+                async_db.save_slack_message(
+                    incident_id=incident_id,
+                    message_blocks=blocks,
+                    slack_response=resp.data,
+                    team_name=enhanced_ai_result.get('team_assigned'),
+                    incident_type=enhanced_ai_result.get('incident_type'),
+                    incident_summary=incident.get('summary_text', incident.get('summary')),
+                    incident_labels=incident.get('labels'),
+                    incident_service=incident.get('service'),
+                    similarity_data=related,
+                    ai_analysis=enhanced_ai_result
+                ),
+                async_db.insert_audit_log(incident_id, "system", "slack_sent", {
+                    "channel": channel,
+                    "message_ts": resp.get('ts'),
+                    "ok": resp.get('ok', False)
+                })
+            )
+            logger.info("✅ Slack message sent to %s", channel, extra={"incident_id": incident_id})
+        except Exception as e:
+            logger.error("❌ Failed to send Slack message to %s: %s", channel, e, extra={"incident_id": incident_id})
+            results["errors"].append(f"slack: {e}")
+            await async_db.insert_audit_log(incident_id, "system", "slack_failed", {"channel": channel, "error": str(e)})
+        return results
+
+    async def handle_incident_message(self, data):
+        notification_results = None
+        try:
+            incident_id = parse_incident_id(data)
+            if incident_id is None:
+                return
+
+            logger.info("Agent received incident: %s", incident_id, extra={"incident_id": incident_id})
+            # Version 2 messages carry the incident; older ones need the row
+            incident = embedded_incident(data, incident_id) or await async_db.get_incident(incident_id)
+            if not incident:
+                logger.warning("No incident row for id %s", incident_id, extra={"incident_id": incident_id})
+                return
+
+            related = await self.search_similar(incident)
+            ai_result = await self.analyze(incident, related)
+
+            try:
+                await async_db.save_memory_item(incident_id, incident)
+            except Exception as e:
+                logger.warning("⚠️ Failed to save to vector memory: %s", e, extra={"incident_id": incident_id})
+
+            retry = data.get("retry") if isinstance(data, dict) else None
+            if isinstance(retry, dict) and "notified" in retry:
+                logger.info("⏭️ Notifications were sent before the retry, not sending again",
+                            extra={"incident_id": incident_id})
+                notification_results = retry["notified"]
+            else:
+                notification_results = await self.notify(incident, ai_result, related)
+
+            await async_db.update_incident_status(incident_id, "ack")
+            await async_db.insert_audit_log(incident_id, "agent", "acknowledged", {
+                "ai_summary": ai_result.get("summary", ""),
+                "notification_results": notification_results,
+                "notifications_sent": True
+            })
+            if self.retries is not None and retry:
+                # Retried incidents are done: the sweeper may look at them again
+                await asyncio.to_thread(self.retries.resolve, [incident_id])
+            logger.info("✅ Successfully processed incident %s", incident_id, extra={"incident_id": incident_id})
+
+        except Exception as e:
+            logger.exception("❌ Error handling incident message: %s", e,
+                             extra={"incident_id": data.get("incident_id") if isinstance(data, dict) else None})
+            # Don't crash the service: retry the incident later (or dead-letter it)
+            await self.fail(data, e, notification_results)
+
+    async def fail(self, data, exc, notification_results=None):
+        """Hand a failed message to the retry scheduler, remembering notifications already sent"""
+        if self.retries is None or not isinstance(data, dict):
+            return
+        if notification_results is not None:
+            # Notifications already went out: record that, so the retry does not send them again
+            retry = data.get("retry") if isinstance(data.get("retry"), dict) else {}
+            data = {**data, "retry": {**retry, "notified": notification_results}}
+        # The scheduler talks to Redis synchronously
+        await asyncio.to_thread(self.retries.fail, data, exc)
+
+    async def dispatch(self, data):
+        """Start processing a message, waiting while max_in_flight incidents are already running"""
+        await self._slots.acquire()
+        task = asyncio.create_task(self._run(data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        """Wait for every in-flight incident to finish"""
+        if self._tasks:
+            logger.info("⏳ Waiting for %d in-flight incidents...", len(self._tasks))
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self, data):
+        key = data.get("incident_id") if isinstance(data, dict) else None
+        try:
+            if key is None:
+                await self.handle_incident_message(data)
+                return
+
+            lock = self._incident_locks.setdefault(key, asyncio.Lock())
+            self._incident_lock_users[key] = self._incident_lock_users.get(key, 0) + 1
+            try:
+                async with lock:
+                    await self.handle_incident_message(data)
+            finally:
+                self._incident_lock_users[key] -= 1
+                if self._incident_lock_users[key] == 0:
+                    del self._incident_lock_users[key]
+                    del self._incident_locks[key]
+        finally:
+            self._slots.release()
+
+    async def listen(self, redis_conn, channel: str):
+        """Subscribe to the channel and dispatch every message"""
+        pubsub = redis_conn.pubsub()
+        await pubsub.subscribe(channel)
+        logger.info("🎧 Async agent listening on Redis channel %s (pub/sub, max %d in flight)", channel, self.max_in_flight)
+        try:
+            async for item in pubsub.listen():
+                if item["type"] != "message":
+                    continue
+                try:
+                    data = decode_message(item["data"])
+                except Exception as exc:
+                    logger.warning("⚠️ Error decoding message: %s", exc)
+                    continue
+                await self.dispatch(data)
+        finally:
+            await pubsub.close()
+
+
+async def main():
+    logger.info("🚀 Starting async reliability agent...")
+    if UPSTASH_REDIS_REST_URL:
+        logger.warning("⚠️ Upstash REST has no async pub/sub; run the sync agent (python app/agent.py) instead")
+        return
+
+    await async_db.init_async_pool()
+    # Raw bytes: messages may be JSON or msgpack
+    redis_conn = aioredis.from_url(REDIS_URL, decode_responses=False)
+    http = httpx.AsyncClient(
+        timeout=30,
+        limits=httpx.Limits(max_connections=ASYNC_MAX_IN_FLIGHT, max_keepalive_connections=ASYNC_MAX_IN_FLIGHT)
+    )
+    slack = AsyncWebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL)
+    retries = get_retry_scheduler(get_redis_client(), publish_many)
+    if retries is not None:
+        retries.start()
+    agent = AsyncIncidentAgent(http, slack, retries=retries)
+
+    try:
+        await agent.listen(redis_conn, REDIS_CHANNEL)
+    except asyncio.CancelledError:
+        logger.info("🛑 Agent stopped by user")
+    finally:
+        await agent.drain()
+        if retries is not None:
+            retries.stop()
+        await http.aclose()
+        await redis_conn.close()
+        await async_db.close_async_pool()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("🛑 Agent stopped")
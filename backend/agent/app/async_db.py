@@ -0,0 +1,201 @@
+"""
+Asyncio database helpers for the async agent
+
+Mirrors the subset of db.py used on the incident processing path, backed by
+psycopg_pool.AsyncConnectionPool so that hundreds of incidents can wait on
+Postgres without holding a thread each. Row mapping and SQL shared with the
+sync helpers are imported from db.py to keep both paths in step.
+"""
+
+from psycopg_pool import AsyncConnectionPool
+
+# Handle both relative and absolute imports
+try:
+    from .config import DATABASE_URL
+    from . import codec
+    from .db import INCIDENT_COLUMNS, SLACK_MESSAGE_INSERT_SQL, incident_from_row, slack_message_text, memory_item_upsert
+    from .semantic_search import SIMILAR_INCIDENTS_SQL, similar_incidents_params, select_diverse_rows
+    from .structured_logging import get_logger
+except ImportError:
+    from config import DATABASE_URL
+    import codec
+    from db import INCIDENT_COLUMNS, SLACK_MESSAGE_INSERT_SQL, incident_from_row, slack_message_text, memory_item_upsert
+    from semantic_search import SIMILAR_INCIDENTS_SQL, similar_incidents_params, select_diverse_rows
+    from structured_logging import get_logger
+
+logger = get_logger("async_db")
+
+async_pool = None
+
+async def init_async_pool(min_size: int = 1, max_size: int = 20):
+    global async_pool
+    if async_pool is None:
+        try:
+            pool = AsyncConnectionPool(DATABASE_URL, min_size=min_size, max_size=max_size, open=False)
+            await pool.open()
+            async_pool = pool
+            logger.info("Async database connection pool initialized")
+        except Exception as e:
+            logger.error("Error creating async connection pool: %s", e)
+            raise
+    return async_pool
+
+async def close_async_pool():
+    global async_pool
+    if async_pool is not None:
+        try:
+            await async_pool.close()
+            async_pool = None
+            logger.info("Async database connection pool closed")
+        except Exception as e:
+            logger.error("Error closing async connection pool: %s", e)
+
+async def get_incident(incident_id):
+    if not incident_id or not isinstance(incident_id, int):
+        logger.warning("Invalid incident_id: %r", incident_id)
+        return None
+
+    try:
+        async with async_pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"""
+                  SELECT {INCIDENT_COLUMNS}
+                  FROM incidents WHERE id = %s
+                """, (incident_id,))
+                row = await cur.fetchone()
+
+                if not row:
+                    return None
+                return incident_from_row(row)
+    except Exception as e:
+        logger.error("Error fetching incident %s: %s", incident_id, e, extra={"incident_id": incident_id})
+        return None
+
+async def find_similar_by_embedding(query_embedding, limit: int = 3, similarity_threshold: float = 0.5):
+    """pgvector similarity search with diversity filtering (see semantic_search.py)"""
+    async with async_pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(SIMILAR_INCIDENTS_SQL, similar_incidents_params(query_embedding, limit, similarity_threshold))
+            rows = await cur.fetchall()
+    return select_diverse_rows(rows, limit)
+
+async def find_similar_by_service(service, labels, limit: int = 3):
+    """Basic similarity fallback: recent memory items with solutions for the same service or labels"""
+    async with async_pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT id, summary, labels, service, incident_type, solution
+                FROM memory_item
+                WHERE solution IS NOT NULL
+                AND (service = %s OR labels && %s)
+                ORDER BY id DESC
+                LIMIT %s
+            """, (service, labels or [], limit))
+            rows = await cur.fetchall()
+
+    return [{
+        'memory_id': row[0],
+        'summary': row[1],
+        'labels': row[2] or [],
+        'service': row[3],
+        'incident_type': row[4],
+        'solution': row[5],
+        'similarity': 0.6  # Lower similarity for basic match
+    } for row in rows]
+
+async def save_memory_item(incident_id: int, incident: dict):
+    """Save the analysed incident to memory_item without overwriting an existing solution"""
+    await save_memory_items([(incident_id, incident)])
+
+async def save_memory_items(items):
+    """Upsert many (incident_id, incident) pairs in one statement. Returns the rows written."""
+    sql, params, row_count = memory_item_upsert(items)
+    if not row_count:
+        return 0
+
+    async with async_pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+        await conn.commit()
+    return row_count
+
+async def update_incident_status(incident_id, status):
+    if not incident_id or not isinstance(incident_id, int):
+        logger.warning("Invalid incident_id: %r", incident_id)
+        return False
+    if not status or not isinstance(status, str):
+        logger.warning("Invalid status: %r", status)
+        return False
+
+    try:
+        async with async_pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("UPDATE incidents SET status = %s WHERE id = %s", (status, incident_id))
+                await conn.commit()
+                return True
+    except Exception as e:
+        logger.error("Error updating incident %s status: %s", incident_id, e, extra={"incident_id": incident_id})
+        return False
+
+async def insert_audit_log(incident_id, who, action, details=None):
+    if not incident_id or not isinstance(incident_id, int):
+        logger.warning("Invalid incident_id: %r", incident_id)
+        return False
+    if not who or not action:
+        logger.warning("Invalid who/action: %r/%r", who, action)
+        return False
+
+    try:
+        async with async_pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                  INSERT INTO audit_logs (incident_id, who, action, details)
+                  VALUES (%s, %s, %s, %s)
+                """, (incident_id, who, action, codec.dumps(details or {})))
+                await conn.commit()
+                return True
+    except Exception as e:
+        logger.error("Error inserting audit log: %s", e, extra={"incident_id": incident_id})
+        return False
+
+async def save_slack_message(
+    incident_id: int,
+    message_blocks: list,
+    slack_response: dict,
+    team_name: str = None,
+    incident_type: str = None,
+    incident_summary: str = None,
+    incident_labels: list = None,
+    incident_service: str = None,
+    similarity_data: list = None,
+    ai_analysis: dict = None
+):
+    """Async counterpart of db.save_slack_message. Returns the message id or False."""
+    if not incident_id or not message_blocks:
+        logger.warning("⚠️ Missing required parameters for saving Slack message")
+        return False
+
+    try:
+        async with async_pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SLACK_MESSAGE_INSERT_SQL, (
+                    incident_id,
+                    slack_response.get('ts') if slack_response else None,
+                    slack_response.get('channel') if slack_response else None,
+                    team_name,
+                    incident_type,
+                    codec.dumps(message_blocks),
+                    slack_message_text(message_blocks),
+                    incident_summary,
+                    incident_labels or [],
+                    incident_service,
+                    codec.dumps(similarity_data) if similarity_data else None,
+                    codec.dumps(ai_analysis) if ai_analysis else None,
+                    codec.dumps(slack_response) if slack_response else None
+                ))
+                message_id = (await cur.fetchone())[0]
+                await conn.commit()
+                return message_id
+    except Exception as e:
+        logger.exception("❌ Error saving Slack message: %s", e, extra={"incident_id": incident_id})
+        return False
@@ -0,0 +1,267 @@
+"""
+Buffered background writer for audit_logs
+
+audit_logs is the highest-volume table the agent writes: every incident adds
+several rows, and each Slack action adds more. Written inline, each row is
+its own INSERT, pool checkout and commit on the incident's critical path.
+
+With AUDIT_SINK_ENABLED=true, insert_audit_log() hands rows to an AuditSink
+instead. The sink:
+
+1. Buffers rows on a bounded in-memory queue (enqueue never blocks)
+2. Flushes them from a background thread with a single
+   `COPY audit_logs FROM STDIN` once AUDIT_SINK_BATCH_SIZE rows are waiting
+   or AUDIT_SINK_FLUSH_INTERVAL seconds have passed since the first one
+3. Flushes whatever is left on shutdown (close_audit_sink(), or atexit)
+
+When the queue is full, enqueue() returns False and the caller falls back to
+a direct INSERT, so audit rows are not silently dropped under load. When a
+COPY fails, the batch is written again one INSERT per row, so one bad row
+(or a transient error) does not lose the rest.
+"""
+
+import atexit
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Handle both relative and absolute imports
+try:
+    from .config import AUDIT_SINK_ENABLED, AUDIT_SINK_BATCH_SIZE, AUDIT_SINK_FLUSH_INTERVAL, AUDIT_SINK_QUEUE_SIZE
+    from .metrics import timed
+    from .structured_logging import get_logger
+    from . import codec
+except ImportError:
+    from config import AUDIT_SINK_ENABLED, AUDIT_SINK_BATCH_SIZE, AUDIT_SINK_FLUSH_INTERVAL, AUDIT_SINK_QUEUE_SIZE
+    from metrics import timed
+    from structured_logging import get_logger
+    import codec
+
+logger = get_logger("audit_sink")
+
+AUDIT_LOG_COPY_SQL = "COPY audit_logs (incident_id, who, action, details) FROM STDIN"
+
+# Sentinel that wakes the writer thread for shutdown
+_STOP = object()
+
+
+def _copy_rows(rows):
+    """Write rows to audit_logs with one COPY and one commit"""
+    # Imported here: db.insert_audit_log imports this module lazily
+    try:
+        from .db import get_conn
+    except ImportError:
+        from db import get_conn
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            with cur.copy(AUDIT_LOG_COPY_SQL) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        conn.commit()
+
+
+def _insert_row(row):
+    """Write one audit row with its own INSERT and commit"""
+    try:
+        from .db import get_conn, AUDIT_LOG_INSERT_SQL
+    except ImportError:
+        from db import get_conn, AUDIT_LOG_INSERT_SQL
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(AUDIT_LOG_INSERT_SQL, row)
+        conn.commit()
+
+
+class AuditSink:
+    """Bounded queue of audit rows drained by one background COPY writer"""
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 1.0, queue_size: int = 10000,
+                 writer=_copy_rows, row_writer=_insert_row):
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.queue: queue.Queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.writer = writer
+        self.row_writer = row_writer
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+
+        # Also held across the running check and put in enqueue(), so stop() cannot
+        # queue its sentinel ahead of a row that was already accepted
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._rejected = 0
+        self._written = 0
+        self._failed = 0
+        self._flushes = 0
+        self._max_depth = 0
+        self._flush_seconds = 0.0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="audit-sink", daemon=True)
+        self.thread.start()
+        logger.info("🧾 Audit sink started: COPY every %d rows or %ss", self.batch_size, self.flush_interval)
+
+    def enqueue(self, incident_id, who, action, details=None) -> bool:
+        """
+        Queue one audit row. Returns False if the sink is stopped or full,
+        in which case the caller should write the row itself.
+        """
+        row = (incident_id, who, action, codec.dumps(details or {}))
+        with self._lock:
+            if not self.running:
+                return False
+            try:
+                self.queue.put_nowait(row)
+            except queue.Full:
+                self._rejected += 1
+                return False
+            self._enqueued += 1
+            self._max_depth = max(self._max_depth, self.queue.qsize())
+        return True
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """Flush every queued row and stop the writer thread"""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+        # No enqueue() can add rows now, so the sentinel is the last item.
+        # Blocks if the queue is full; the writer is still draining it
+        self.queue.put(_STOP)
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        logger.info("🧾 Audit sink stopped (%d rows written, %d failed)", self._written, self._failed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self._max_depth,
+                "enqueued": self._enqueued,
+                "rejected": self._rejected,
+                "written": self._written,
+                "failed": self._failed,
+                "flushes": self._flushes,
+                "avg_rows_per_flush": round((self._written + self._failed) / self._flushes, 1) if self._flushes else 0.0,
+                "last_flush_ms": self._last_flush_ms,
+                "avg_flush_ms": round(self._flush_seconds / self._flushes * 1000, 1) if self._flushes else 0.0,
+                "max_flush_ms": self._max_flush_ms
+            }
+
+    def print_stats(self):
+        s = self.stats()
+        logger.info("🧾 Audit sink: depth=%d max=%d written=%d failed=%d rejected=%d flushes=%d "
+                    "rows/flush=%s flush=%sms (max %sms)", s['queue_depth'], s['max_queue_depth'], s['written'],
+                    s['failed'], s['rejected'], s['flushes'], s['avg_rows_per_flush'], s['avg_flush_ms'],
+                    s['max_flush_ms'])
+
+    def _run(self):
+        stop = False
+        while not stop:
+            rows = []
+            # Block for the first row, then collect until the batch is full or the interval passes
+            item = self.queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                    # Drain everything queued ahead of shutdown
+                    try:
+                        while True:
+                            rows.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        pass
+                    rows = [row for row in rows if row is not _STOP]
+                    break
+                rows.append(item)
+                if len(rows) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            for start in range(0, len(rows), self.batch_size):
+                self._flush(rows[start:start + self.batch_size])
+
+    def _flush(self, rows):
+        if not rows:
+            return
+        started = time.monotonic()
+        written = len(rows)
+        try:
+            with timed("audit_copy"):
+                self.writer(rows)
+        except Exception as e:
+            logger.warning("⚠️ Audit sink COPY of %d rows failed, inserting them one by one: %s", len(rows), e)
+            written = self._insert_rows(rows)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._flushes += 1
+            self._flush_seconds += elapsed
+            self._last_flush_ms = round(elapsed * 1000, 1)
+            self._max_flush_ms = max(self._max_flush_ms, self._last_flush_ms)
+            self._written += written
+            self._failed += len(rows) - written
+
+    def _insert_rows(self, rows) -> int:
+        """Fallback for a failed COPY: one INSERT per row; returns how many were written"""
+        written = 0
+        for row in rows:
+            try:
+                self.row_writer(row)
+                written += 1
+            except Exception as e:
+                logger.error("❌ Audit sink could not write audit row '%s': %s", row[2], e,
+                             extra={"incident_id": row[0]})
+        return written
+
+
+# Lazy initialization: the sink only starts if enabled and an audit row is written
+_sink = None
+_sink_lock = threading.Lock()
+
+def get_audit_sink() -> Optional[AuditSink]:
+    """The process-wide audit sink, or None when AUDIT_SINK_ENABLED is off"""
+    global _sink
+    if not AUDIT_SINK_ENABLED:
+        return None
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                sink = AuditSink(
+                    batch_size=AUDIT_SINK_BATCH_SIZE,
+                    flush_interval=AUDIT_SINK_FLUSH_INTERVAL,
+                    queue_size=AUDIT_SINK_QUEUE_SIZE
+                )
+                sink.start()
+                atexit.register(close_audit_sink)
+                _sink = sink
+    return _sink
+
+def audit_sink_stats():
+    """Stats of the running sink, or {} when it has not been started"""
+    sink = _sink
+    return sink.stats() if sink is not None else {}
+
+def close_audit_sink():
+    """Flush pending audit rows and stop the writer. Call before closing the DB pool."""
+    global _sink
+    with _sink_lock:
+        if _sink is not None:
+            _sink.stop()
+            _sink.print_stats()
+            _sink = None
@@ -0,0 +1,155 @@
+"""
+Incident storm coalescing
+
+When a service fails, the worker emits many near-identical incidents: same
+evidence.service, same labels. Analysing and posting each one separately
+multiplies LLM spend and floods Slack during exactly the moments people are
+trying to read it.
+
+IncidentCoalescer sits in front of the search/LLM steps and groups incidents
+by (service, label signature). The first incident of a group opens a window
+of COALESCE_WINDOW seconds; every matching incident that arrives before the
+window closes joins the group. When the window closes (or the group reaches
+COALESCE_MAX_GROUP members) the group is emitted as one context:
+
+- the first incident is the leader: it is searched, analysed and notified once
+- ctx["members"] holds every member context, leader included
+- the leader's incident carries "coalesced_ids" so the Slack message lists
+  every member incident id
+
+Later stages write memory, status and audit rows for each member.
+
+Coalescing trades up to one window of latency for the savings, so keep the
+window short (a few seconds).
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Handle both relative and absolute imports
+try:
+    from .structured_logging import get_logger
+except ImportError:
+    from structured_logging import get_logger
+
+logger = get_logger("coalescer")
+
+
+def group_key(incident: Dict[str, Any]) -> tuple:
+    """Incidents with the same service and label set are coalesced together"""
+    evidence = incident.get('evidence')
+    service = evidence.get('service') if isinstance(evidence, dict) else None
+    labels = tuple(sorted(set(incident.get('labels') or [])))
+    return (service or 'unknown', labels)
+
+
+def coalesce_group(members: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Turn member contexts into one group context led by the first member"""
+    leader = members[0]
+    leader["members"] = members
+    if len(members) > 1:
+        # Copy rather than mutate the fetched incident row
+        leader["incident"] = {
+            **leader["incident"],
+            "coalesced_ids": [member["incident_id"] for member in members]
+        }
+    return leader
+
+
+class IncidentCoalescer:
+    """Time-windowed grouping of incident contexts, emitted from a background thread"""
+
+    def __init__(self, emit: Callable[[Dict[str, Any]], Any], window_seconds: float = 5.0,
+                 max_group_size: int = 50):
+        self.emit = emit
+        self.window_seconds = max(0.0, float(window_seconds))
+        self.max_group_size = max(1, int(max_group_size))
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+        self._cond = threading.Condition()
+        self._groups: Dict[tuple, Dict[str, Any]] = {}
+        self._incidents = 0
+        self._emitted_groups = 0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="incident-coalescer", daemon=True)
+        self.thread.start()
+        logger.info("🌪️ Incident coalescing enabled: %ss window, up to %d incidents per group",
+                    self.window_seconds, self.max_group_size)
+
+    def add(self, ctx: Dict[str, Any]):
+        """Add a fetched incident context to its group"""
+        key = group_key(ctx["incident"])
+        full = None
+        with self._cond:
+            self._incidents += 1
+            group = self._groups.get(key)
+            if group is None:
+                group = {"deadline": time.monotonic() + self.window_seconds, "members": []}
+                self._groups[key] = group
+                self._cond.notify()
+            group["members"].append(ctx)
+            if len(group["members"]) >= self.max_group_size:
+                full = self._groups.pop(key)["members"]
+        if full:
+            self._emit(key, full)
+
+    def stop(self):
+        """Emit every open group immediately and stop the timer thread"""
+        if not self.running:
+            return
+        with self._cond:
+            self.running = False
+            pending = list(self._groups.items())
+            self._groups.clear()
+            self._cond.notify()
+        for key, group in pending:
+            self._emit(key, group["members"])
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        logger.info("🌪️ Incident coalescer stopped (%d incidents in %d groups)", self._incidents, self._emitted_groups)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = sum(len(g["members"]) for g in self._groups.values())
+            return {
+                "open_groups": len(self._groups),
+                "pending_incidents": pending,
+                "incidents": self._incidents,
+                "groups": self._emitted_groups,
+                # LLM calls and Slack posts avoided so far
+                "saved_analyses": self._incidents - pending - self._emitted_groups
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self.running:
+                    return
+                now = time.monotonic()
+                due = [key for key, group in self._groups.items() if group["deadline"] <= now]
+                ready = [(key, self._groups.pop(key)["members"]) for key in due]
+                if not ready:
+                    next_deadline = min((g["deadline"] for g in self._groups.values()), default=None)
+                    self._cond.wait(None if next_deadline is None else max(0.0, next_deadline - now))
+                    continue
+            for key, members in ready:
+                self._emit(key, members)
+
+    def _emit(self, key: tuple, members: List[Dict[str, Any]]):
+        with self._cond:
+            self._emitted_groups += 1
+        if len(members) > 1:
+            service, labels = key
+            logger.info("🌪️ Coalesced %d incidents for %s %s: %s", len(members), service, list(labels),
+                        [member['incident_id'] for member in members], extra={"incident_id": members[0]['incident_id']})
+        try:
+            self.emit(coalesce_group(members))
+        except Exception as e:
+            logger.error("❌ Failed to hand off coalesced group %s: %s", [m.get('incident_id') for m in members], e)
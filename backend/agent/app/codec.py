@@ -0,0 +1,53 @@
+"""
+JSON codec shared by Redis messages, JSONB columns and API responses
+
+orjson is used when it is installed (`pip install orjson`): it is several
+times faster than the json module on the large Slack block payloads, produces
+bytes directly and reads bytes without decoding them to str first. Without it
+the stdlib json module is used. Both paths write the same compact JSON
+(no spaces, non-ASCII characters kept as-is), so producers and consumers can
+run with or without orjson.
+
+    dumps(obj)  -> str    for psycopg parameters and str-based APIs
+    dumpb(obj)  -> bytes  for Redis and HTTP responses
+    loads(data)           accepts str, bytes, bytearray or memoryview
+
+Decoding errors are ValueError subclasses on both paths.
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+JSON_BACKEND = "orjson" if ORJSON_AVAILABLE else "json"
+
+# orjson rejects non-str dict keys unless asked; json converts them to str
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if ORJSON_AVAILABLE else 0
+
+
+def dumpb(obj: Any) -> bytes:
+    """Encode obj as UTF-8 JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """Encode obj as a JSON str"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Decode JSON from str or raw bytes (e.g. straight from Redis)"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
@@ -1,4 +1,5 @@
 import os
+import socket
 import sys
 from dotenv import load_dotenv
 load_dotenv()
@@ -38,11 +39,191 @@ EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "all-MiniLM-L6-v2")
 VECTOR_DIM = int(os.getenv("VECTOR_DIM", "384"))
 SLACK_CHANNEL = os.getenv("SLACK_CHANNEL", "#incident-alerts")
 
+# Message transport (redis_client.py): "pubsub" is pub/sub on standard Redis and
+# list polling on Upstash; "list" polls the list REDIS_CHANNEL on either backend
+# (producers LPUSH); "streams" uses the stream "<REDIS_CHANNEL>:stream" with a
+# consumer group, so agents share the messages and nothing published while
+# they are down is lost; "postgres" uses LISTEN/NOTIFY on the channel
+# REDIS_CHANNEL, fed by a trigger on incidents INSERT (pg_notify.py), and needs
+# no Redis at all unless dedupe, retries or the sweeper are enabled
+REDIS_TRANSPORT = os.getenv("REDIS_TRANSPORT", "pubsub").lower()
+STREAM_GROUP = os.getenv("STREAM_GROUP", "reliability-agent")
+# Give each agent process a stable name (e.g. the pod name) so it picks up its own pending messages on restart
+# (also names its processing list with RELIABLE_QUEUE)
+STREAM_CONSUMER = os.getenv("STREAM_CONSUMER", f"{socket.gethostname()}-{os.getpid()}")
+STREAM_BLOCK_MS = int(os.getenv("STREAM_BLOCK_MS", "5000"))  # XREADGROUP block (polled without blocking on Upstash)
+STREAM_READ_COUNT = int(os.getenv("STREAM_READ_COUNT", "50"))  # entries per XREADGROUP
+# Unacknowledged entries idle this long belong to a crashed consumer and are
+# taken over with XAUTOCLAIM; must exceed the worst queueing + processing time
+STREAM_CLAIM_IDLE_MS = int(os.getenv("STREAM_CLAIM_IDLE_MS", "300000"))
+STREAM_MAXLEN = int(os.getenv("STREAM_MAXLEN", "100000"))  # approximate XADD trim (0 = never trim)
+# List polling: pop up to POLL_BATCH_SIZE messages per request. Standard Redis
+# then blocks in BRPOP for up to POLL_BLOCK_SECONDS; Upstash (no blocking over
+# REST) backs off from POLL_IDLE_MIN to POLL_IDLE_MAX seconds with jitter
+POLL_BATCH_SIZE = int(os.getenv("POLL_BATCH_SIZE", "50"))
+POLL_BLOCK_SECONDS = int(os.getenv("POLL_BLOCK_SECONDS", "5"))
+POLL_IDLE_MIN = float(os.getenv("POLL_IDLE_MIN", "0.05"))
+POLL_IDLE_MAX = float(os.getenv("POLL_IDLE_MAX", "2.0"))
+# Reliable list queue: messages are moved to "<REDIS_CHANNEL>:processing:<consumer>"
+# instead of popped, and removed only once handled; entries in flight longer than
+# RELIABLE_VISIBILITY_TIMEOUT seconds are pushed back onto the queue
+RELIABLE_QUEUE = os.getenv("RELIABLE_QUEUE", "false").lower() in ("1", "true", "yes")
+RELIABLE_VISIBILITY_TIMEOUT = float(os.getenv("RELIABLE_VISIBILITY_TIMEOUT", "300"))
+# Most commands sent in one pipeline round-trip (one HTTPS request on Upstash);
+# larger batches are split
+REDIS_PIPELINE_SIZE = int(os.getenv("REDIS_PIPELINE_SIZE", "100"))
+# Postgres LISTEN/NOTIFY transport: after the first notification the listener
+# waits up to PG_NOTIFY_BATCH_WINDOW seconds for more (at most PG_NOTIFY_BATCH_SIZE)
+# and reads the rows of the batch that did not fit in a notification in one query.
+# After a reconnect it re-reads incidents still open created since the connection was
+# lost (at most PG_NOTIFY_CATCHUP_WINDOW seconds back); the first connect replays nothing
+PG_NOTIFY_BATCH_SIZE = int(os.getenv("PG_NOTIFY_BATCH_SIZE", "100"))
+PG_NOTIFY_BATCH_WINDOW = float(os.getenv("PG_NOTIFY_BATCH_WINDOW", "0.05"))
+PG_NOTIFY_CATCHUP_WINDOW = int(os.getenv("PG_NOTIFY_CATCHUP_WINDOW", "3600"))  # seconds (0 = no catch-up)
+PG_NOTIFY_INSTALL_TRIGGER = os.getenv("PG_NOTIFY_INSTALL_TRIGGER", "true").lower() in ("1", "true", "yes")
+# Encoding of published messages: "json", or "msgpack" (needs the msgpack package;
+# pub/sub and plain list transports on standard Redis, JSON is used otherwise).
+# Consumers detect the encoding of each message from its first byte
+MESSAGE_FORMAT = os.getenv("MESSAGE_FORMAT", "json").lower()
+
+# Chat model used for incident analysis
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+
+# Upstream service endpoints (overridable for local stand-ins and benchmarks)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+# Empty (default): the agent runs semantic search in-process. Set to a
+# /semantic-search URL to call a separate FastAPI instance instead.
+SEMANTIC_SEARCH_URL = os.getenv("SEMANTIC_SEARCH_URL", "")
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/")
+
+def _parse_stage_map(value, cast=int):
+    """Parse "fetch=2,analyze=8" into {"fetch": 2, "analyze": 8}"""
+    result = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, count = item.split("=", 1)
+            result[name.strip()] = cast(count)
+    return result
+
+# Shared pooled HTTP client (http_client.py) for OpenAI and search calls
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))  # hosts kept in the pool
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))  # keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))  # idle seconds (HTTP/2 backend)
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Background audit_logs writer (audit_sink.py): rows are buffered and written
+# with COPY off the incident path
+AUDIT_SINK_ENABLED = os.getenv("AUDIT_SINK_ENABLED", "false").lower() in ("1", "true", "yes")
+AUDIT_SINK_BATCH_SIZE = int(os.getenv("AUDIT_SINK_BATCH_SIZE", "500"))
+AUDIT_SINK_FLUSH_INTERVAL = float(os.getenv("AUDIT_SINK_FLUSH_INTERVAL", "1.0"))  # seconds
+AUDIT_SINK_QUEUE_SIZE = int(os.getenv("AUDIT_SINK_QUEUE_SIZE", "10000"))
+
+# Duplicate suppression (dedupe.py): a Redis lease per incident stops two
+# replicas working on the same incident, and a ledger of processed incidents
+# ("redis" or "postgres") turns re-deliveries into no-ops
+DEDUPE_ENABLED = os.getenv("DEDUPE_ENABLED", "true").lower() in ("1", "true", "yes")
+DEDUPE_LEDGER = os.getenv("DEDUPE_LEDGER", "redis").lower()
+DEDUPE_LEASE_MS = int(os.getenv("DEDUPE_LEASE_MS", "300000"))  # renewed between stages; must outlast the slowest one
+DEDUPE_LEDGER_TTL = int(os.getenv("DEDUPE_LEDGER_TTL", "604800"))  # seconds (redis ledger only)
+
+# Retries (retry.py): an incident whose processing raised a transient error is
+# re-published after an exponential, jittered delay (sorted set
+# "<REDIS_CHANNEL>:retry"); permanent errors, and incidents still failing after
+# RETRY_MAX_ATTEMPTS, go to the dead-letter list "<REDIS_CHANNEL>:dead"
+# (inspect and requeue with tests/dead_letters.py)
+RETRY_ENABLED = os.getenv("RETRY_ENABLED", "true").lower() in ("1", "true", "yes")
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "5"))  # seconds before the first retry
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "300"))
+RETRY_POLL_INTERVAL = float(os.getenv("RETRY_POLL_INTERVAL", "1.0"))
+RETRY_BATCH_SIZE = int(os.getenv("RETRY_BATCH_SIZE", "100"))  # due retries re-published per poll
+
+# Missed-incident sweeper (sweeper.py): incidents still "open" SWEEPER_GRACE_PERIOD
+# seconds after they were created (e.g. published on pub/sub while no agent was
+# listening) are re-published on REDIS_CHANNEL, at most SWEEPER_RATE per second.
+# One agent sweeps per SWEEPER_INTERVAL; an incident is re-published at most
+# once per SWEEPER_RESWEEP_AFTER seconds
+SWEEPER_ENABLED = os.getenv("SWEEPER_ENABLED", "true").lower() in ("1", "true", "yes")
+SWEEPER_INTERVAL = float(os.getenv("SWEEPER_INTERVAL", "60"))  # seconds between sweeps
+SWEEPER_GRACE_PERIOD = int(os.getenv("SWEEPER_GRACE_PERIOD", "300"))  # seconds an incident may stay open
+SWEEPER_MAX_AGE = int(os.getenv("SWEEPER_MAX_AGE", "86400"))  # seconds; older open incidents are left alone (0 = no limit)
+SWEEPER_BATCH_SIZE = int(os.getenv("SWEEPER_BATCH_SIZE", "100"))  # rows per query and publish
+SWEEPER_RATE = float(os.getenv("SWEEPER_RATE", "20"))  # incidents re-published per second
+SWEEPER_RESWEEP_AFTER = int(os.getenv("SWEEPER_RESWEEP_AFTER", "3600"))  # seconds
+
+# Incident storm coalescing (coalescer.py): incidents with the same service and
+# labels arriving within COALESCE_WINDOW seconds share one analysis and one
+# Slack post (0 disables)
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0"))
+COALESCE_MAX_GROUP = int(os.getenv("COALESCE_MAX_GROUP", "50"))
+
+# Priority scheduling (priority.py): in staged mode the search and analyze
+# queues serve the highest weighted incident score first, plus
+# PRIORITY_AGING_RATE points per second waited so low scores still progress.
+# AGENT_MODE=staged only: serial and pool modes handle messages in arrival order
+PRIORITY_SCHEDULING = os.getenv("PRIORITY_SCHEDULING", "true").lower() in ("1", "true", "yes")
+PRIORITY_WEIGHTS = _parse_stage_map(os.getenv("PRIORITY_WEIGHTS", "anomaly_score=1.0,confidence=0.5"), cast=float)
+PRIORITY_AGING_RATE = float(os.getenv("PRIORITY_AGING_RATE", "0.01"))
+
+# Load shedding (load_shedder.py): when the backlog or an incident's age passes
+# a limit, low-anomaly incidents take the cheaper SHED_ACTIONS paths
+SHED_ENABLED = os.getenv("SHED_ENABLED", "false").lower() in ("1", "true", "yes")
+SHED_MAX_BACKLOG = int(os.getenv("SHED_MAX_BACKLOG", "50"))  # queued messages
+SHED_MAX_AGE = float(os.getenv("SHED_MAX_AGE", "120"))  # seconds since the message was received
+SHED_ANOMALY_THRESHOLD = float(os.getenv("SHED_ANOMALY_THRESHOLD", "0.7"))  # at or above: never degraded
+SHED_ACTIONS = [a.strip() for a in os.getenv("SHED_ACTIONS", "skip_search,cheap_model,compact_slack").split(",") if a.strip()]
+# Empty: no model swap, cheap_model keeps LLM_MODEL and only trims the prompt and SHED_CHEAP_MAX_TOKENS
+SHED_CHEAP_MODEL = os.getenv("SHED_CHEAP_MODEL", "")
+SHED_CHEAP_MAX_TOKENS = int(os.getenv("SHED_CHEAP_MAX_TOKENS", "150"))
+
+# Agent processing mode: "serial" handles each message inline on the listener,
+# "pool" hands messages to a bounded pool of concurrent workers, "staged" runs
+# each processing step as its own stage with a queue and worker threads
+AGENT_MODE = os.getenv("AGENT_MODE", "serial").lower()
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "4"))
+AGENT_QUEUE_SIZE = int(os.getenv("AGENT_QUEUE_SIZE", "100"))
+# Worker threads per stage in staged mode; the LLM stage runs wide, DB stages narrow
+PIPELINE_CONCURRENCY = {
+    "fetch": 2, "coalesce": 1, "search": 4, "analyze": 8, "memory": 1, "notify": 4, "finalize": 1,
+    **_parse_stage_map(os.getenv("PIPELINE_CONCURRENCY"))
+}
+# Upper bound on incident_ready messages fetched from Postgres in one query when
+# pool or staged workers find a backlog waiting on their queue
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", "50"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))
+# Seconds between stage statistics reports in staged mode (0 disables)
+PIPELINE_STATS_INTERVAL = float(os.getenv("PIPELINE_STATS_INTERVAL", "60"))
+# Maximum incidents in flight at once in the asyncio agent (app/async_agent.py)
+ASYNC_MAX_IN_FLIGHT = int(os.getenv("ASYNC_MAX_IN_FLIGHT", "200"))
+
+# Port for the agent's Prometheus /metrics endpoint (0 disables; needs prometheus_client)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Structured logging (structured_logging.py): records are queued and written by a
+# background thread. LOG_FORMAT is "json" (one object per line) or "text";
+# LOG_LEVELS overrides the level per module ("redis_client=WARNING,db=DEBUG").
+# DEBUG records are sampled (LOG_DEBUG_SAMPLE) and capped at LOG_DEBUG_RATE per
+# second per call site (0 = no cap)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVELS = _parse_stage_map(os.getenv("LOG_LEVELS"), cast=lambda level: level.strip().upper())
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_DEBUG_RATE = float(os.getenv("LOG_DEBUG_RATE", "5"))
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "1.0"))
+
 # Log configuration (excluding secrets)
 print("Configuration loaded:")
 print(f"  DATABASE_URL: {'*' * (len(DATABASE_URL) - 10) + DATABASE_URL[-10:] if DATABASE_URL else 'NOT SET'}")
 print(f"  REDIS_URL: {REDIS_URL}")
 print(f"  REDIS_CHANNEL: {REDIS_CHANNEL}")
+print(f"  REDIS_TRANSPORT: {REDIS_TRANSPORT}" + (f" (group={STREAM_GROUP}, consumer={STREAM_CONSUMER})" if REDIS_TRANSPORT == "streams" else ""))
+if REDIS_TRANSPORT == "postgres":
+    print(f"  PG_NOTIFY: batch={PG_NOTIFY_BATCH_SIZE}/{PG_NOTIFY_BATCH_WINDOW}s, catch-up={PG_NOTIFY_CATCHUP_WINDOW}s, "
+          f"install_trigger={PG_NOTIFY_INSTALL_TRIGGER}")
+if RELIABLE_QUEUE:
+    print(f"  RELIABLE_QUEUE: visibility_timeout={RELIABLE_VISIBILITY_TIMEOUT}s, consumer={STREAM_CONSUMER}")
 print(f"  UPSTASH_REDIS_REST_URL: {'SET' if UPSTASH_REDIS_REST_URL else 'NOT SET'}")
 print(f"  SLACK_CHANNEL: {SLACK_CHANNEL}")
 print(f"  EMBED_MODEL_NAME: {EMBED_MODEL_NAME}")
@@ -50,3 +231,26 @@ print(f"  VECTOR_DIM: {VECTOR_DIM}")
 print(f"  OPENAI_API_KEY: {'SET' if OPENAI_API_KEY else 'NOT SET'}")
 print(f"  SLACK_BOT_TOKEN: {'SET' if SLACK_BOT_TOKEN else 'NOT SET'}")
 print(f"  SLACK_SIGNING_SECRET: {'SET' if SLACK_SIGNING_SECRET else 'NOT SET'}")
+print(f"  LLM_MODEL: {LLM_MODEL}")
+print(f"  OPENAI_BASE_URL: {OPENAI_BASE_URL}")
+print(f"  SEMANTIC_SEARCH_URL: {SEMANTIC_SEARCH_URL or 'in-process'}")
+print(f"  HTTP pool: {HTTP_POOL_CONNECTIONS} hosts x {HTTP_POOL_MAXSIZE} connections, "
+      f"timeouts={HTTP_CONNECT_TIMEOUT}s/{HTTP_READ_TIMEOUT}s, http2={HTTP2_ENABLED}")
+if AUDIT_SINK_ENABLED:
+    print(f"  AUDIT_SINK: batch_size={AUDIT_SINK_BATCH_SIZE}, flush_interval={AUDIT_SINK_FLUSH_INTERVAL}s")
+print(f"  DEDUPE: {'ledger=' + DEDUPE_LEDGER + f', lease={DEDUPE_LEASE_MS}ms' if DEDUPE_ENABLED else 'disabled'}")
+print(f"  RETRY: {f'max_attempts={RETRY_MAX_ATTEMPTS}, delay={RETRY_BASE_DELAY}..{RETRY_MAX_DELAY}s' if RETRY_ENABLED else 'disabled'}")
+print(f"  SWEEPER: {f'every {SWEEPER_INTERVAL}s, grace={SWEEPER_GRACE_PERIOD}s, rate={SWEEPER_RATE}/s' if SWEEPER_ENABLED else 'disabled'}")
+if COALESCE_WINDOW > 0:
+    print(f"  COALESCE: window={COALESCE_WINDOW}s, max_group={COALESCE_MAX_GROUP}")
+if SHED_ENABLED:
+    print(f"  SHED: max_backlog={SHED_MAX_BACKLOG}, max_age={SHED_MAX_AGE}s, actions={SHED_ACTIONS}, cheap_model={SHED_CHEAP_MODEL or LLM_MODEL}")
+print(f"  METRICS_PORT: {METRICS_PORT or 'disabled'}")
+print(f"  LOG: level={LOG_LEVEL}, format={LOG_FORMAT}" + (f", overrides={LOG_LEVELS}" if LOG_LEVELS else ""))
+print(f"  AGENT_MODE: {AGENT_MODE} (workers={AGENT_WORKERS}, queue_size={AGENT_QUEUE_SIZE})")
+if AGENT_MODE == "staged":
+    print(f"  PIPELINE_CONCURRENCY: {PIPELINE_CONCURRENCY} (queue_size={PIPELINE_QUEUE_SIZE})")
+    if PRIORITY_SCHEDULING:
+        print(f"  PRIORITY: weights={PRIORITY_WEIGHTS}, aging={PRIORITY_AGING_RATE}/s")
+elif PRIORITY_SCHEDULING:
+    print(f"  PRIORITY: ignored in {AGENT_MODE} mode (AGENT_MODE=staged only)")
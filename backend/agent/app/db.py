@@ -1,14 +1,27 @@
-import os, json
+import os, re
+from contextlib import contextmanager
+from contextvars import ContextVar
 import psycopg
+from psycopg.types.json import set_json_dumps, set_json_loads
 from psycopg_pool import ConnectionPool
 
 # Handle both relative and absolute imports
 try:
-    from .config import DATABASE_URL
+    from .config import DATABASE_URL, AUDIT_SINK_ENABLED
+    from .metrics import observe
+    from .structured_logging import get_logger
+    from . import codec
 except ImportError:
-    from config import DATABASE_URL
+    from config import DATABASE_URL, AUDIT_SINK_ENABLED
+    from metrics import observe
+    from structured_logging import get_logger
+    import codec
 
-import logging
+logger = get_logger("db")
+
+# JSON/JSONB columns are parsed (and Json() parameters written) with the shared codec
+set_json_loads(codec.loads)
+set_json_dumps(codec.dumps)
 
 # Connection pool for better performance
 connection_pool = None
@@ -22,13 +35,13 @@ def init_connection_pool():
                 min_size=1, 
                 max_size=20
             )
-            print("Database connection pool initialized")
+            logger.info("Database connection pool initialized")
             
             # Create slack_messages table if it doesn't exist
             create_slack_messages_table()
             
         except Exception as e:
-            print(f"Error creating connection pool: {e}")
+            logger.error("Error creating connection pool: %s", e)
             raise
 
 def create_slack_messages_table():
@@ -68,10 +81,10 @@ def create_slack_messages_table():
                 cur.execute("CREATE INDEX IF NOT EXISTS idx_slack_messages_team ON slack_messages(team_name)")
                 
                 conn.commit()
-                print("✅ Slack messages table ensured to exist")
+                logger.info("✅ Slack messages table ensured to exist")
                 
     except Exception as e:
-        print(f"⚠️ Error creating slack_messages table: {e}")
+        logger.warning("⚠️ Error creating slack_messages table: %s", e)
 
 def close_connection_pool():
     global connection_pool
@@ -79,9 +92,9 @@ def close_connection_pool():
         try:
             connection_pool.close()
             connection_pool = None
-            print("Database connection pool closed")
+            logger.info("Database connection pool closed")
         except Exception as e:
-            print(f"Error closing connection pool: {e}")
+            logger.error("Error closing connection pool: %s", e)
 
 def get_conn():
     if connection_pool is None:
@@ -89,52 +102,351 @@ def get_conn():
     try:
         return connection_pool.connection()
     except Exception as e:
-        print(f"Error getting database connection: {e}")
+        logger.error("Error getting database connection: %s", e)
         raise
 
 def return_conn(conn):
     # psycopg-pool connections are context managers, no need to manually close
     pass
 
+def pool_stats():
+    """Connection pool gauges (size, available, waiting requests...) for metrics"""
+    if connection_pool is None:
+        return {}
+    return connection_pool.get_stats()
+
+def create_processed_incidents_table():
+    """Create the processed_incidents ledger used by dedupe.py (DEDUPE_LEDGER=postgres)"""
+    try:
+        with connection_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS processed_incidents (
+                        incident_id INTEGER PRIMARY KEY,
+                        processed_by TEXT,
+                        processed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                    )
+                """)
+                conn.commit()
+                logger.info("✅ Processed incidents ledger ensured to exist")
+                
+    except Exception as e:
+        logger.warning("⚠️ Error creating processed_incidents table: %s", e)
+
+def is_incident_processed(incident_id):
+    """True if the ledger records the incident as fully processed"""
+    with connection_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM processed_incidents WHERE incident_id = %s", (incident_id,))
+            return cur.fetchone() is not None
+
+def mark_incident_processed(incident_id, processed_by=None):
+    """Record the incident in the ledger; re-marking an incident is a no-op"""
+    with connection_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO processed_incidents (incident_id, processed_by)
+                VALUES (%s, %s)
+                ON CONFLICT (incident_id) DO NOTHING
+            """, (incident_id, processed_by))
+            conn.commit()
+
+class UnitOfWork:
+    """
+    Buffered incident writes applied with one pooled connection and one commit
+    
+    While a unit of work is active (see unit_of_work()), update_incident_status,
+    insert_audit_log and save_slack_message queue their statement here instead
+    of checking out a connection and committing on their own.
+    """
+    
+    def __init__(self):
+        self.writes = []
+    
+    def add(self, description, sql, params):
+        self.writes.append((description, sql, params))
+    
+    @observe("unit_of_work_commit", failed=lambda ok: not ok)
+    def commit(self):
+        """Apply every buffered write in a single transaction. Returns True on success."""
+        if not self.writes:
+            return True
+        writes, self.writes = self.writes, []
+        
+        try:
+            with connection_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    for _description, sql, params in writes:
+                        cur.execute(sql, params)
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.warning("Error committing %d buffered write(s), retrying one by one: %s", len(writes), e)
+        
+        # One bad row shouldn't lose the others: fall back to a transaction per write
+        ok = True
+        for description, sql, params in writes:
+            try:
+                with connection_pool.connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(sql, params)
+                    conn.commit()
+            except Exception as e:
+                logger.error("Error applying %s: %s", description, e)
+                ok = False
+        return ok
+
+class UnitOfWorkError(RuntimeError):
+    """Some buffered writes of a unit of work could not be applied"""
+
+_current_unit_of_work = ContextVar("current_unit_of_work", default=None)
+
+@contextmanager
+def unit_of_work(uow=None, commit=True):
+    """
+    Group the incident writes made inside the block into one transaction
+    
+    Args:
+        uow: Existing UnitOfWork to add to (e.g. carried between pipeline stages
+            on different threads); a new one is created if omitted
+        commit: Commit when the block exits normally. Pass False to keep
+            buffering and commit the same UnitOfWork in a later block.
+    
+    Nested blocks join the enclosing unit of work and leave committing to it.
+    Buffered writes are still committed if the block raises, since they record
+    actions (like a sent Slack message) that have already happened.
+    
+    Raises UnitOfWorkError when the commit made on a normal exit leaves any
+    write unapplied, so callers do not carry on as if it was recorded.
+    """
+    outer = _current_unit_of_work.get()
+    if outer is not None and uow is None:
+        yield outer
+        return
+    
+    uow = uow or UnitOfWork()
+    token = _current_unit_of_work.set(uow)
+    try:
+        yield uow
+    except BaseException:
+        uow.commit()
+        raise
+    else:
+        if commit and not uow.commit():
+            raise UnitOfWorkError("some buffered incident writes could not be applied")
+    finally:
+        _current_unit_of_work.reset(token)
+
+INCIDENT_COLUMNS = "id, event_id, labels, summary_text, anomaly_score, confidence, evidence, status, created_at"
+
+def incident_from_row(row):
+    """Convert an incidents row (selected with INCIDENT_COLUMNS) into the agent's incident dict"""
+    return {
+        "id": row[0],
+        "event_id": row[1],
+        "labels": row[2] or [],
+        "summary_text": row[3],
+        "anomaly_score": row[4],
+        "confidence": row[5],
+        "evidence": row[6],
+        "status": row[7],
+        "created_at": row[8].isoformat() if row[8] else None
+    }
+
+@observe("get_incident")
 def get_incident(incident_id):
+    """
+    The incident with this id, or None if there is no such row.
+    Database errors are raised so the incident can be retried later.
+    """
     if not incident_id or not isinstance(incident_id, int):
-        print(f"Invalid incident_id: {incident_id}")
+        logger.warning("Invalid incident_id: %r", incident_id)
         return None
         
     try:
         with connection_pool.connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                  SELECT id, event_id, labels, summary_text, anomaly_score, confidence, evidence, status, created_at
+                cur.execute(f"""
+                  SELECT {INCIDENT_COLUMNS}
                   FROM incidents WHERE id = %s
                 """, (incident_id,))
                 row = cur.fetchone()
                 
                 if not row:
                     return None
-                return {
-                    "id": row[0],
-                    "event_id": row[1],
-                    "labels": row[2] or [],
-                    "summary_text": row[3],
-                    "anomaly_score": row[4],
-                    "confidence": row[5],
-                    "evidence": row[6],
-                    "status": row[7],
-                    "created_at": row[8].isoformat() if row[8] else None
-                }
+                return incident_from_row(row)
+    except Exception as e:
+        logger.error("Error fetching incident %s: %s", incident_id, e, extra={"incident_id": incident_id})
+        raise
+
+@observe("get_incidents", failed=lambda incidents: incidents is None)
+def get_incidents(incident_ids):
+    """
+    Fetch many incidents in one round-trip
+    
+    Args:
+        incident_ids: Iterable of incident IDs; invalid and duplicate IDs are ignored
+    
+    Returns:
+        dict|None: Incident dicts keyed by id (IDs with no row are absent),
+        or None if the query failed
+    """
+    ids = sorted({i for i in incident_ids if isinstance(i, int) and i > 0})
+    if not ids:
+        return {}
+        
+    try:
+        with connection_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                  SELECT {INCIDENT_COLUMNS}
+                  FROM incidents WHERE id = ANY(%s)
+                """, (ids,))
+                return {row[0]: incident_from_row(row) for row in cur.fetchall()}
     except Exception as e:
-        print(f"Error fetching incident {incident_id}: {e}")
+        logger.error("Error fetching %d incidents %s: %s", len(ids), ids[:10], e)
         return None
 
+def create_incident_status_index():
+    """Index the sweeper's query for open incidents by age (see sweeper.py)"""
+    try:
+        with connection_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_incidents_status_created_at ON incidents(status, created_at)")
+                conn.commit()
+                logger.info("✅ Incidents (status, created_at) index ensured to exist")
+                
+    except Exception as e:
+        logger.warning("⚠️ Error creating incidents status index: %s", e)
+
+@observe("get_stale_incidents")
+def get_stale_incidents(grace_seconds, max_age_seconds=0, after=None, limit=100, status="open"):
+    """
+    Incidents still in `status` more than grace_seconds after they were created,
+    oldest first, for the sweeper
+    
+    Args:
+        grace_seconds: Minimum age in seconds
+        max_age_seconds: Maximum age in seconds (0 = no limit)
+        after: Cursor returned by the previous call, to read the next page
+        limit: Maximum number of incidents returned
+    
+    Returns:
+        tuple: (incident dicts, cursor for the next page or None when there are no rows)
+    """
+    conditions = ["status = %s", "created_at < now() - make_interval(secs => %s)"]
+    params = [status, grace_seconds]
+    if max_age_seconds:
+        conditions.append("created_at >= now() - make_interval(secs => %s)")
+        params.append(max_age_seconds)
+    if after is not None:
+        conditions.append("(created_at, id) > (%s, %s)")
+        params.extend(after)
+    params.append(limit)
+    
+    with connection_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+              SELECT {INCIDENT_COLUMNS}
+              FROM incidents
+              WHERE {' AND '.join(conditions)}
+              ORDER BY created_at, id
+              LIMIT %s
+            """, params)
+            rows = cur.fetchall()
+    if not rows:
+        return [], None
+    return [incident_from_row(row) for row in rows], (rows[-1][8], rows[-1][0])
+
+MEMORY_ITEM_COLUMNS = "id, summary, labels, service, incident_type, model, dim, solution"
+
+# Insert or refresh the incident's memory row in one statement. An existing
+# solution (added later from Slack) is never overwritten.
+MEMORY_ITEM_UPSERT_SQL = """
+    INSERT INTO memory_item ({columns})
+    VALUES {values}
+    ON CONFLICT (id) DO UPDATE
+    SET summary = EXCLUDED.summary,
+        labels = EXCLUDED.labels,
+        service = EXCLUDED.service,
+        incident_type = EXCLUDED.incident_type
+"""
+
+def memory_item_values(incident_id, incident):
+    """Column values for an incident's memory_item row (solution starts as null)"""
+    evidence = incident.get('evidence')
+    service = evidence.get('service') if isinstance(evidence, dict) else 'unknown'
+    return (str(incident_id), incident.get('summary', ''), incident.get('labels', []), service,
+            'incident', 'text-embedding-3-small', 1536, None)
+
+def memory_item_upsert(items):
+    """
+    SQL and parameters upserting many incidents in one statement
+    
+    Args:
+        items: Iterable of (incident_id, incident) pairs. When an id appears
+            more than once the last incident wins, since Postgres rejects an
+            ON CONFLICT statement that touches the same row twice.
+    
+    Returns:
+        tuple: (sql, params, row_count)
+    """
+    rows = {}
+    for incident_id, incident in items:
+        rows[str(incident_id)] = memory_item_values(incident_id, incident)
+    
+    placeholder = "(" + ", ".join(["%s"] * len(MEMORY_ITEM_COLUMNS.split(","))) + ")"
+    sql = MEMORY_ITEM_UPSERT_SQL.format(
+        columns=MEMORY_ITEM_COLUMNS,
+        values=", ".join([placeholder] * len(rows))
+    )
+    params = [value for row in rows.values() for value in row]
+    return sql, params, len(rows)
+
+def upsert_memory_item(incident_id, incident):
+    """Insert or update one incident in memory_item, keeping any existing solution"""
+    return upsert_memory_items([(incident_id, incident)]) == 1
+
+@observe("memory_upsert", failed=lambda saved: not saved)
+def upsert_memory_items(items):
+    """
+    Insert or update many incidents in memory_item with a single statement
+    
+    Args:
+        items: Iterable of (incident_id, incident) pairs
+    
+    Returns:
+        int: Number of distinct memory rows written (0 on error)
+    """
+    sql, params, row_count = memory_item_upsert(items)
+    if not row_count:
+        return 0
+        
+    try:
+        with connection_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                conn.commit()
+                return row_count
+    except Exception as e:
+        logger.error("Error upserting %d memory item(s): %s", row_count, e)
+        return 0
+
+@observe("status_update", failed=lambda ok: ok is False)
 def update_incident_status(incident_id, status):
     if not incident_id or not isinstance(incident_id, int):
-        print(f"Invalid incident_id: {incident_id}")
+        logger.warning("Invalid incident_id: %r", incident_id)
         return False
     if not status or not isinstance(status, str):
-        print(f"Invalid status: {status}")
+        logger.warning("Invalid status: %r", status)
         return False
         
+    uow = _current_unit_of_work.get()
+    if uow is not None:
+        uow.add(f"status update for incident {incident_id}",
+                "UPDATE incidents SET status = %s WHERE id = %s", (status, incident_id))
+        return True
+        
     try:
         with connection_pool.connection() as conn:
             with conn.cursor() as cur:
@@ -142,30 +454,76 @@ def update_incident_status(incident_id, status):
                 conn.commit()
                 return True
     except Exception as e:
-        print(f"Error updating incident {incident_id} status: {e}")
+        logger.error("Error updating incident %s status: %s", incident_id, e, extra={"incident_id": incident_id})
         return False
 
+AUDIT_LOG_INSERT_SQL = """
+  INSERT INTO audit_logs (incident_id, who, action, details)
+  VALUES (%s, %s, %s, %s)
+"""
+
+def _audit_sink_enqueue(incident_id, who, action, details):
+    # Imported lazily: audit_sink writes back through get_conn()
+    try:
+        from .audit_sink import get_audit_sink
+    except ImportError:
+        from audit_sink import get_audit_sink
+    sink = get_audit_sink()
+    return sink is not None and sink.enqueue(incident_id, who, action, details)
+
+@observe("audit_write", failed=lambda ok: ok is False)
 def insert_audit_log(incident_id, who, action, details=None):
     if not incident_id or not isinstance(incident_id, int):
-        print(f"Invalid incident_id: {incident_id}")
+        logger.warning("Invalid incident_id: %r", incident_id)
         return False
     if not who or not action:
-        print(f"Invalid who/action: {who}/{action}")
+        logger.warning("Invalid who/action: %r/%r", who, action)
         return False
         
+    # The background COPY writer takes audit rows off the hot path entirely
+    if AUDIT_SINK_ENABLED and _audit_sink_enqueue(incident_id, who, action, details):
+        return True
+        
+    params = (incident_id, who, action, codec.dumps(details or {}))
+    uow = _current_unit_of_work.get()
+    if uow is not None:
+        uow.add(f"audit log '{action}' for incident {incident_id}", AUDIT_LOG_INSERT_SQL, params)
+        return True
+        
     try:
         with connection_pool.connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                  INSERT INTO audit_logs (incident_id, who, action, details)
-                  VALUES (%s, %s, %s, %s)
-                """, (incident_id, who, action, json.dumps(details or {})))
+                cur.execute(AUDIT_LOG_INSERT_SQL, params)
                 conn.commit()
                 return True
     except Exception as e:
-        print(f"Error inserting audit log: {e}")
+        logger.error("Error inserting audit log: %s", e, extra={"incident_id": incident_id})
         return False
 
+SLACK_MESSAGE_INSERT_SQL = """
+    INSERT INTO slack_messages (
+        incident_id, message_ts, channel_id, team_name, incident_type,
+        message_blocks, message_text, incident_summary, incident_labels,
+        incident_service, similarity_data, ai_analysis, slack_response
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING id
+"""
+
+def slack_message_text(message_blocks):
+    """Build a plain text version of Slack blocks with markdown formatting removed"""
+    message_text = ""
+    if message_blocks:
+        for block in message_blocks:
+            if block.get('type') == 'section' and block.get('text'):
+                text_content = block['text'].get('text', '')
+                # Remove Slack markdown formatting for plain text
+                plain_text = re.sub(r'\*([^*]+)\*', r'\1', text_content)  # Remove bold
+                plain_text = re.sub(r'_([^_]+)_', r'\1', plain_text)      # Remove italic
+                plain_text = re.sub(r'`([^`]+)`', r'\1', plain_text)      # Remove code
+                message_text += plain_text + "\n"
+    return message_text.strip()
+
+@observe("slack_message_save", failed=lambda message_id: message_id is False)
 def save_slack_message(
     incident_id: int,
     message_blocks: list,
@@ -194,67 +552,62 @@ def save_slack_message(
         ai_analysis: AI analysis results
     
     Returns:
-        int|bool: Message ID if successful, False otherwise
+        int|bool: Message ID if successful, False otherwise. Inside a
+        unit_of_work() the insert is only queued and True is returned.
     """
     try:
         # Validate required parameters
         if not incident_id or not message_blocks:
-            print(f"⚠️ Missing required parameters for saving Slack message")
+            logger.warning("⚠️ Missing required parameters for saving Slack message")
             return False
             
+        # Extract message metadata from Slack response
+        message_ts = slack_response.get('ts') if slack_response else None
+        channel_id = slack_response.get('channel') if slack_response else None
+        
+        # Create plain text version of the message
+        message_text = slack_message_text(message_blocks)
+        
+        params = (
+            incident_id,
+            message_ts,
+            channel_id,
+            team_name,
+            incident_type,
+            codec.dumps(message_blocks),
+            message_text,
+            incident_summary,
+            incident_labels or [],
+            incident_service,
+            codec.dumps(similarity_data) if similarity_data else None,
+            codec.dumps(ai_analysis) if ai_analysis else None,
+            codec.dumps(slack_response) if slack_response else None
+        )
+        
+        uow = _current_unit_of_work.get()
+        if uow is not None:
+            uow.add(f"Slack message for incident {incident_id}", SLACK_MESSAGE_INSERT_SQL, params)
+            return True
+            
         with connection_pool.connection() as conn:
             with conn.cursor() as cur:
-                # Extract message metadata from Slack response
-                message_ts = slack_response.get('ts') if slack_response else None
-                channel_id = slack_response.get('channel') if slack_response else None
-                
-                # Create plain text version of the message
-                message_text = ""
-                if message_blocks:
-                    for block in message_blocks:
-                        if block.get('type') == 'section' and block.get('text'):
-                            text_content = block['text'].get('text', '')
-                            # Remove Slack markdown formatting for plain text
-                            import re
-                            plain_text = re.sub(r'\*([^*]+)\*', r'\1', text_content)  # Remove bold
-                            plain_text = re.sub(r'_([^_]+)_', r'\1', plain_text)      # Remove italic
-                            plain_text = re.sub(r'`([^`]+)`', r'\1', plain_text)      # Remove code
-                            message_text += plain_text + "\n"
-                
-                cur.execute("""
-                    INSERT INTO slack_messages (
-                        incident_id, message_ts, channel_id, team_name, incident_type,
-                        message_blocks, message_text, incident_summary, incident_labels,
-                        incident_service, similarity_data, ai_analysis, slack_response
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    incident_id,
-                    message_ts,
-                    channel_id,
-                    team_name,
-                    incident_type,
-                    json.dumps(message_blocks),
-                    message_text.strip(),
-                    incident_summary,
-                    incident_labels or [],
-                    incident_service,
-                    json.dumps(similarity_data) if similarity_data else None,
-                    json.dumps(ai_analysis) if ai_analysis else None,
-                    json.dumps(slack_response) if slack_response else None
-                ))
+                cur.execute(SLACK_MESSAGE_INSERT_SQL, params)
                 
                 message_id = cur.fetchone()[0]
                 conn.commit()
-                print(f"✅ Saved Slack message to database with ID: {message_id} for incident {incident_id}")
+                logger.info("✅ Saved Slack message to database with ID: %s", message_id, extra={"incident_id": incident_id})
                 return message_id
                 
     except Exception as e:
-        print(f"❌ Error saving Slack message: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Error saving Slack message: %s", e, extra={"incident_id": incident_id})
         return False
 
+def _json_column(value, default):
+    """JSONB arrives already parsed by psycopg; text values still need decoding"""
+    if not value:
+        return default
+    return codec.loads(value) if isinstance(value, (str, bytes)) else value
+
 def get_slack_messages(incident_id: int = None, limit: int = 50, team_name: str = None):
     """
     Retrieve Slack messages for frontend display
@@ -306,13 +659,13 @@ def get_slack_messages(incident_id: int = None, limit: int = 50, team_name: str
                         'channel_id': row[3],
                         'team_name': row[4],
                         'incident_type': row[5],
-                        'message_blocks': json.loads(row[6]) if row[6] else [],
+                        'message_blocks': _json_column(row[6], []),
                         'message_text': row[7],
                         'incident_summary': row[8],
                         'incident_labels': row[9] or [],
                         'incident_service': row[10],
-                        'similarity_data': json.loads(row[11]) if row[11] else [],
-                        'ai_analysis': json.loads(row[12]) if row[12] else {},
+                        'similarity_data': _json_column(row[11], []),
+                        'ai_analysis': _json_column(row[12], {}),
                         'sent_at': row[13].isoformat() if row[13] else None,
                         'status': row[14]
                     })
@@ -320,5 +673,5 @@ def get_slack_messages(incident_id: int = None, limit: int = 50, team_name: str
                 return messages
                 
     except Exception as e:
-        print(f"❌ Error retrieving Slack messages: {e}")
+        logger.error("❌ Error retrieving Slack messages: %s", e)
         return []
@@ -0,0 +1,214 @@
+"""
+Duplicate suppression for incident processing
+
+The worker may re-publish incident_ready for an incident (retries), and more
+than one agent replica can listen on the same channel. Without a guard each
+delivery re-runs the LLM analysis and posts another Slack message.
+
+IncidentDeduplicator combines two mechanisms:
+
+1. Lease: `SET agent:incident:lease:<id> <token> NX PX <ttl>` so only one
+   consumer works on an incident at a time. The lease is released with a
+   compare-and-delete script, so a consumer whose lease already expired can
+   never delete a lease another consumer has since taken. While the incident
+   moves through its stages the holder renews the lease (renew(), the same
+   compare-and-set), so a slow LLM call does not let it expire mid-processing.
+2. Ledger: once an incident is fully processed it is recorded (a Redis key
+   with a TTL, or the processed_incidents table in Postgres). A later
+   delivery of the same incident is skipped.
+
+The ledger is checked after the lease is taken and written before the lease is
+released, so a duplicate that waits for the lease always sees the result.
+
+If Redis cannot be reached the claim fails open: the incident is processed
+rather than lost.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Optional
+
+# Handle both relative and absolute imports
+try:
+    from .config import DEDUPE_ENABLED, DEDUPE_LEDGER, DEDUPE_LEASE_MS, DEDUPE_LEDGER_TTL
+    from .db import create_processed_incidents_table, is_incident_processed, mark_incident_processed
+    from .structured_logging import get_logger
+except ImportError:
+    from config import DEDUPE_ENABLED, DEDUPE_LEDGER, DEDUPE_LEASE_MS, DEDUPE_LEDGER_TTL
+    from db import create_processed_incidents_table, is_incident_processed, mark_incident_processed
+    from structured_logging import get_logger
+
+logger = get_logger("dedupe")
+
+KEY_PREFIX = "agent:incident"
+
+# Delete the lease only if it still holds our token
+RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Push the lease expiry out only if it still holds our token
+RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Returned by claim() when Redis was unreachable and the incident runs unguarded
+NO_LEASE = ""
+
+
+class RedisLedger:
+    """Processed incidents as Redis keys that expire after ttl_seconds"""
+
+    def __init__(self, redis_client, ttl_seconds: int = 604800):
+        self.redis = redis_client
+        self.ttl_seconds = ttl_seconds
+
+    def is_processed(self, incident_id: int) -> bool:
+        return self.redis.get(f"{KEY_PREFIX}:processed:{incident_id}") is not None
+
+    def mark_processed(self, incident_id: int, processed_by: str, pipe=None):
+        """Record the incident, or with pipe queue the write on that pipeline"""
+        (pipe or self.redis).set(f"{KEY_PREFIX}:processed:{incident_id}", processed_by, ex=self.ttl_seconds)
+
+
+class PostgresLedger:
+    """Processed incidents in the processed_incidents table (kept indefinitely)"""
+
+    def __init__(self):
+        create_processed_incidents_table()
+
+    def is_processed(self, incident_id: int) -> bool:
+        return is_incident_processed(incident_id)
+
+    def mark_processed(self, incident_id: int, processed_by: str):
+        mark_incident_processed(incident_id, processed_by)
+
+
+class IncidentDeduplicator:
+    """Per-incident Redis lease plus a processed-incident ledger"""
+
+    def __init__(self, redis_client, ledger, lease_ms: int = 300000):
+        self.redis = redis_client
+        self.ledger = ledger
+        self.lease_ms = lease_ms
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        # claim() and renew() run on every worker thread
+        self._lock = threading.Lock()
+        self._stats = {"claimed": 0, "duplicates": 0, "already_processed": 0, "unguarded": 0,
+                       "renewed": 0, "lost": 0}
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def claim(self, incident_id: int) -> Optional[str]:
+        """
+        Try to take the incident for processing.
+
+        Returns a lease token to pass to release(), or None if the incident
+        is being processed elsewhere or has already been processed.
+        """
+        key = f"{KEY_PREFIX}:lease:{incident_id}"
+        token = f"{self.owner}:{uuid.uuid4().hex}"
+
+        if not self.redis.set(key, token, px=self.lease_ms, nx=True):
+            holder = self.redis.get(key)
+            if holder is not None:
+                self._count("duplicates")
+                logger.info("🔁 Incident %s is already being processed by %s, skipping", incident_id,
+                            holder.rsplit(':', 1)[0], extra={"incident_id": incident_id})
+                return None
+            # Either the lease just expired or Redis is unavailable: don't drop the incident
+            logger.warning("⚠️ Could not take lease for incident %s, processing without it", incident_id,
+                           extra={"incident_id": incident_id})
+            token = NO_LEASE
+            self._count("unguarded")
+
+        try:
+            processed = self.ledger.is_processed(incident_id)
+        except Exception as e:
+            logger.warning("⚠️ Could not check processed-incident ledger for %s: %s", incident_id, e,
+                           extra={"incident_id": incident_id})
+            processed = False
+
+        if processed:
+            self._count("already_processed")
+            logger.info("🔁 Incident %s was already processed, skipping re-delivery", incident_id,
+                        extra={"incident_id": incident_id})
+            self.release(incident_id, token)
+            return None
+
+        self._count("claimed")
+        return token
+
+    def renew(self, incident_id: int, token: Optional[str]) -> bool:
+        """
+        Extend a lease taken by claim() to lease_ms from now. False if it
+        expired and another consumer may have taken the incident meanwhile.
+        """
+        if not token:
+            # Unguarded (NO_LEASE): there is nothing to extend
+            return True
+        renewed = self.redis.eval(RENEW_LEASE_SCRIPT, [f"{KEY_PREFIX}:lease:{incident_id}"], [token, self.lease_ms])
+        if renewed is None:
+            # Redis unavailable: keep going, as claim() does
+            return True
+        if not renewed:
+            self._count("lost")
+            logger.warning("⚠️ Lease for incident %s expired during processing (DEDUPE_LEASE_MS=%d too short?)",
+                           incident_id, self.lease_ms, extra={"incident_id": incident_id})
+            return False
+        self._count("renewed")
+        return True
+
+    def release(self, incident_id: int, token: Optional[str], processed: bool = False):
+        """
+        Give up the lease. With processed=True the incident is recorded in the
+        ledger first, so later deliveries are skipped; otherwise it can be retried.
+        """
+        if processed and token and isinstance(self.ledger, RedisLedger):
+            # Ledger write and lease release in one round-trip, in that order
+            pipe = self.redis.pipeline()
+            self.ledger.mark_processed(incident_id, f"{self.owner}@{int(time.time())}", pipe=pipe)
+            pipe.eval(RELEASE_LEASE_SCRIPT, [f"{KEY_PREFIX}:lease:{incident_id}"], [token])
+            ledger_result, _ = pipe.execute()
+            if ledger_result is not True:
+                logger.error("❌ Could not record incident %s as processed: %s", incident_id, ledger_result,
+                             extra={"incident_id": incident_id})
+            return
+
+        if processed:
+            try:
+                self.ledger.mark_processed(incident_id, f"{self.owner}@{int(time.time())}")
+            except Exception as e:
+                logger.error("❌ Could not record incident %s as processed: %s", incident_id, e,
+                             extra={"incident_id": incident_id})
+
+        if token:
+            self.redis.eval(RELEASE_LEASE_SCRIPT, [f"{KEY_PREFIX}:lease:{incident_id}"], [token])
+
+
+def get_deduplicator(redis_client) -> Optional[IncidentDeduplicator]:
+    """Build the deduplicator from config, or None when DEDUPE_ENABLED is off"""
+    if not DEDUPE_ENABLED:
+        return None
+
+    if DEDUPE_LEDGER == "postgres":
+        ledger = PostgresLedger()
+    else:
+        ledger = RedisLedger(redis_client, ttl_seconds=DEDUPE_LEDGER_TTL)
+    logger.info("🛡️ Duplicate suppression enabled (%s ledger, %dms lease)", DEDUPE_LEDGER, DEDUPE_LEASE_MS)
+    return IncidentDeduplicator(redis_client, ledger, lease_ms=DEDUPE_LEASE_MS)
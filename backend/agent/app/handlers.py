@@ -1,10 +1,21 @@
-from fastapi import FastAPI, Request, Header, HTTPException
+from fastapi import FastAPI, Request, Header, HTTPException, Response
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from slack_sdk.signature import SignatureVerifier
 import json
 from .config import SLACK_SIGNING_SECRET
 from .db import update_incident_status, insert_audit_log, get_conn, return_conn, connection_pool, init_connection_pool
+from .semantic_search import search_similar_incidents, EMBEDDING_MODEL
+from .metrics import latest_metrics, register_stats, CONTENT_TYPE_LATEST
+from . import codec
 
-app = FastAPI()
+class CodecJSONResponse(JSONResponse):
+    """JSONResponse rendered with the shared codec (orjson when installed)"""
+
+    def render(self, content) -> bytes:
+        return codec.dumpb(content)
+
+app = FastAPI(default_response_class=CodecJSONResponse)
 
 @app.on_event("startup")
 async def startup_event():
@@ -13,50 +24,19 @@ async def startup_event():
     try:
         init_connection_pool()
         print("✅ Database connection pool initialized successfully")
+        from .db import pool_stats
+        from .audit_sink import audit_sink_stats
+        register_stats("db_pool", "psycopg connection pool statistics", pool_stats)
+        register_stats("audit_sink", "Background audit writer statistics", audit_sink_stats)
     except Exception as e:
         print(f"❌ Failed to initialize database connection pool: {e}")
         raise
 
-def _extract_diversity_key(summary, service):
-    """Extract diversity key based on incident patterns."""
-    if summary and service:
-        # For SQL injection, look for different types
-        if "sql" in summary.lower() or "injection" in summary.lower():
-            if "union" in summary.lower():
-                return f"{service}_sql_union"
-            elif "blind" in summary.lower():
-                return f"{service}_sql_blind"
-            elif "time" in summary.lower() or "delay" in summary.lower():
-                return f"{service}_sql_time"
-            else:
-                return f"{service}_sql_generic"
-        
-        # For other incidents, use service + key terms
-        key_terms = ["auth", "permission", "timeout", "error", "crash", "memory", "performance"]
-        for term in key_terms:
-            if term in summary.lower():
-                return f"{service}_{term}"
-    
-    return f"{service or 'unknown'}_general"
-
-def _filter_diverse_results(incidents, max_per_key=1):
-    """Filter incidents to ensure diversity in patterns."""
-    diversity_map = {}
-    filtered_results = []
-    
-    for incident in incidents:
-        summary = incident.get('summary', '')
-        service = incident.get('service', '')
-        diversity_key = _extract_diversity_key(summary, service)
-        
-        if diversity_key not in diversity_map:
-            diversity_map[diversity_key] = 0
-        
-        if diversity_map[diversity_key] < max_per_key:
-            filtered_results.append(incident)
-            diversity_map[diversity_key] += 1
-    
-    return filtered_results
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush buffered audit rows before the process exits"""
+    from .audit_sink import close_audit_sink
+    close_audit_sink()
 
 verifier = SignatureVerifier(SLACK_SIGNING_SECRET)
 
@@ -78,7 +58,7 @@ async def slack_actions(request: Request, x_slack_signature: str = Header(None),
         if not payload_raw:
             raise HTTPException(status_code=400, detail="Missing payload")
             
-        payload = json.loads(payload_raw)
+        payload = codec.loads(payload_raw)
         
         # Validate payload structure
         if "actions" not in payload or not payload["actions"]:
@@ -171,7 +151,7 @@ async def slack_actions(request: Request, x_slack_signature: str = Header(None),
 async def update_solution(incident_id: int, request: Request):
     """Update solution for a specific incident"""
     try:
-        body = await request.json()
+        body = codec.loads(await request.body())
         solution = body.get("solution", "").strip()
         user = body.get("user", "unknown")
         
@@ -311,6 +291,26 @@ async def health_check():
             "message": f"Database connection failed: {str(e)}"
         }
 
+@app.get("/http/stats")
+async def http_stats():
+    """Per-host request counts and connection reuse for outbound API calls"""
+    from .http_client import get_http_client
+    return {"status": "success", "hosts": get_http_client().connection_stats()}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint (operation latencies, LLM tokens, pool gauges)"""
+    return Response(latest_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/audit/stats")
+async def audit_stats():
+    """Queue depth and flush latency of the background audit writer"""
+    from .audit_sink import get_audit_sink
+    sink = get_audit_sink()
+    if sink is None:
+        return {"status": "disabled"}
+    return {"status": "success", **sink.stats()}
+
 @app.post("/semantic-search")
 async def semantic_search(request: Request):
     """
@@ -321,7 +321,7 @@ async def semantic_search(request: Request):
     4. Returns top results with solutions
     """
     try:
-        body = await request.json()
+        body = codec.loads(await request.body())
         query_text = body.get("query", body.get("summary", "")).strip()
         limit = body.get("limit", 3)
         similarity_threshold = body.get("similarity_threshold", body.get("threshold", 0.7))
@@ -329,105 +329,27 @@ async def semantic_search(request: Request):
         if not query_text:
             raise HTTPException(status_code=400, detail="Query text is required")
 
-        # Get OpenAI embedding for the query
-        from .llm_client import get_openai_client
-        import requests as req
-        
-        client = get_openai_client()
-        if not hasattr(client, 'api_key'):
-            raise HTTPException(status_code=500, detail="OpenAI client not properly configured")
-        
-        # Get embedding
-        headers = {
-            "Authorization": f"Bearer {client.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "input": query_text,
-            "model": "text-embedding-3-small"
+        # Embedding + pgvector query block, so keep them off the event loop
+        results = await run_in_threadpool(search_similar_incidents, query_text, limit, similarity_threshold)
+
+        return {
+            "status": "success",
+            "query": query_text,
+            "incidents": results,
+            "total_found": len(results),
+            "query_embedding_generated": True,
+            "search_threshold": similarity_threshold,
+            "diversity_filtering_applied": True,
+            "search_params": {
+                "similarity_threshold": similarity_threshold,
+                "limit": limit,
+                "embedding_model": EMBEDDING_MODEL,
+                "diversity_enabled": True
+            }
         }
         
-        response = req.post(
-            "https://api.openai.com/v1/embeddings",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Embedding API error: {response.text}")
-        
-        embedding_result = response.json()
-        query_embedding = embedding_result['data'][0]['embedding']
-        
-        # Search similar incidents using pgvector based on summary similarity
-        from .db import connection_pool
-        
-        if connection_pool is None:
-            raise HTTPException(status_code=500, detail="Database connection pool not initialized")
-            
-        with connection_pool.connection() as conn:
-            with conn.cursor() as cursor:
-                # Get more results initially to enable diversity filtering
-                initial_limit = limit * 3  # Get three times as many results for diversity
-                
-                cursor.execute("""
-                    SELECT id, summary, labels, service, incident_type, solution,
-                           1 - (embedding <=> %s::vector) as similarity
-                    FROM memory_item 
-                    WHERE embedding IS NOT NULL
-                    AND 1 - (embedding <=> %s::vector) > %s
-                    ORDER BY embedding <=> %s::vector
-                    LIMIT %s
-                """, (query_embedding, query_embedding, similarity_threshold, query_embedding, initial_limit))
-                
-                all_rows = cursor.fetchall()
-                
-                # Apply diversity filtering to get varied results
-                results = []
-                used_patterns = set()
-                
-                for row in all_rows:
-                    if len(results) >= limit:
-                        break
-                        
-                    summary = row[1] or ""
-                    service = row[3] or "unknown"
-                    
-                    # Create a diversity key based on service and summary patterns
-                    diversity_key = _extract_diversity_key(summary, service)
-                    
-                    # If we haven't seen this pattern type yet, or if we have few results, include it
-                    if diversity_key not in used_patterns or len(results) < limit // 2:
-                        results.append({
-                            'incident_id': row[0],
-                            'summary': summary,
-                            'labels': row[2] or [],
-                            'service': service,
-                            'incident_type': row[4] or "incident",
-                            'solution': row[5],
-                            'similarity': round(row[6], 3),
-                            'has_solution': bool(row[5] and row[5].strip())
-                        })
-                        used_patterns.add(diversity_key)
-                
-                return {
-                    "status": "success",
-                    "query": query_text,
-                    "incidents": results,
-                    "total_found": len(results),
-                    "query_embedding_generated": True,
-                    "search_threshold": similarity_threshold,
-                    "diversity_filtering_applied": True,
-                    "search_params": {
-                        "similarity_threshold": similarity_threshold,
-                        "limit": limit,
-                        "embedding_model": "text-embedding-3-small",
-                        "diversity_enabled": True
-                    }
-                }
-            
+    except HTTPException:
+        raise
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON")
     except Exception as e:
@@ -463,7 +385,7 @@ async def slack_actions(request: Request, x_slack_signature: str = Header(None),
         if not payload_str:
             raise HTTPException(status_code=400, detail="No payload found")
         
-        payload = json.loads(payload_str)
+        payload = codec.loads(payload_str)
         
         # Extract action information
         action = payload.get('actions', [{}])[0]
@@ -539,7 +461,7 @@ async def test_notifications_endpoint(request: Request):
     Test endpoint for the notification routing system
     """
     try:
-        body = await request.json()
+        body = codec.loads(await request.body())
         incident_type = body.get("incident_type", "xss")
         
         # Import the test function
@@ -0,0 +1,193 @@
+"""
+Shared HTTP client for outbound API calls
+
+Bare requests.post() opens a new TCP (and TLS) connection for every call.
+All outbound calls on the incident path (OpenAI chat completions, OpenAI
+embeddings and the remote semantic search endpoint) go through one pooled
+client instead, so connections to each host are kept alive and reused.
+
+Two backends are available:
+1. requests.Session with a sized urllib3 connection pool (default)
+2. httpx.Client with HTTP/2 (HTTP2_ENABLED=true, needs `pip install httpx[http2]`)
+
+connection_stats() reports, per host, how many requests were sent and how
+many new connections had to be opened to serve them.
+"""
+
+import socket
+import threading
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+# Handle both relative and absolute imports
+try:
+    from .config import (
+        HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+        HTTP_KEEPALIVE_EXPIRY, HTTP2_ENABLED
+    )
+    from .structured_logging import get_logger
+except ImportError:
+    from config import (
+        HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+        HTTP_KEEPALIVE_EXPIRY, HTTP2_ENABLED
+    )
+    from structured_logging import get_logger
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+logger = get_logger("http_client")
+
+# Enable TCP keepalive so idle pooled connections are not silently dropped by NAT/load balancers
+_KEEPALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled sockets have TCP keepalive enabled"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = _KEEPALIVE_SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
+class PooledHTTPClient:
+    """
+    Thread-safe HTTP client with persistent, pooled connections.
+
+    post()/get() accept the same keyword arguments as requests (headers,
+    json, params, timeout) and return a response with status_code, text
+    and json() on either backend.
+    """
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 20,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 keepalive_expiry: float = 60.0, http2: bool = False):
+        self.timeout = (connect_timeout, read_timeout)
+        self.http2 = bool(http2 and HTTPX_AVAILABLE)
+        self._lock = threading.Lock()
+        self._requests_by_host: Dict[str, int] = {}
+        self._http2_by_host: Dict[str, int] = {}
+
+        if http2 and not HTTPX_AVAILABLE:
+            logger.warning("⚠️ HTTP2_ENABLED is set but httpx is not installed; using HTTP/1.1 keep-alive")
+
+        self._adapters = []
+        if self.http2:
+            try:
+                self._client = httpx.Client(
+                    http2=True,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                    limits=httpx.Limits(
+                        max_connections=pool_connections * pool_maxsize,
+                        max_keepalive_connections=pool_maxsize,
+                        keepalive_expiry=keepalive_expiry
+                    )
+                )
+            except ImportError:
+                # httpx raises ImportError when the h2 package is missing
+                logger.warning("⚠️ HTTP2_ENABLED is set but the h2 package is not installed; using HTTP/1.1 keep-alive")
+                self.http2 = False
+        if not self.http2:
+            self._client = requests.Session()
+            adapter = _KeepAliveAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+            self._client.mount("https://", adapter)
+            self._client.mount("http://", adapter)
+            self._adapters = [adapter]
+
+    def request(self, method: str, url: str, **kwargs) -> Any:
+        timeout = kwargs.pop("timeout", None) or self.timeout
+        if self.http2 and isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+
+        host = self._host_of(url)
+        with self._lock:
+            self._requests_by_host[host] = self._requests_by_host.get(host, 0) + 1
+        response = self._client.request(method, url, timeout=timeout, **kwargs)
+        if self.http2 and response.http_version == "HTTP/2":
+            with self._lock:
+                self._http2_by_host[host] = self._http2_by_host.get(host, 0) + 1
+        return response
+
+    def post(self, url: str, **kwargs) -> Any:
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> Any:
+        return self.request("GET", url, **kwargs)
+
+    def connection_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Per-host request and connection counts.
+
+        new_connections is how many TCP connections were opened for the host;
+        reuse_ratio is the share of requests served on an existing connection.
+        The httpx backend does not expose connection counts; it reports how
+        many responses were multiplexed over HTTP/2 instead.
+        """
+        with self._lock:
+            requests_by_host = dict(self._requests_by_host)
+            http2_by_host = dict(self._http2_by_host)
+
+        stats = {}
+        for host, sent in requests_by_host.items():
+            entry = {"requests": sent}
+            if self._adapters:
+                pool = self._adapters[0].poolmanager.connection_from_url(host)
+                entry["new_connections"] = pool.num_connections
+                entry["reuse_ratio"] = round(1 - pool.num_connections / sent, 3) if sent else 0.0
+            else:
+                entry["http2_responses"] = http2_by_host.get(host, 0)
+            stats[host] = entry
+        return stats
+
+    def print_connection_stats(self):
+        stats = self.connection_stats()
+        if not stats:
+            return
+        logger.info("🔗 HTTP connection reuse (%s):", 'HTTP/2' if self.http2 else 'HTTP/1.1 keep-alive')
+        for host, entry in stats.items():
+            details = ", ".join(f"{key}={value}" for key, value in entry.items())
+            logger.info("   %s: %s", host, details)
+
+    def close(self):
+        self._client.close()
+
+    @staticmethod
+    def _host_of(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+
+# Lazy initialization of the shared client
+_client = None
+_client_lock = threading.Lock()
+
+def get_http_client() -> PooledHTTPClient:
+    """Get the process-wide pooled HTTP client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PooledHTTPClient(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    connect_timeout=HTTP_CONNECT_TIMEOUT,
+                    read_timeout=HTTP_READ_TIMEOUT,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                    http2=HTTP2_ENABLED
+                )
+    return _client
+
+def close_http_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.print_connection_stats()
+            _client.close()
+            _client = None
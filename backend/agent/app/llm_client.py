@@ -1,22 +1,31 @@
 import os, json
-import requests
 # Handle both relative and absolute imports
 try:
-    from .config import OPENAI_API_KEY
+    from .config import OPENAI_API_KEY, OPENAI_BASE_URL, LLM_MODEL
+    from .http_client import get_http_client
+    from .metrics import timed, record_llm_usage
+    from .retry import TransientError, PermanentError
+    from .structured_logging import get_logger
 except ImportError:
-    from config import OPENAI_API_KEY
+    from config import OPENAI_API_KEY, OPENAI_BASE_URL, LLM_MODEL
+    from http_client import get_http_client
+    from metrics import timed, record_llm_usage
+    from retry import TransientError, PermanentError
+    from structured_logging import get_logger
 try:
     from .prompt_templates import SUMMARY_PROMPT
 except ImportError:
     from prompt_templates import SUMMARY_PROMPT
 
+logger = get_logger("llm_client")
+
 # Lazy initialization of OpenAI client
 _client = None
 
 def get_openai_client():
     global _client
     if _client is None:
-        print("🤖 Initializing OpenAI client...")
+        logger.info("🤖 Initializing OpenAI client...")
         try:
             # Create a custom OpenAI client for compatibility
             class SimpleOpenAIClient:
@@ -30,105 +39,121 @@ def get_openai_client():
                     }
                     
                     data = {
-                        "model": kwargs.get("model", "gpt-4o-mini"),
+                        "model": kwargs.get("model", LLM_MODEL),
                         "messages": kwargs.get("messages", []),
                         "temperature": kwargs.get("temperature", 0.0),
                         "max_tokens": kwargs.get("max_tokens", 400)
                     }
                     
-                    response = requests.post(
-                        "https://api.openai.com/v1/chat/completions",
+                    response = get_http_client().post(
+                        f"{OPENAI_BASE_URL}/chat/completions",
                         headers=headers,
-                        json=data,
-                        timeout=30
+                        json=data
                     )
                     
                     if response.status_code == 200:
                         return response.json()
-                    else:
-                        raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
+                    # Timeouts, rate limits and server errors may pass; other rejections will not
+                    transient = response.status_code in (408, 429) or response.status_code >= 500
+                    error = TransientError if transient else PermanentError
+                    raise error(f"OpenAI API error: {response.status_code} - {response.text[:500]}")
             
             _client = SimpleOpenAIClient(OPENAI_API_KEY)
-            print("✅ OpenAI client initialized (custom client)")
+            logger.info("✅ OpenAI client initialized (custom client)")
             
         except Exception as e:
-            print(f"❌ OpenAI client initialization failed: {e}")
+            logger.error("❌ OpenAI client initialization failed: %s", e)
             raise e
     return _client
 
-def ask_llm(incident: dict, related_items: list):
+def build_analysis_prompt(incident: dict, related_items: list) -> str:
+    """Render SUMMARY_PROMPT for an incident and its similar past incidents"""
+    related_text = ""
+    if related_items and isinstance(related_items, list):
+        for it in related_items:
+            if isinstance(it, dict):
+                similarity = it.get('similarity', 0)
+                summary = (it.get('summary') or '')[:200]
+                service = it.get('service', 'unknown')
+                labels = it.get('labels', [])
+                
+                # Include solutions from similar incidents
+                solution = it.get('solution', '')
+                
+                related_text += f"• Similar incident (similarity: {similarity})\n"
+                related_text += f"  Service: {service} | Summary: {summary}\n"
+                related_text += f"  Labels: {labels}\n"
+                
+                if solution:
+                    related_text += f"  Solution: {solution}\n"
+                else:
+                    related_text += f"  Solution: Not provided yet\n"
+                related_text += "\n"
+    
+    return SUMMARY_PROMPT.format(
+        service = incident.get("evidence", {}).get("service") if isinstance(incident.get("evidence"), dict) else "unknown",
+        timestamp = incident.get("created_at") or "",
+        labels = incident.get("labels") or [],
+        summary = incident.get("summary_text") or "",
+        evidence = str(incident.get("evidence", "")) if incident.get("evidence") else "",
+        related_list = related_text or "None"
+    )
+
+def parse_analysis_response(text: str) -> dict:
+    """Extract the JSON analysis from the model output, tolerating surrounding prose"""
     try:
-        related_text = ""
-        if related_items and isinstance(related_items, list):
-            for it in related_items:
-                if isinstance(it, dict):
-                    similarity = it.get('similarity', 0)
-                    summary = (it.get('summary') or '')[:200]
-                    service = it.get('service', 'unknown')
-                    labels = it.get('labels', [])
-                    
-                    # Include solutions from similar incidents
-                    solution = it.get('solution', '')
-                    
-                    related_text += f"• Similar incident (similarity: {similarity})\n"
-                    related_text += f"  Service: {service} | Summary: {summary}\n"
-                    related_text += f"  Labels: {labels}\n"
-                    
-                    if solution:
-                        related_text += f"  Solution: {solution}\n"
-                    else:
-                        related_text += f"  Solution: Not provided yet\n"
-                    related_text += "\n"
-        
-        prompt = SUMMARY_PROMPT.format(
-            service = incident.get("evidence", {}).get("service") if isinstance(incident.get("evidence"), dict) else "unknown",
-            timestamp = incident.get("created_at") or "",
-            labels = incident.get("labels") or [],
-            summary = incident.get("summary_text") or "",
-            evidence = str(incident.get("evidence", "")) if incident.get("evidence") else "",
-            related_list = related_text or "None"
-        )
-        
-        client = get_openai_client()
-        
-        # Make API call with proper error handling
-        try:
-            # Use custom client
+        start = text.find("{")
+        end = text.rfind("}")+1
+        json_text = text[start:end]
+        return json.loads(json_text)
+    except Exception:
+        return {"summary": text[:400], "root_causes": [], "confidence": "low"}
+
+def fallback_analysis(incident: dict) -> dict:
+    """Analysis the asyncio agent posts when the OpenAI API call fails"""
+    return {
+        "summary": f"Analysis failed for incident: {incident.get('summary_text', 'Unknown')[:100]}. Manual review required.",
+        "root_causes": [
+            {
+                "cause": "Automated analysis unavailable",
+                "fixes": ["Manual incident review required", "Check system logs", "Contact on-call engineer"],
+                "rollback": "No automatic fixes available"
+            }
+        ],
+        "confidence": "low"
+    }
+
+def skipped_analysis(incident: dict, reason: str) -> dict:
+    """Analysis recorded when the LLM call is deliberately skipped (e.g. load shedding)"""
+    return {
+        "summary": f"{(incident.get('summary_text') or 'Unknown incident')[:200]} (automated analysis skipped: {reason})",
+        "root_causes": [],
+        "confidence": "low"
+    }
+
+def ask_llm(incident: dict, related_items: list, model: str = None, max_tokens: int = 400):
+    """
+    Analyse the incident with the chat model.
+
+    API failures are raised (TransientError for rate limits and server errors,
+    PermanentError for other rejections, connection errors as they are) so the
+    incident is retried rather than posted with a canned analysis.
+    """
+    prompt = build_analysis_prompt(incident, related_items)
+    client = get_openai_client()
+    
+    try:
+        with timed("ask_llm"):
             response = client.chat_completions_create(
-                model="gpt-4o-mini",
+                model=model or LLM_MODEL,
                 messages=[{"role":"user","content":prompt}],
                 temperature=0.0,
-                max_tokens=400
+                max_tokens=max_tokens
             )
-            text = response['choices'][0]['message']['content'].strip()
-            
-        except Exception as api_error:
-            print(f"❌ OpenAI API call failed: {api_error}")
-            # Return a meaningful fallback response
-            return {
-                "summary": f"Analysis failed for incident: {incident.get('summary_text', 'Unknown')[:100]}. Manual review required.",
-                "root_causes": [
-                    {
-                        "cause": "Automated analysis unavailable",
-                        "fixes": ["Manual incident review required", "Check system logs", "Contact on-call engineer"],
-                        "rollback": "No automatic fixes available"
-                    }
-                ],
-                "confidence": "low"
-            }
-        
-        try:
-            start = text.find("{")
-            end = text.rfind("}")+1
-            json_text = text[start:end]
-            return json.loads(json_text)
-        except Exception:
-            return {"summary": text[:400], "root_causes": [], "confidence": "low"}
+    except Exception as api_error:
+        logger.error("❌ OpenAI API call failed: %s", api_error)
+        raise
     
-    except Exception as e:
-        print(f"Error calling OpenAI API: {e}")
-        return {
-            "summary": f"Error analyzing incident: {incident.get('summary_text', 'Unknown incident')}", 
-            "root_causes": [], 
-            "confidence": "low"
-        }
\ No newline at end of file
+    record_llm_usage(model or LLM_MODEL, response.get('usage'))
+    text = response['choices'][0]['message']['content'].strip()
+    return parse_analysis_response(text)
@@ -0,0 +1,135 @@
+"""
+Load shedding: degrade on purpose when the agent falls behind
+
+When OpenAI slows down or an outage floods the channel, a backlog builds up
+and every incident, important or not, waits longer and longer. LoadShedder
+decides, per incident, whether to take cheaper paths so the backlog drains
+and incidents that matter keep a bounded end-to-end latency.
+
+The agent is overloaded when either
+- the backlog (messages queued in the worker pool or pipeline) reaches
+  SHED_MAX_BACKLOG, or
+- the incident has already waited SHED_MAX_AGE seconds since it was received.
+
+While overloaded, incidents below SHED_ANOMALY_THRESHOLD get every action in
+SHED_ACTIONS:
+
+    skip_search     no embedding call or pgvector query
+    cheap_model     short LLM pass (SHED_CHEAP_MAX_TOKENS) without similar incidents,
+                    on SHED_CHEAP_MODEL if set, else on LLM_MODEL
+    no_llm          no LLM call at all (takes precedence over cheap_model)
+    compact_slack   a short Slack message without root causes or similar incidents
+
+Incidents at or above the threshold keep the full analysis; they only skip
+semantic search once they are themselves older than SHED_MAX_AGE.
+
+Every decision is returned as a dict that the agent records in audit_logs.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+# Handle both relative and absolute imports
+try:
+    from .config import (
+        SHED_ENABLED, SHED_MAX_BACKLOG, SHED_MAX_AGE, SHED_ANOMALY_THRESHOLD, SHED_ACTIONS, SHED_CHEAP_MODEL,
+        LLM_MODEL
+    )
+    from .structured_logging import get_logger
+except ImportError:
+    from config import (
+        SHED_ENABLED, SHED_MAX_BACKLOG, SHED_MAX_AGE, SHED_ANOMALY_THRESHOLD, SHED_ACTIONS, SHED_CHEAP_MODEL,
+        LLM_MODEL
+    )
+    from structured_logging import get_logger
+
+logger = get_logger("load_shedder")
+
+SHED_ACTION_NAMES = ("skip_search", "cheap_model", "no_llm", "compact_slack")
+
+
+class LoadShedder:
+    """Per-incident degradation policy driven by backlog depth and incident age"""
+
+    def __init__(self, backlog: Callable[[], int], max_backlog: int = 50, max_age_seconds: float = 120.0,
+                 anomaly_threshold: float = 0.7,
+                 actions: Iterable[str] = ("skip_search", "cheap_model", "compact_slack")):
+        self.backlog = backlog
+        self.max_backlog = max_backlog
+        self.max_age_seconds = max_age_seconds
+        self.anomaly_threshold = anomaly_threshold
+        self.actions = [action for action in actions if action in SHED_ACTION_NAMES]
+        if "no_llm" in self.actions and "cheap_model" in self.actions:
+            self.actions.remove("cheap_model")
+
+        self._lock = threading.Lock()
+        self._decisions = 0
+        self._by_action = {action: 0 for action in SHED_ACTION_NAMES}
+
+    def decide(self, incident: Dict[str, Any], received_at: Optional[float]) -> Optional[Dict[str, Any]]:
+        """
+        Degradation decision for one incident, or None to process it normally.
+
+        Args:
+            incident: Incident dict (anomaly_score decides whether it matters)
+            received_at: time.time() when the agent received the message
+        """
+        try:
+            backlog = int(self.backlog())
+        except Exception:
+            backlog = 0
+        age = time.time() - received_at if received_at else 0.0
+        over_backlog = backlog >= self.max_backlog
+        over_age = age >= self.max_age_seconds
+        if not (over_backlog or over_age):
+            return None
+
+        try:
+            anomaly_score = float(incident.get("anomaly_score") or 0)
+        except (TypeError, ValueError):
+            anomaly_score = 0.0
+
+        if anomaly_score >= self.anomaly_threshold:
+            # Incidents that matter keep the full analysis; drop search only once they are late
+            actions = ["skip_search"] if over_age and "skip_search" in self.actions else []
+        else:
+            actions = list(self.actions)
+        if not actions:
+            return None
+
+        with self._lock:
+            self._decisions += 1
+            for action in actions:
+                self._by_action[action] += 1
+
+        return {
+            "actions": actions,
+            "reason": " and ".join(reason for reason, hit in (("backlog", over_backlog), ("age", over_age)) if hit),
+            "backlog": backlog,
+            "age_seconds": round(age, 1),
+            "anomaly_score": anomaly_score
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"degraded_incidents": self._decisions, **self._by_action}
+
+
+def build_load_shedder(backlog: Callable[[], int]) -> Optional[LoadShedder]:
+    """LoadShedder from config, or None when SHED_ENABLED is off"""
+    if not SHED_ENABLED:
+        return None
+    shedder = LoadShedder(
+        backlog,
+        max_backlog=SHED_MAX_BACKLOG,
+        max_age_seconds=SHED_MAX_AGE,
+        anomaly_threshold=SHED_ANOMALY_THRESHOLD,
+        actions=SHED_ACTIONS
+    )
+    logger.info("🪫 Load shedding enabled: backlog>=%d or age>=%ss, anomaly<%s gets %s",
+                SHED_MAX_BACKLOG, SHED_MAX_AGE, SHED_ANOMALY_THRESHOLD, shedder.actions)
+    if "cheap_model" in shedder.actions and SHED_CHEAP_MODEL == LLM_MODEL:
+        logger.warning("⚠️ SHED_CHEAP_MODEL is LLM_MODEL (%s): cheap_model only shortens the analysis; "
+                       "set a cheaper model or leave SHED_CHEAP_MODEL empty", LLM_MODEL)
+    return shedder
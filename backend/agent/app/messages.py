@@ -0,0 +1,137 @@
+"""
+incident_ready message contract
+
+The worker publishes one message per incident on REDIS_CHANNEL. Version 1
+carries only the id, so the agent reads the incident row from Postgres:
+
+    {"incident_id": 123}
+
+Version 2 ("fat" messages) also embeds the incident fields the agent needs,
+so the DB read is skipped:
+
+    {"v": 2, "incident_id": 123,
+     "incident": {"summary_text": "...", "labels": ["latency"], "evidence": {"service": "checkout"},
+                  "anomaly_score": 0.92, "confidence": 0.8,
+                  "created_at": "2024-05-01T12:00:00+00:00"}}
+
+event_id and status may be included too. An embedded incident without a
+summary_text is ignored and the row is read from the DB instead.
+
+Messages are JSON, or msgpack (MESSAGE_FORMAT=msgpack on the publisher). A
+msgpack map always starts with a byte JSON text cannot start with, so
+decode_message() tells them apart per message and producers can switch
+format without coordinating with the agents.
+
+These helpers validate incoming messages so every agent implementation
+(sync, worker pool, asyncio) rejects malformed input the same way.
+"""
+
+from typing import Any, Dict, Optional, Union
+
+# Handle both relative and absolute imports
+try:
+    from .structured_logging import get_logger
+    from . import codec
+except ImportError:
+    from structured_logging import get_logger
+    import codec
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+logger = get_logger("messages")
+
+MESSAGE_VERSION = 2
+
+# Fields a version 2 message may embed; the rest of the incident dict is derived
+EMBEDDED_FIELDS = ("event_id", "labels", "summary_text", "anomaly_score", "confidence",
+                   "evidence", "status", "created_at")
+
+
+def _is_msgpack(raw: bytes) -> bool:
+    # fixmap (0x80-0x8f), map 16 (0xde) or map 32 (0xdf)
+    return bool(raw) and (0x80 <= raw[0] <= 0x8f or raw[0] in (0xde, 0xdf))
+
+
+def encode_message(data: Dict[str, Any], fmt: str = "json") -> Union[str, bytes]:
+    """Encode a message as JSON (str) or msgpack (bytes)"""
+    if fmt == "msgpack":
+        if not MSGPACK_AVAILABLE:
+            raise RuntimeError("MESSAGE_FORMAT=msgpack but the msgpack package is not installed")
+        return msgpack.packb(data, use_bin_type=True)
+    return codec.dumps(data)
+
+
+def decode_message(raw: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Decode a JSON or msgpack message; raises ValueError if it is neither"""
+    if isinstance(raw, (bytes, bytearray, memoryview)) and _is_msgpack(bytes(raw[:1])):
+        if not MSGPACK_AVAILABLE:
+            raise ValueError("msgpack message received but the msgpack package is not installed")
+        try:
+            return msgpack.unpackb(raw, raw=False)
+        except Exception as e:
+            raise ValueError(f"invalid msgpack message: {e}") from e
+    return codec.loads(raw)
+
+
+def build_incident_message(incident_id: int, incident: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """A version 1 message, or version 2 with the incident's fields embedded"""
+    if incident is None:
+        return {"incident_id": incident_id}
+    embedded = {field: incident[field] for field in EMBEDDED_FIELDS if incident.get(field) is not None}
+    if hasattr(embedded.get("created_at"), "isoformat"):
+        embedded["created_at"] = embedded["created_at"].isoformat()
+    return {"v": MESSAGE_VERSION, "incident_id": incident_id, "incident": embedded}
+
+
+def parse_incident_id(data: Any) -> Optional[int]:
+    """Return the positive integer incident_id from a message, or None if it is invalid"""
+    if not isinstance(data, dict):
+        logger.warning("⚠️ Invalid message format: expected dict, got %s (message: %.200s)", type(data).__name__, data)
+        return None
+
+    if "incident_id" not in data:
+        logger.warning("⚠️ Missing incident_id in message")
+        return None
+
+    incident_id_raw = data.get("incident_id")
+    try:
+        incident_id = int(incident_id_raw)
+    except (ValueError, TypeError):
+        logger.warning("⚠️ Invalid incident_id format: %s", incident_id_raw)
+        return None
+
+    if incident_id <= 0:
+        logger.warning("⚠️ Invalid incident_id value: %s", incident_id)
+        return None
+
+    return incident_id
+
+
+def embedded_incident(data: Dict[str, Any], incident_id: int) -> Optional[Dict[str, Any]]:
+    """
+    The incident carried by a version 2 message, shaped like db.get_incident(),
+    or None when the message has none (or an unusable one) and the DB must be read
+    """
+    version = data.get("v", 1)
+    embedded = data.get("incident") if isinstance(version, int) and version >= 2 else None
+    if not isinstance(embedded, dict) or not isinstance(embedded.get("summary_text"), str):
+        return None
+
+    labels = embedded.get("labels") or []
+    if not isinstance(labels, list):
+        return None
+    return {
+        "id": incident_id,
+        "event_id": embedded.get("event_id"),
+        "labels": labels,
+        "summary_text": embedded["summary_text"],
+        "anomaly_score": embedded.get("anomaly_score"),
+        "confidence": embedded.get("confidence"),
+        "evidence": embedded.get("evidence"),
+        "status": embedded.get("status", "open"),
+        "created_at": embedded.get("created_at")
+    }
@@ -0,0 +1,224 @@
+"""
+Prometheus metrics for the agent and the FastAPI app
+
+Latency and outcome of every external call on the incident path are recorded
+in one histogram, agent_operation_seconds{operation, outcome}:
+
+    get_incident, get_incidents, semantic_search, semantic_search_http,
+    semantic_search_fallback_sql, openai_embedding, ask_llm, memory_upsert,
+    notify_incident, slack_api, slack_message_save, status_update,
+    audit_write, unit_of_work_commit, audit_copy, redis_pipeline,
+    get_stale_incidents
+
+plus LLM token counters, per-stage pipeline timings and queue depths,
+listener counters, where incidents were read from, retry outcomes, incidents
+re-published by the sweeper, and gauges read at scrape time from stats()
+callbacks (database pool, dedupe, coalescer, load shedder, audit sink,
+retries, sweeper).
+
+The agent serves them on METRICS_PORT; the FastAPI app on GET /metrics.
+prometheus_client is optional: without it every metric is a no-op.
+"""
+
+import functools
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+# Handle both relative and absolute imports
+try:
+    from .config import METRICS_PORT
+except ImportError:
+    from config import METRICS_PORT
+
+try:
+    from prometheus_client import (
+        Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, start_http_server
+    )
+    from prometheus_client.core import GaugeMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    Counter = Gauge = Histogram = None
+    CONTENT_TYPE_LATEST = "text/plain; charset=utf-8"
+
+
+class _NoopMetric:
+    """Stands in for every metric type when prometheus_client is not installed"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def set_function(self, fn):
+        pass
+
+
+def _metric(kind, name, documentation, labelnames=(), **kwargs):
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    return kind(name, documentation, labelnames, **kwargs)
+
+
+# Seconds; spans sub-millisecond DB calls up to slow LLM completions
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+OPERATION_SECONDS = _metric(
+    Histogram, "agent_operation_seconds",
+    "Latency of external calls made while processing incidents", ["operation", "outcome"],
+    buckets=_LATENCY_BUCKETS
+)
+LLM_TOKENS = _metric(
+    Counter, "agent_llm_tokens",
+    "Tokens used by chat completions", ["model", "kind"]
+)
+STAGE_SECONDS = _metric(
+    Histogram, "agent_stage_seconds",
+    "Time a pipeline stage spent handling one item or batch", ["stage"],
+    buckets=_LATENCY_BUCKETS
+)
+STAGE_WAIT_SECONDS = _metric(
+    Histogram, "agent_stage_wait_seconds",
+    "Time an item waited in a pipeline stage queue", ["stage"],
+    buckets=_LATENCY_BUCKETS
+)
+STAGE_ITEMS = _metric(
+    Counter, "agent_stage_items",
+    "Items leaving a pipeline stage", ["stage", "outcome"]
+)
+STAGE_QUEUE_DEPTH = _metric(
+    Gauge, "agent_stage_queue_depth",
+    "Items waiting in a pipeline stage queue", ["stage"]
+)
+LISTENER_MESSAGES = _metric(
+    Counter, "agent_listener_messages",
+    "Messages received by the message listener", ["transport", "outcome"]
+)
+INCIDENT_SOURCE = _metric(
+    Counter, "agent_incident_source",
+    "Incidents read from the message itself (embedded) or from Postgres (db)", ["source"]
+)
+RETRY_EVENTS = _metric(
+    Counter, "agent_retry_events",
+    "Failed incidents scheduled for retry, dead-lettered, re-published or requeued", ["outcome"]
+)
+SWEEPER_EVENTS = _metric(
+    Counter, "agent_sweeper_events",
+    "Stale open incidents re-published by the sweeper, skipped as recently swept or failed (retrying or "
+    "dead-lettered), or not delivered (publish_failed)", ["outcome"]
+)
+LISTENER_HANDOFF_SECONDS = _metric(
+    Histogram, "agent_listener_handoff_seconds",
+    "Time the listener spent handing a message to the handler (includes backpressure waits)",
+    ["transport"], buckets=_LATENCY_BUCKETS
+)
+
+
+def observe(operation: str, failed: Callable[[Any], bool] = None):
+    """
+    Decorator recording a function's latency under agent_operation_seconds.
+
+    Raised exceptions count as outcome="error"; so do results for which
+    failed(result) is true, for helpers that report errors by return value.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = fn(*args, **kwargs)
+                if not (failed and failed(result)):
+                    outcome = "ok"
+                return result
+            finally:
+                OPERATION_SECONDS.labels(operation, outcome).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def timed(operation: str):
+    """Context manager form of observe() for calls made inline"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        OPERATION_SECONDS.labels(operation, outcome).observe(time.perf_counter() - started)
+
+
+def record_llm_usage(model: str, usage: Dict[str, Any]):
+    """Count prompt and completion tokens from an OpenAI `usage` block"""
+    if not usage:
+        return
+    LLM_TOKENS.labels(model, "prompt").inc(usage.get("prompt_tokens", 0) or 0)
+    LLM_TOKENS.labels(model, "completion").inc(usage.get("completion_tokens", 0) or 0)
+
+
+class _StatsCollector:
+    """Exports the numeric values of a stats() dict as one gauge family at scrape time"""
+
+    def __init__(self, name: str, documentation: str, stats: Callable[[], Dict[str, Any]]):
+        self.name = name
+        self.documentation = documentation
+        self.stats = stats
+
+    def collect(self):
+        family = GaugeMetricFamily(self.name, self.documentation, labels=["stat"])
+        try:
+            values = self.stats() or {}
+        except Exception:
+            values = {}
+        for stat, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                family.add_metric([stat], value)
+        yield family
+
+
+_registered_stats = {}
+
+def register_stats(name: str, documentation: str, stats: Callable[[], Dict[str, Any]]):
+    """
+    Expose a stats() callback as gauge agent_<name>{stat="..."}.
+    Registering the same name again replaces the callback.
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return
+    previous = _registered_stats.pop(name, None)
+    if previous is not None:
+        REGISTRY.unregister(previous)
+    collector = _StatsCollector(f"agent_{name}", documentation, stats)
+    REGISTRY.register(collector)
+    _registered_stats[name] = collector
+
+
+def latest_metrics() -> bytes:
+    """Current metrics in the Prometheus text format"""
+    if not PROMETHEUS_AVAILABLE:
+        return b"# prometheus_client is not installed\n"
+    return generate_latest()
+
+
+def start_metrics_server(port: int = None):
+    """Serve /metrics for the agent process on METRICS_PORT (0 disables)"""
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return
+    if not PROMETHEUS_AVAILABLE:
+        print("⚠️ METRICS_PORT is set but prometheus_client is not installed; metrics disabled")
+        return
+    try:
+        start_http_server(port)
+        print(f"📈 Metrics available on :{port}/metrics")
+    except Exception as e:
+        print(f"⚠️ Could not start metrics server on port {port}: {e}")
@@ -3,15 +3,17 @@ import json
 import os
 # Handle both relative and absolute imports
 try:
-    from .config import SLACK_BOT_TOKEN, SLACK_CHANNEL
+    from .config import SLACK_BOT_TOKEN, SLACK_CHANNEL, SLACK_API_URL
     from .db import insert_audit_log, save_slack_message
     from .email_notifier import load_routing_config, classify_incident_type
+    from .metrics import timed
 except ImportError:
-    from config import SLACK_BOT_TOKEN, SLACK_CHANNEL
+    from config import SLACK_BOT_TOKEN, SLACK_CHANNEL, SLACK_API_URL
     from db import insert_audit_log, save_slack_message
     from email_notifier import load_routing_config, classify_incident_type
+    from metrics import timed
 
-slack = WebClient(token=SLACK_BOT_TOKEN)
+slack = WebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL)
 
 def build_blocks(incident, ai_result, similar_incidents=None):
     summary = ai_result.get("summary", "")
@@ -29,14 +31,27 @@ def build_blocks(incident, ai_result, similar_incidents=None):
     if incident_type:
         incident_header += f"\n🏷️ *Type:* {incident_type.replace('_', ' ').title()}"
 
-    blocks = [
-        {"type":"section", "text":{"type":"mrkdwn", "text": incident_header}},
-        {"type":"section", "text":{"type":"mrkdwn", "text": f"*AI Summary:* {summary}"}},
-        {"type":"section", "text":{"type":"mrkdwn", "text": f"*Root causes & fixes:*\n{causes_md}"}},
-    ]
+    if ai_result.get("compact"):
+        # Degraded mode (load shedding): header and summary only
+        blocks = [
+            {"type":"section", "text":{"type":"mrkdwn", "text": incident_header}},
+            {"type":"context", "elements":[{"type":"mrkdwn", "text": f"{summary[:300]}\n_Reduced analysis: agent under load_"}]},
+        ]
+    else:
+        blocks = [
+            {"type":"section", "text":{"type":"mrkdwn", "text": incident_header}},
+            {"type":"section", "text":{"type":"mrkdwn", "text": f"*AI Summary:* {summary}"}},
+            {"type":"section", "text":{"type":"mrkdwn", "text": f"*Root causes & fixes:*\n{causes_md}"}},
+        ]
+    
+    # Coalesced incident storm: list every incident covered by this analysis
+    coalesced_ids = incident.get('coalesced_ids') or []
+    if len(coalesced_ids) > 1:
+        id_list = ", ".join(f"#{i}" for i in coalesced_ids)
+        blocks.insert(1, {"type":"section", "text":{"type":"mrkdwn", "text": f"🌪️ *{len(coalesced_ids)} related incidents grouped:* {id_list}"}})
     
     # Add similar incidents section if available
-    if similar_incidents and len(similar_incidents) > 0:
+    if similar_incidents and len(similar_incidents) > 0 and not ai_result.get("compact"):
         similar_text = "*Previous Similar Incidents:*\n"
         for incident in similar_incidents[:3]:  # Show top 3
             similarity = incident.get('similarity', 0)
@@ -68,7 +83,8 @@ def send_incident_message(channel: str, incident: dict, ai_result: dict, similar
     incident_id = incident.get('incident_id', incident.get('id', 'N/A'))
     
     try:
-        resp = slack.chat_postMessage(channel=channel, blocks=blocks, text=f"Incident {incident_id} notification")
+        with timed("slack_api"):
+            resp = slack.chat_postMessage(channel=channel, blocks=blocks, text=f"Incident {incident_id} notification")
         
         # Save Slack message to database for frontend display
         try:
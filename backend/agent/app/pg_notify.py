@@ -0,0 +1,315 @@
+"""
+Postgres LISTEN/NOTIFY transport (REDIS_TRANSPORT=postgres)
+
+The worker already writes every incident to Postgres, so instead of a second
+publish to Redis a trigger on incidents INSERT sends the incident_ready
+message with NOTIFY on the channel REDIS_CHANNEL when the insert commits:
+
+    worker INSERT -> trigger -> NOTIFY incident_ready -> agent LISTEN
+
+The trigger (created on start unless PG_NOTIFY_INSTALL_TRIGGER=false) embeds
+the row as a version 2 message (see messages.py), so the agent does not read
+it back. NOTIFY payloads must be shorter than 8000 bytes; a larger incident is
+sent as {"incident_id": N}, and the listener reads all such rows of a batch in
+one query.
+
+PostgresNotifyListener holds one dedicated autocommit connection (LISTEN is
+per session, so it cannot come from the pool). After a notification arrives it
+waits up to PG_NOTIFY_BATCH_WINDOW seconds for more, up to
+PG_NOTIFY_BATCH_SIZE, then hands them to the callback one by one. NOTIFY is
+not queued for absent listeners, so after a reconnect (once LISTEN is active
+again) the listener re-reads incidents still open that were created since the
+connection was lost, less CATCHUP_MARGIN seconds and at most
+PG_NOTIFY_CATCHUP_WINDOW seconds back, and delivers them too. The first
+connection does not replay anything: incidents left open by an earlier run are
+the sweeper's job, which is throttled by its own markers.
+
+Like Redis pub/sub, every listening agent receives every notification: with
+several agents keep DEDUPE_ENABLED so the Redis lease decides which one
+processes an incident. Messages published by the agent itself (retries, the
+sweeper, tests/publish_incident_ready.py) go out with pg_notify() as well.
+Needs psycopg 3.2 or later (Connection.notifies() with a timeout).
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import psycopg
+from psycopg import errors, sql
+
+# Handle both relative and absolute imports
+try:
+    from .config import (
+        DATABASE_URL, PG_NOTIFY_BATCH_SIZE, PG_NOTIFY_BATCH_WINDOW, PG_NOTIFY_CATCHUP_WINDOW,
+        PG_NOTIFY_INSTALL_TRIGGER
+    )
+    from .db import get_conn, get_incidents, get_stale_incidents
+    from .messages import build_incident_message, decode_message
+    from .redis_client import RedisMessageListener
+    from .structured_logging import get_logger
+    from . import codec
+except ImportError:
+    from config import (
+        DATABASE_URL, PG_NOTIFY_BATCH_SIZE, PG_NOTIFY_BATCH_WINDOW, PG_NOTIFY_CATCHUP_WINDOW,
+        PG_NOTIFY_INSTALL_TRIGGER
+    )
+    from db import get_conn, get_incidents, get_stale_incidents
+    from messages import build_incident_message, decode_message
+    from redis_client import RedisMessageListener
+    from structured_logging import get_logger
+    import codec
+
+logger = get_logger("pg_notify")
+
+# NOTIFY rejects payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7999
+
+# Seconds re-read before the moment the connection was lost, for clock skew and in-flight commits
+CATCHUP_MARGIN = 60
+
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+
+# Sends NEW as a version 2 message on the channel given as the trigger argument
+NOTIFY_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION notify_incident_ready() RETURNS trigger AS $$
+DECLARE
+    payload TEXT;
+BEGIN
+    payload := json_build_object(
+        'v', 2,
+        'incident_id', NEW.id,
+        'incident', json_strip_nulls(json_build_object(
+            'event_id', NEW.event_id,
+            'labels', NEW.labels,
+            'summary_text', NEW.summary_text,
+            'anomaly_score', NEW.anomaly_score,
+            'confidence', NEW.confidence,
+            'evidence', NEW.evidence,
+            'status', NEW.status,
+            'created_at', NEW.created_at
+        ))
+    )::text;
+    IF octet_length(payload) > 7999 THEN
+        -- Too large for NOTIFY: the agent reads the row instead
+        payload := json_build_object('incident_id', NEW.id)::text;
+    END IF;
+    PERFORM pg_notify(TG_ARGV[0], payload);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def trigger_name(channel: str) -> str:
+    """Name of the incidents trigger notifying a channel (identifiers are cut at 63 bytes)"""
+    return f"incidents_notify_{channel}"[:63]
+
+
+def install_incident_trigger(conn, channel: str) -> bool:
+    """
+    Create the notify function and the incidents INSERT trigger for a channel
+    unless the trigger exists; False (with a warning) if the role may not
+    """
+    name = trigger_name(channel)
+    try:
+        conn.execute(NOTIFY_FUNCTION_SQL)
+        exists = conn.execute(
+            "SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = 'incidents'::regclass", (name,)
+        ).fetchone()
+        if exists is None:
+            conn.execute(sql.SQL(
+                "CREATE TRIGGER {} AFTER INSERT ON incidents FOR EACH ROW EXECUTE FUNCTION notify_incident_ready({})"
+            ).format(sql.Identifier(name), sql.Literal(channel)))
+            logger.info("✅ Created trigger %s: incidents INSERT -> NOTIFY %s", name, channel)
+        return True
+    except errors.DuplicateObject:
+        # Another agent created it first
+        return True
+    except psycopg.OperationalError:
+        raise
+    except Exception as e:
+        logger.warning("⚠️ Could not install the incidents NOTIFY trigger: %s (create it by hand, see README)", e)
+        return False
+
+
+def _payload(data: Dict[str, Any]) -> str:
+    payload = codec.dumps(data)
+    if len(payload.encode("utf-8")) > MAX_PAYLOAD_BYTES:
+        # Drop the embedded incident; the listener reads the row
+        payload = codec.dumps({key: value for key, value in data.items() if key not in ("v", "incident")})
+    return payload
+
+
+def _retry_attempt(data: Dict[str, Any]) -> int:
+    """Retry attempt carried by a message (0 for a first delivery)"""
+    retry = data.get("retry")
+    attempt = retry.get("attempt") if isinstance(retry, dict) else None
+    return attempt if isinstance(attempt, int) else 0
+
+
+def notify_many(channel: str, items: List[Dict[str, Any]]) -> int:
+    """
+    Send messages with pg_notify() in one transaction (delivered together on
+    commit); returns how many were sent, 0 on failure
+    """
+    if not items:
+        return 0
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.executemany("SELECT pg_notify(%s, %s)", [(channel, _payload(data)) for data in items])
+            conn.commit()
+        return len(items)
+    except Exception as e:
+        logger.error("❌ Error sending %d notifications on %s: %s", len(items), channel, e)
+        return 0
+
+
+class PostgresNotifyListener(RedisMessageListener):
+    """
+    LISTEN on a Postgres channel with batched delivery and catch-up on (re)connect
+    """
+
+    def __init__(self, channel: str, batch_size: int = PG_NOTIFY_BATCH_SIZE,
+                 batch_window: float = PG_NOTIFY_BATCH_WINDOW, catchup_window: int = PG_NOTIFY_CATCHUP_WINDOW,
+                 install_trigger: bool = PG_NOTIFY_INSTALL_TRIGGER):
+        super().__init__(None, channel)
+        self.batch_size = max(1, int(batch_size))
+        self.batch_window = max(0.0, float(batch_window))
+        self.catchup_window = max(0, int(catchup_window))
+        self.conn = None
+        # Set while there is no LISTEN connection (or its catch-up failed)
+        self.disconnected_at: Optional[float] = None
+        self._trigger_checked = not install_trigger
+        self._stopped = threading.Event()
+
+    def listen(self, callback_func):
+        self.running = True
+        self._stopped.clear()
+        delay = RECONNECT_MIN_DELAY
+        logger.info("🎯 Agent listening on Postgres channel %s (LISTEN/NOTIFY, up to %d per batch)",
+                    self.channel, self.batch_size)
+
+        while self.running:
+            try:
+                self._connect()
+                # LISTEN is active: anything committed from now on is notified
+                self._catch_up(callback_func)
+                delay = RECONNECT_MIN_DELAY
+                self._receive(callback_func)
+            except psycopg.OperationalError as e:
+                if self.disconnected_at is None:
+                    self.disconnected_at = time.time()
+                if not self.running:
+                    break
+                logger.error("❌ LISTEN connection lost: %s; reconnecting in %.0fs", e, delay)
+                self._stopped.wait(delay)
+                delay = min(RECONNECT_MAX_DELAY, delay * 2)
+            finally:
+                self._close()
+
+    def _connect(self):
+        conn = psycopg.connect(DATABASE_URL, autocommit=True)
+        try:
+            if not self._trigger_checked:
+                install_incident_trigger(conn, self.channel)
+                self._trigger_checked = True
+            conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+        except Exception:
+            conn.close()
+            raise
+        self.conn = conn
+
+    def _close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def _catch_up(self, callback_func):
+        """Deliver incidents still open that were created while the connection was down"""
+        if self.disconnected_at is None or not self.catchup_window:
+            # First start (nothing was missed by this listener) or catch-up disabled
+            self.disconnected_at = None
+            return
+        # created_at >= disconnected_at - CATCHUP_MARGIN, capped at the catch-up window
+        window = min(self.catchup_window, int(time.time() - self.disconnected_at) + CATCHUP_MARGIN)
+        try:
+            delivered = 0
+            cursor = None
+            while self.running:
+                incidents, cursor = get_stale_incidents(0, window, after=cursor, limit=self.batch_size)
+                for incident in incidents:
+                    self._deliver(callback_func, build_incident_message(incident["id"], incident))
+                delivered += len(incidents)
+                if len(incidents) < self.batch_size:
+                    break
+            self.disconnected_at = None
+            if delivered:
+                logger.info("🔄 Caught up on %d open incidents from the last %ds", delivered, window)
+        except Exception as e:
+            logger.error("❌ Catch-up query failed: %s", e)
+
+    def _receive(self, callback_func):
+        while self.running:
+            # Wake up at least every second to notice stop()
+            payloads = [notify.payload for notify in self.conn.notifies(timeout=1.0, stop_after=1)]
+            if not payloads:
+                continue
+            if self.batch_size > 1 and self.batch_window > 0:
+                payloads += [notify.payload for notify in
+                             self.conn.notifies(timeout=self.batch_window, stop_after=self.batch_size - 1)]
+            self._deliver_batch(callback_func, payloads)
+
+    def _deliver_batch(self, callback_func, payloads: List[str]):
+        messages = []
+        # incident_id -> index in messages of the notification kept for it
+        kept: Dict[int, int] = {}
+        for payload in payloads:
+            try:
+                data = decode_message(payload)
+            except ValueError as exc:
+                logger.error("❌ Dropping malformed notification: %s (payload: %.200s)", exc, payload)
+                continue
+            incident_id = data.get("incident_id") if isinstance(data, dict) else None
+            if isinstance(incident_id, int):
+                index = kept.get(incident_id)
+                if index is not None:
+                    # Same incident twice in a batch: keep the furthest retry so its
+                    # attempt count (and the dead-letter limit) is not reset
+                    if _retry_attempt(data) > _retry_attempt(messages[index]):
+                        messages[index] = data
+                    continue
+                kept[incident_id] = len(messages)
+            messages.append(data)
+
+        self._embed_rows(messages)
+        for data in messages:
+            self._deliver(callback_func, data)
+
+    def _embed_rows(self, messages: List[Any]):
+        """Embed the rows of notifications sent without their incident, read in one query"""
+        thin = [data for data in messages
+                if isinstance(data, dict) and isinstance(data.get("incident_id"), int) and "incident" not in data]
+        if not thin:
+            return
+        # On failure (None) the agent reads each row itself
+        incidents = get_incidents([data["incident_id"] for data in thin]) or {}
+        for data in thin:
+            incident = incidents.get(data["incident_id"])
+            if incident is not None:
+                data.update(build_incident_message(data["incident_id"], incident))
+
+    def _deliver(self, callback_func, data):
+        try:
+            self._dispatch("postgres", callback_func, data)
+        except Exception as exc:
+            logger.exception("❌ Error handling message: %s", exc)
+
+    def stop(self):
+        super().stop()
+        self._stopped.set()
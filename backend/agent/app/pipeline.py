@@ -0,0 +1,340 @@
+"""
+Staged (SEDA-style) incident pipeline
+
+The steps of incident processing have very different costs: a Postgres
+lookup takes milliseconds while the LLM call can take tens of seconds. In a
+staged pipeline each step runs in its own stage:
+
+    listener -> [queue] fetch -> [queue] search -> [queue] analyze -> ...
+
+Every stage owns a bounded input queue and a fixed number of worker threads,
+so slow stages can run wide while cheap database stages stay narrow. Each
+stage records queue depth, throughput and busy time, which makes the
+bottleneck visible: it is the stage with the highest utilisation and the
+deepest queue.
+
+Stage handlers receive a context dict and return it (possibly updated) to
+pass it on, or None to stop processing that item. A stage created with
+batch_size > 1 instead receives a list of every context already waiting in its
+queue (up to batch_size) and returns the list of contexts to pass on; it never
+waits for a batch to fill, so batching adds no latency when the agent is idle.
+
+A stage given a priority function serves its queue highest priority first
+(see priority.py) instead of in arrival order.
+
+An optional on_discard hook sees every context a stage drops or fails, so
+resources held for an item (such as an incident lease) can be released. An
+on_error hook additionally receives each context of a failed handler call with
+the exception (e.g. to schedule a retry); it runs before on_discard.
+
+A handler may also return HELD to keep an item for later (e.g. to coalesce it
+with others); whatever owns it passes it on with the stage's forward(). The
+stage's on_stop callback runs once its workers have exited and before the
+next stage is stopped, so held items can still be flushed downstream.
+"""
+
+import math
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Handle both relative and absolute imports
+try:
+    from .priority import PriorityWorkQueue
+    from .metrics import STAGE_SECONDS, STAGE_WAIT_SECONDS, STAGE_ITEMS, STAGE_QUEUE_DEPTH
+    from .structured_logging import get_logger
+except ImportError:
+    from priority import PriorityWorkQueue
+    from metrics import STAGE_SECONDS, STAGE_WAIT_SECONDS, STAGE_ITEMS, STAGE_QUEUE_DEPTH
+    from structured_logging import get_logger
+
+logger = get_logger("pipeline")
+
+# Sentinel placed on a stage queue to stop one of its workers
+_STOP = object()
+
+# Returned by a handler that keeps the item and will forward() it itself
+HELD = object()
+
+
+class PipelineStage:
+    """One stage: a bounded queue feeding `concurrency` worker threads"""
+
+    def __init__(self, name: str, handler: Callable[[Any], Any],
+                 concurrency: int = 1, queue_size: int = 100, batch_size: int = 1,
+                 on_stop: Optional[Callable[[], None]] = None,
+                 priority: Optional[Callable[[Any], float]] = None, aging_rate: float = 0.0):
+        self.name = name
+        self.handler = handler
+        self.on_stop = on_stop
+        self.concurrency = max(1, int(concurrency))
+        self.batch_size = max(1, int(batch_size))
+        if priority is not None:
+            # Highest priority first; shutdown sentinels rank below every real item
+            self.queue: queue.Queue = PriorityWorkQueue(
+                max(1, int(queue_size)),
+                lambda ctx: -math.inf if ctx is _STOP else priority(ctx),
+                aging_rate
+            )
+        else:
+            self.queue: queue.Queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.next_stage: Optional["PipelineStage"] = None
+        # Called with each context a stage drops or fails, and with (context, exception)
+        # for each context of a failed call (set by StagedPipeline)
+        self.on_discard: Optional[Callable[[Any], None]] = None
+        self.on_error: Optional[Callable[[Any, Exception], None]] = None
+        self.threads: List[threading.Thread] = []
+
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._processed = 0
+        self._failed = 0
+        self._dropped = 0
+        self._batches = 0
+        self._in_flight = 0
+        self._max_depth = 0
+        self._busy_seconds = 0.0
+        self._wait_seconds = 0.0
+
+    def start(self):
+        self._started_at = time.monotonic()
+        STAGE_QUEUE_DEPTH.labels(self.name).set_function(self.queue.qsize)
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._worker, name=f"stage-{self.name}-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, ctx: Dict[str, Any], timeout: Optional[float] = None):
+        """Enqueue an item, blocking while the queue is full (backpressure)"""
+        self.queue.put((time.monotonic(), ctx), timeout=timeout)
+        depth = self.queue.qsize()
+        with self._lock:
+            if depth > self._max_depth:
+                self._max_depth = depth
+
+    def stop(self):
+        """Stop after every item already queued has been handled"""
+        for _ in self.threads:
+            self.queue.put((time.monotonic(), _STOP))
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.on_stop is not None:
+            self.on_stop()
+
+    def forward(self, ctx: Dict[str, Any]):
+        """Pass an item this stage held on to the next stage"""
+        if self.next_stage is not None:
+            self.next_stage.put(ctx)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+            handled = self._processed + self._failed + self._dropped
+            return {
+                "stage": self.name,
+                "concurrency": self.concurrency,
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self._max_depth,
+                "in_flight": self._in_flight,
+                "processed": self._processed,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "avg_batch_size": round(handled / self._batches, 1) if self._batches else 0.0,
+                "avg_service_ms": round(self._busy_seconds / handled * 1000, 1) if handled else 0.0,
+                "avg_wait_ms": round(self._wait_seconds / handled * 1000, 1) if handled else 0.0,
+                # Share of the stage's worker capacity spent handling items
+                "utilization": round(self._busy_seconds / (elapsed * self.concurrency), 3) if elapsed else 0.0
+            }
+
+    def _take(self) -> list:
+        """Block for one entry, then take whatever else is already queued up to batch_size"""
+        entries = [self.queue.get()]
+        while len(entries) < self.batch_size:
+            try:
+                entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return entries
+
+    def _worker(self):
+        while True:
+            entries = self._take()
+            stop = False
+            batch = []
+            for enqueued_at, ctx in entries:
+                if ctx is _STOP:
+                    if stop:
+                        # Only one sentinel per worker; hand the extra back to a sibling
+                        self.queue.put((time.monotonic(), _STOP))
+                    stop = True
+                else:
+                    batch.append((enqueued_at, ctx))
+
+            if batch:
+                self._handle(batch)
+            for _ in entries:
+                self.queue.task_done()
+            if stop:
+                break
+
+    def _handle(self, batch: list):
+        started = time.monotonic()
+        with self._lock:
+            self._in_flight += len(batch)
+            self._batches += 1
+            self._wait_seconds += sum(started - enqueued_at for enqueued_at, _ in batch)
+        for enqueued_at, _ in batch:
+            STAGE_WAIT_SECONDS.labels(self.name).observe(started - enqueued_at)
+
+        contexts = [ctx for _, ctx in batch]
+        results = []
+        held = []
+        failed = False
+        error = None
+        try:
+            if self.batch_size > 1:
+                results = [ctx for ctx in (self.handler(contexts) or []) if ctx is not None]
+            else:
+                result = self.handler(contexts[0])
+                results = [result] if result is not None else []
+            held = [ctx for ctx in results if ctx is HELD]
+            results = [ctx for ctx in results if ctx is not HELD]
+        except Exception as exc:
+            failed = True
+            error = exc
+            incident_ids = [ctx.get('incident_id') for ctx in contexts]
+            logger.exception("❌ Stage %s failed for incident(s) %s: %s", self.name, incident_ids, exc,
+                             extra={"stage": self.name})
+
+        if error is not None and self.on_error is not None:
+            for ctx in contexts:
+                try:
+                    self.on_error(ctx, error)
+                except Exception as exc:
+                    logger.error("❌ Stage %s error hook failed: %s", self.name, exc,
+                                 extra={"stage": self.name, "incident_id": ctx.get('incident_id')})
+
+        if self.on_discard is not None and not held:
+            kept = {id(ctx) for ctx in results}
+            for ctx in contexts:
+                if id(ctx) not in kept:
+                    try:
+                        self.on_discard(ctx)
+                    except Exception as exc:
+                        logger.error("❌ Stage %s discard hook failed: %s", self.name, exc,
+                                     extra={"stage": self.name, "incident_id": ctx.get('incident_id')})
+
+        elapsed = time.monotonic() - started
+        STAGE_SECONDS.labels(self.name).observe(elapsed)
+        if failed:
+            STAGE_ITEMS.labels(self.name, "failed").inc(len(batch))
+        else:
+            STAGE_ITEMS.labels(self.name, "processed").inc(len(results) + len(held))
+            STAGE_ITEMS.labels(self.name, "dropped").inc(len(batch) - len(results) - len(held))
+
+        with self._lock:
+            self._in_flight -= len(batch)
+            self._busy_seconds += elapsed
+            if failed:
+                self._failed += len(batch)
+            else:
+                self._processed += len(results) + len(held)
+                self._dropped += len(batch) - len(results) - len(held)
+
+        if self.next_stage is not None:
+            for result in results:
+                self.next_stage.put(result)
+
+
+class StagedPipeline:
+    """Chain of PipelineStages fed by submit()"""
+
+    def __init__(self, stages: List[PipelineStage], stats_interval: float = 0,
+                 on_discard: Optional[Callable[[Any], None]] = None,
+                 on_error: Optional[Callable[[Any, Exception], None]] = None):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.next_stage = downstream
+        for stage in stages:
+            stage.on_discard = on_discard
+            stage.on_error = on_error
+        self.stats_interval = stats_interval
+        self.running = False
+        self._stats_thread = None
+        self._stop_event = threading.Event()
+        # submit() calls past the running check; stop() waits for them before stopping the stages
+        self._submit_cond = threading.Condition()
+        self._submitting = 0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for stage in self.stages:
+            stage.start()
+        if self.stats_interval > 0:
+            self._stats_thread = threading.Thread(target=self._report_stats, name="pipeline-stats", daemon=True)
+            self._stats_thread.start()
+        layout = " -> ".join(f"{stage.name}({stage.concurrency})" for stage in self.stages)
+        logger.info("🏭 Staged pipeline started: %s", layout)
+
+    def submit(self, data: Any) -> bool:
+        """Listener callback: feed a raw message into the first stage"""
+        with self._submit_cond:
+            if not self.running:
+                logger.warning("⚠️ Pipeline is not running, dropping message")
+                return False
+            self._submitting += 1
+        try:
+            self.stages[0].put({"data": data, "received_at": time.time()})
+            return True
+        finally:
+            with self._submit_cond:
+                self._submitting -= 1
+                self._submit_cond.notify_all()
+
+    def stop(self):
+        """Drain every stage in order, so in-flight incidents complete"""
+        with self._submit_cond:
+            if not self.running:
+                return
+            self.running = False
+            # A blocked put() completes while the first stage drains, so this does not deadlock
+            self._submit_cond.wait_for(lambda: self._submitting == 0)
+        self._stop_event.set()
+        for stage in self.stages:
+            stage.stop()
+        self.print_stats()
+        logger.info("🏭 Staged pipeline stopped")
+
+    def backlog(self) -> int:
+        """Items waiting in every stage queue"""
+        return sum(stage.queue.qsize() for stage in self.stages)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [stage.stats() for stage in self.stages]
+
+    def bottleneck(self) -> Optional[str]:
+        """Name of the stage with the highest utilisation, if any work was done"""
+        stats = self.stats()
+        busiest = max(stats, key=lambda s: (s["utilization"], s["queue_depth"]))
+        return busiest["stage"] if busiest["utilization"] > 0 else None
+
+    def print_stats(self):
+        logger.info("📊 Pipeline stages:")
+        for s in self.stats():
+            logger.info("   %-10s depth=%-4d max=%-4d in_flight=%d/%d done=%d dropped=%d failed=%d batch=%s "
+                        "wait=%sms service=%sms util=%.0f%%", s['stage'], s['queue_depth'], s['max_queue_depth'],
+                        s['in_flight'], s['concurrency'], s['processed'], s['dropped'], s['failed'],
+                        s['avg_batch_size'], s['avg_wait_ms'], s['avg_service_ms'], s['utilization'] * 100)
+        bottleneck = self.bottleneck()
+        if bottleneck:
+            logger.info("   bottleneck: %s", bottleneck)
+
+    def _report_stats(self):
+        while not self._stop_event.wait(self.stats_interval):
+            self.print_stats()
@@ -0,0 +1,65 @@
+"""
+Priority scheduling for incidents waiting on the slow stages
+
+By default every stage queue is FIFO, so when the LLM stage is saturated a
+high-severity incident waits behind every low-score incident that arrived
+before it. PriorityWorkQueue is a drop-in bounded queue.Queue that hands out
+the highest-priority entry first instead.
+
+Priority is a weighted sum of the incident's scores (PRIORITY_WEIGHTS, e.g.
+"anomaly_score=1.0,confidence=0.5") plus aging: an entry gains
+PRIORITY_AGING_RATE points for every second it has waited, so low-priority
+incidents still make progress under sustained load. Because every waiting
+entry ages at the same rate, the effective priority
+
+    score + aging_rate * (now - enqueued_at)
+
+orders entries the same way as the fixed key score - aging_rate * enqueued_at,
+which lets a plain heap do the work.
+"""
+
+import heapq
+import itertools
+import queue
+from typing import Any, Callable, Dict, Tuple
+
+
+def priority_score(incident: Dict[str, Any], weights: Dict[str, float]) -> float:
+    """Weighted sum of the incident's numeric fields (missing or null fields count as 0)"""
+    score = 0.0
+    for field, weight in weights.items():
+        try:
+            score += weight * float(incident.get(field) or 0)
+        except (TypeError, ValueError):
+            continue
+    return score
+
+
+class PriorityWorkQueue(queue.Queue):
+    """
+    Bounded queue of (enqueued_at, item) entries served highest priority first.
+
+    priority(item) returns the item's base score; ties are served in arrival
+    order. Blocking, maxsize and task_done() behave exactly as in queue.Queue.
+    """
+
+    def __init__(self, maxsize: int, priority: Callable[[Any], float], aging_rate: float = 0.0):
+        self.priority = priority
+        self.aging_rate = aging_rate
+        super().__init__(maxsize)
+
+    # queue.Queue calls these with its mutex held
+    def _init(self, maxsize):
+        self.queue = []
+        self._sequence = itertools.count()
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, entry: Tuple[float, Any]):
+        enqueued_at, item = entry
+        key = -(self.priority(item) - self.aging_rate * enqueued_at)
+        heapq.heappush(self.queue, (key, next(self._sequence), entry))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
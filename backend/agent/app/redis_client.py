@@ -6,18 +6,41 @@ This module provides a unified interface for Redis operations that can work with
 2. Upstash Redis REST API (serverless Redis)
 
 The client automatically chooses the appropriate connection method based on 
-available configuration.
+available configuration. It connects on first use, so a process that never
+touches Redis (REDIS_TRANSPORT=postgres without dedupe or retries) does not
+need one.
 """
 
-import json
+import functools
+import logging
+import random
+import threading
 import time
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 
 # Handle both relative and absolute imports
 try:
-    from .config import REDIS_URL, UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN
+    from .config import (
+        REDIS_URL, UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN, REDIS_TRANSPORT,
+        STREAM_GROUP, STREAM_CONSUMER, STREAM_BLOCK_MS, STREAM_READ_COUNT, STREAM_CLAIM_IDLE_MS, STREAM_MAXLEN,
+        POLL_BATCH_SIZE, POLL_BLOCK_SECONDS, POLL_IDLE_MIN, POLL_IDLE_MAX, RELIABLE_QUEUE, RELIABLE_VISIBILITY_TIMEOUT,
+        REDIS_PIPELINE_SIZE, MESSAGE_FORMAT
+    )
+    from .metrics import LISTENER_MESSAGES, LISTENER_HANDOFF_SECONDS, timed
+    from .structured_logging import get_logger
+    from .messages import encode_message, decode_message
 except ImportError:
-    from config import REDIS_URL, UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN
+    from config import (
+        REDIS_URL, UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN, REDIS_TRANSPORT,
+        STREAM_GROUP, STREAM_CONSUMER, STREAM_BLOCK_MS, STREAM_READ_COUNT, STREAM_CLAIM_IDLE_MS, STREAM_MAXLEN,
+        POLL_BATCH_SIZE, POLL_BLOCK_SECONDS, POLL_IDLE_MIN, POLL_IDLE_MAX, RELIABLE_QUEUE, RELIABLE_VISIBILITY_TIMEOUT,
+        REDIS_PIPELINE_SIZE, MESSAGE_FORMAT
+    )
+    from metrics import LISTENER_MESSAGES, LISTENER_HANDOFF_SECONDS, timed
+    from structured_logging import get_logger
+    from messages import encode_message, decode_message
+
+logger = get_logger("redis_client")
 
 # Try to import both Redis clients
 try:
@@ -38,9 +61,28 @@ class UnifiedRedisClient:
     """
     
     def __init__(self):
-        self.client = None
-        self.client_type = None
-        self._connect()
+        self._client = None
+        self._client_type = None
+        self._raw = None
+        self._connect_lock = threading.Lock()
+    
+    def _ensure_connected(self):
+        """Connect on first use; raises ConnectionError while Redis is unreachable"""
+        if self._client is None:
+            with self._connect_lock:
+                if self._client is None:
+                    self._connect()
+    
+    @property
+    def client(self):
+        self._ensure_connected()
+        return self._client
+    
+    @property
+    def client_type(self) -> str:
+        """ "upstash" or "standard" """
+        self._ensure_connected()
+        return self._client_type
     
     def _connect(self):
         """Establish connection using the best available method"""
@@ -50,33 +92,45 @@ class UnifiedRedisClient:
             UPSTASH_REDIS_REST_URL and 
             UPSTASH_REDIS_REST_TOKEN):
             try:
-                self.client = UpstashRedis(
+                client = UpstashRedis(
                     url=UPSTASH_REDIS_REST_URL,
                     token=UPSTASH_REDIS_REST_TOKEN
                 )
                 # Test connection
-                self.client.ping()
-                self.client_type = "upstash"
-                print("✅ Connected to Upstash Redis REST API")
+                client.ping()
+                self._client, self._client_type = client, "upstash"
+                logger.info("✅ Connected to Upstash Redis REST API")
                 return
             except Exception as e:
-                print(f"⚠️  Failed to connect to Upstash Redis: {e}")
+                logger.warning("⚠️  Failed to connect to Upstash Redis: %s", e)
         
         # Priority 2: Fall back to standard Redis
         if REDIS_AVAILABLE and REDIS_URL:
             try:
-                self.client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+                client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
                 # Test connection
-                self.client.ping()
-                self.client_type = "standard"
-                print("✅ Connected to standard Redis")
+                client.ping()
+                self._client, self._client_type = client, "standard"
+                logger.info("✅ Connected to standard Redis")
                 return
             except Exception as e:
-                print(f"⚠️  Failed to connect to standard Redis: {e}")
+                logger.warning("⚠️  Failed to connect to standard Redis: %s", e)
         
         # No connection available
         raise ConnectionError("Could not connect to any Redis instance")
     
+    def raw_client(self):
+        """
+        Second connection to the same standard Redis that returns bytes
+        (decode_responses=False), so message payloads go straight to
+        decode_message() without a str round-trip. Upstash returns str either way.
+        """
+        if self.client_type != "standard":
+            return self.client
+        if self._raw is None:
+            self._raw = redis.Redis.from_url(REDIS_URL, decode_responses=False)
+        return self._raw
+    
     def ping(self) -> bool:
         """Test Redis connection"""
         try:
@@ -99,15 +153,15 @@ class UnifiedRedisClient:
                 # Standard Redis
                 return self.client.publish(channel, message)
         except Exception as e:
-            print(f"Error publishing to Redis: {e}")
+            logger.error("Error publishing to Redis: %s", e)
             return 0
     
-    def subscribe(self, channel: str):
-        """Subscribe to a channel (only works with standard Redis)"""
+    def subscribe(self, channel: str, raw: bool = False):
+        """Subscribe to a channel (only works with standard Redis); raw=True delivers bytes"""
         if self.client_type != "standard":
             raise NotImplementedError("Subscribe only available with standard Redis protocol")
         
-        pubsub = self.client.pubsub()
+        pubsub = (self.raw_client() if raw else self.client).pubsub()
         pubsub.subscribe(channel)
         return pubsub
     
@@ -119,22 +173,27 @@ class UnifiedRedisClient:
             else:
                 return self.client.get(key)
         except Exception as e:
-            print(f"Error getting from Redis: {e}")
+            logger.error("Error getting from Redis: %s", e)
             return None
     
-    def set(self, key: str, value: str, ex: Optional[int] = None) -> bool:
-        """Set key-value pair with optional expiration"""
+    def set(self, key: str, value: str, ex: Optional[int] = None,
+            px: Optional[int] = None, nx: bool = False) -> bool:
+        """
+        Set key-value pair with optional expiration (ex seconds or px milliseconds).
+        With nx=True the key is only set if it does not exist yet; returns False
+        when it already does.
+        """
         try:
             if self.client_type == "upstash":
-                if ex:
+                if ex and not px and not nx:
                     result = self.client.setex(key, ex, value)
                 else:
-                    result = self.client.set(key, value)
-                return result == "OK"
+                    result = self.client.set(key, value, ex=ex, px=px, nx=nx or None)
+                return result in ("OK", True)
             else:
-                return self.client.set(key, value, ex=ex)
+                return bool(self.client.set(key, value, ex=ex, px=px, nx=nx))
         except Exception as e:
-            print(f"Error setting in Redis: {e}")
+            logger.error("Error setting in Redis: %s", e)
             return False
     
     def delete(self, key: str) -> int:
@@ -145,19 +204,419 @@ class UnifiedRedisClient:
             else:
                 return self.client.delete(key)
         except Exception as e:
-            print(f"Error deleting from Redis: {e}")
+            logger.error("Error deleting from Redis: %s", e)
             return 0
     
-    def rpop(self, key: str) -> Optional[str]:
-        """Remove and return the last element from a list"""
+    def eval(self, script: str, keys: list, args: list) -> Any:
+        """Run a Lua script atomically on the server"""
         try:
             if self.client_type == "upstash":
-                return self.client.rpop(key)
+                return self.client.eval(script, keys=keys, args=args)
             else:
-                return self.client.rpop(key)
+                return self.client.eval(script, len(keys), *keys, *args)
         except Exception as e:
-            print(f"Error rpop from Redis: {e}")
+            logger.error("Error running Lua script in Redis: %s", e)
             return None
+    
+    def rpop(self, key: str, count: Optional[int] = None, raw: bool = False):
+        """
+        Remove and return the last element from a list, or with count a list
+        of up to count elements (oldest first for LPUSH producers; None when empty).
+        raw=True returns bytes on standard Redis.
+        """
+        client = self.raw_client() if raw else self.client
+        try:
+            if count is None:
+                return client.rpop(key)
+            return client.rpop(key, count)
+        except Exception as e:
+            logger.error("Error rpop from Redis: %s", e)
+            return None
+    
+    def brpop(self, key: str, timeout: int, raw: bool = False) -> Optional[str]:
+        """
+        Block up to timeout seconds for an element (standard Redis only).
+        Errors are raised so the listener can back off.
+        """
+        if self.client_type != "standard":
+            raise NotImplementedError("BRPOP only available with standard Redis protocol")
+        result = (self.raw_client() if raw else self.client).brpop(key, timeout=timeout)
+        return result[1] if result else None
+    
+    def blmove(self, source: str, destination: str, timeout: int,
+               source_side: str = "RIGHT", destination_side: str = "LEFT") -> Optional[str]:
+        """
+        Block up to timeout seconds to move an element between lists (standard Redis only).
+        Errors are raised so the listener can back off.
+        """
+        if self.client_type != "standard":
+            raise NotImplementedError("BLMOVE only available with standard Redis protocol")
+        return self.client.blmove(source, destination, timeout, source_side, destination_side)
+    
+    def lpush(self, key: str, *values: str) -> int:
+        """Push values onto the head of a list; returns the new length"""
+        try:
+            return int(self.client.lpush(key, *values) or 0)
+        except Exception as e:
+            logger.error("Error lpush to Redis: %s", e)
+            return 0
+    
+    def lrange(self, key: str, start: int, stop: int) -> List[str]:
+        """Elements start..stop (inclusive) of a list; errors are raised"""
+        return list(self.client.lrange(key, start, stop) or [])
+    
+    def llen(self, key: str) -> int:
+        """Length of a list (0 on error)"""
+        try:
+            return int(self.client.llen(key) or 0)
+        except Exception as e:
+            logger.error("Error reading list length from Redis: %s", e)
+            return 0
+    
+    def lrem(self, key: str, count: int, value: str) -> int:
+        """Remove up to count occurrences of value from a list; errors are raised"""
+        return int(self.client.lrem(key, count, value) or 0)
+    
+    # Sorted sets
+    
+    def zadd(self, key: str, mapping: Dict[str, float]) -> int:
+        """Add members with their scores; returns the number added. Errors are raised."""
+        return int(self.client.zadd(key, mapping) or 0)
+    
+    def zrem(self, key: str, *members: str) -> int:
+        """Remove members; returns the number removed (0 on error)"""
+        try:
+            return int(self.client.zrem(key, *members) or 0)
+        except Exception as e:
+            logger.error("Error removing sorted set members in Redis: %s", e)
+            return 0
+    
+    def zcard(self, key: str) -> int:
+        """Number of members of a sorted set (0 on error)"""
+        try:
+            return int(self.client.zcard(key) or 0)
+        except Exception as e:
+            logger.error("Error reading sorted set size from Redis: %s", e)
+            return 0
+    
+    # Streams (REDIS_TRANSPORT=streams)
+    
+    def xadd(self, key: str, fields: Dict[str, str], maxlen: Optional[int] = None) -> Optional[str]:
+        """Append an entry to a stream, trimming it to about maxlen entries; returns the entry id"""
+        try:
+            if self.client_type == "upstash":
+                return self.client.xadd(key, "*", fields, maxlen=maxlen or None, approximate_trim=True)
+            else:
+                return self.client.xadd(key, fields, maxlen=maxlen or None, approximate=True)
+        except Exception as e:
+            logger.error("Error adding to Redis stream: %s", e)
+            return None
+    
+    def xgroup_create(self, key: str, group: str, start_id: str = "0") -> bool:
+        """Create a consumer group (and the stream) unless it already exists"""
+        try:
+            if self.client_type == "upstash":
+                self.client.xgroup_create(key, group, start_id, mkstream=True)
+            else:
+                self.client.xgroup_create(key, group, id=start_id, mkstream=True)
+            return True
+        except Exception as e:
+            if "BUSYGROUP" in str(e):
+                return True
+            logger.error("Error creating Redis consumer group: %s", e)
+            return False
+    
+    def xreadgroup(self, group: str, consumer: str, key: str, start_id: str = ">",
+                   count: Optional[int] = None, block_ms: Optional[int] = None) -> List[Tuple[str, Dict[str, str]]]:
+        """
+        Read entries for a consumer as [(entry_id, fields)]. start_id ">" reads
+        new entries; an entry id re-reads the consumer's pending entries after it.
+        Errors are raised so the listener can back off.
+        """
+        if self.client_type == "upstash":
+            # The REST API cannot hold a request open, so never block
+            result = self.client.xreadgroup(group, consumer, {key: start_id}, count=count)
+        else:
+            result = self.client.xreadgroup(group, consumer, {key: start_id}, count=count, block=block_ms)
+        entries = []
+        for stream in (result.values() if isinstance(result, dict) else [s[1] for s in result or []]):
+            entries.extend(_stream_entries(stream))
+        return entries
+    
+    def xack(self, key: str, group: str, entry_ids: List[str]) -> int:
+        """Acknowledge processed entries so they leave the group's pending list"""
+        try:
+            return int(self.client.xack(key, group, *entry_ids) or 0)
+        except Exception as e:
+            logger.error("Error acknowledging Redis stream entries: %s", e)
+            return 0
+    
+    def xautoclaim(self, key: str, group: str, consumer: str, min_idle_ms: int, start_id: str = "0-0",
+                   count: Optional[int] = None) -> Tuple[str, List[Tuple[str, Dict[str, str]]], List[str]]:
+        """
+        Take over pending entries idle for at least min_idle_ms.
+        Returns (next start id, claimed entries, ids of entries deleted meanwhile).
+        """
+        result = self.client.xautoclaim(key, group, consumer, min_idle_ms, start_id, count=count)
+        next_id, claimed = result[0], result[1]
+        deleted = list(result[2]) if len(result) > 2 else []
+        return next_id, _stream_entries(claimed), deleted
+    
+    # Batches
+    
+    def pipeline(self, transaction: bool = False) -> "RedisPipeline":
+        """
+        Queue commands and send them together on execute(): a redis-py
+        pipeline, or one request to Upstash's /pipeline endpoint
+        (/multi-exec with transaction=True)
+        """
+        return RedisPipeline(self, transaction=transaction)
+    
+    def mget(self, keys: List[str]) -> List[Optional[str]]:
+        """Values of several keys in one command, None for missing keys"""
+        if not keys:
+            return []
+        try:
+            if self.client_type == "upstash":
+                return list(self.client.mget(*keys))
+            else:
+                return list(self.client.mget(keys))
+        except Exception as e:
+            logger.error("Error getting keys from Redis: %s", e)
+            return [None] * len(keys)
+    
+    def mset(self, mapping: Dict[str, str], ex: Optional[int] = None) -> bool:
+        """
+        Set several keys at once. MSET cannot expire keys, so with ex each key
+        is written with SET ... EX instead, pipelined.
+        """
+        if not mapping:
+            return True
+        if ex:
+            pipe = self.pipeline()
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=ex)
+            return all(result is True for result in pipe.execute())
+        try:
+            return self.client.mset(mapping) in ("OK", True)
+        except Exception as e:
+            logger.error("Error setting keys in Redis: %s", e)
+            return False
+
+def _is_ok(result) -> bool:
+    return result in ("OK", True)
+
+class RedisPipeline:
+    """
+    Commands queued on a UnifiedRedisClient and sent together by execute().
+
+    The methods mirror the client's and return the pipeline, so calls can be
+    chained. execute() returns one result per command, in order and converted
+    like the client method's result (set -> bool, publish -> int). A failed
+    command has its exception in place of a result; if the round-trip itself
+    fails, every command in it gets that error.
+
+    Pipelines of more than REDIS_PIPELINE_SIZE commands are sent in several
+    round-trips, unless transaction=True (one MULTI/EXEC).
+
+        pipe = redis_client.pipeline()
+        for key, value in values.items():
+            pipe.set(key, value, ex=60)
+        results = pipe.execute()
+    """
+
+    def __init__(self, client: UnifiedRedisClient, transaction: bool = False,
+                 max_commands: int = REDIS_PIPELINE_SIZE):
+        self.client = client
+        self.transaction = transaction
+        self.max_commands = max(1, int(max_commands))
+        self.upstash = client.client_type == "upstash"
+        # (function queuing the command on the backend pipeline, result conversion)
+        self._commands = []
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __bool__(self):
+        # An empty pipeline is still a pipeline (`pipe or client` must not pick the client)
+        return True
+
+    def _queue(self, command, convert=None) -> "RedisPipeline":
+        self._commands.append((command, convert))
+        return self
+
+    def get(self, key: str) -> "RedisPipeline":
+        return self._queue(lambda pipe: pipe.get(key))
+
+    def set(self, key: str, value: str, ex: Optional[int] = None,
+            px: Optional[int] = None, nx: bool = False) -> "RedisPipeline":
+        return self._queue(lambda pipe: pipe.set(key, value, ex=ex, px=px, nx=nx or None), _is_ok)
+
+    def delete(self, *keys: str) -> "RedisPipeline":
+        return self._queue(lambda pipe: pipe.delete(*keys), int)
+
+    def expire(self, key: str, seconds: int) -> "RedisPipeline":
+        return self._queue(lambda pipe: pipe.expire(key, seconds), bool)
+
+    def incr(self, key: str) -> "RedisPipeline":
+        return self._queue(lambda pipe: pipe.incr(key), int)
+
+    def publish(self, channel: str, message: str) -> "RedisPipeline":
+        return self._queue(lambda pipe: pipe.publish(channel, message), lambda result: int(result or 0))
+
+    def lpush(self, key: str, *values: str) -> "RedisPipeline":
+        return self._queue(lambda pipe: pipe.lpush(key, *values), lambda result: int(result or 0))
+
+    def xadd(self, key: str, fields: Dict[str, str], maxlen: Optional[int] = None) -> "RedisPipeline":
+        if self.upstash:
+            return self._queue(lambda pipe: pipe.xadd(key, "*", fields, maxlen=maxlen or None, approximate_trim=True))
+        return self._queue(lambda pipe: pipe.xadd(key, fields, maxlen=maxlen or None, approximate=True))
+
+    def eval(self, script: str, keys: list, args: list) -> "RedisPipeline":
+        if self.upstash:
+            return self._queue(lambda pipe: pipe.eval(script, keys=keys, args=args))
+        return self._queue(lambda pipe: pipe.eval(script, len(keys), *keys, *args))
+
+    def execute(self) -> List[Any]:
+        """Send the queued commands and return their results; the pipeline is left empty"""
+        commands, self._commands = self._commands, []
+        if not commands:
+            return []
+        size = len(commands) if self.transaction else self.max_commands
+        results = []
+        for start in range(0, len(commands), size):
+            results.extend(self._send(commands[start:start + size]))
+        return results
+
+    def _send(self, commands) -> List[Any]:
+        try:
+            with timed("redis_pipeline"):
+                if self.upstash:
+                    pipe = self.client.client.multi() if self.transaction else self.client.client.pipeline()
+                else:
+                    pipe = self.client.client.pipeline(transaction=self.transaction)
+                for command, _ in commands:
+                    command(pipe)
+                raw = pipe.exec() if self.upstash else pipe.execute(raise_on_error=False)
+        except Exception as e:
+            logger.error("Error executing Redis pipeline of %d commands: %s", len(commands), e)
+            return [e] * len(commands)
+        return [
+            result if convert is None or isinstance(result, Exception) else convert(result)
+            for (_, convert), result in zip(commands, raw)
+        ]
+
+def _stream_entries(entries) -> List[Tuple[str, Dict[str, str]]]:
+    """Normalize stream entries from either client to [(entry_id, {field: value})]"""
+    normalized = []
+    for entry_id, fields in entries or []:
+        if fields is None:
+            # Trimmed or deleted after delivery
+            normalized.append((entry_id, None))
+        elif isinstance(fields, dict):
+            normalized.append((entry_id, fields))
+        else:
+            normalized.append((entry_id, dict(zip(fields[::2], fields[1::2]))))
+    return normalized
+
+# Reliable list queue (RELIABLE_QUEUE=true). In-flight messages are tracked in a
+# sorted set scored by the server time they were taken; each member is
+# "<processing list>|<delivery id>|<message>" so the reaper knows which list
+# holds it. Channel names must not contain "|".
+
+RELIABLE_POP_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = now[1] * 1000 + math.floor(now[2] / 1000)
+local members = {}
+for i = 1, tonumber(ARGV[1]) do
+    local message = redis.call('LMOVE', KEYS[1], KEYS[2], 'RIGHT', 'LEFT')
+    if not message then break end
+    local member = KEYS[2] .. '|' .. redis.call('INCR', KEYS[4]) .. '|' .. message
+    redis.call('ZADD', KEYS[3], now_ms, member)
+    members[#members + 1] = member
+end
+return members
+"""
+
+RELIABLE_ACK_SCRIPT = """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 1 then
+    redis.call('LREM', KEYS[1], -1, ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELIABLE_REAP_SCRIPT = """
+local now = redis.call('TIME')
+local cutoff = now[1] * 1000 + math.floor(now[2] / 1000) - tonumber(ARGV[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', cutoff, 'LIMIT', 0, tonumber(ARGV[2]))
+for _, member in ipairs(expired) do
+    local first = string.find(member, '|', 1, true)
+    local second = string.find(member, '|', first + 1, true)
+    local processing = string.sub(member, 1, first - 1)
+    local message = string.sub(member, second + 1)
+    redis.call('ZREM', KEYS[1], member)
+    if redis.call('LREM', processing, -1, message) > 0 then
+        redis.call('RPUSH', KEYS[2], message)
+    end
+end
+return #expired
+"""
+
+class ReliableListQueue:
+    """
+    At-least-once consumption of the list REDIS_CHANNEL
+    
+    pop() atomically moves messages into this consumer's processing list and
+    records when they were taken (one Lua round-trip). ack() removes a handled
+    message. reap() pushes messages in flight longer than the visibility
+    timeout - their consumer crashed or is stuck - back onto the queue, where
+    they are popped next. Any agent's reaper covers every consumer.
+    """
+    
+    def __init__(self, redis_client: "UnifiedRedisClient", channel: str, consumer: str = STREAM_CONSUMER,
+                 visibility_timeout: float = RELIABLE_VISIBILITY_TIMEOUT):
+        self.redis_client = redis_client
+        self.key = channel
+        self.processing_key = f"{channel}:processing:{consumer}"
+        self.inflight_key = f"{channel}:inflight"
+        self.sequence_key = f"{channel}:inflight:seq"
+        self.visibility_timeout = visibility_timeout
+        self._next_reap = 0.0
+    
+    def pop(self, count: int) -> List[Tuple[str, str]]:
+        """Take up to count messages as [(member, message)]"""
+        members = self.redis_client.eval(
+            RELIABLE_POP_SCRIPT, [self.key, self.processing_key, self.inflight_key, self.sequence_key], [count])
+        prefix = len(self.processing_key) + 1
+        return [(member, member[prefix:].split("|", 1)[1]) for member in members or []]
+    
+    def wait(self, timeout: int):
+        """
+        Block until the queue has a message, without taking it (standard Redis).
+        Moving the tail element onto the tail leaves the list unchanged.
+        """
+        self.redis_client.blmove(self.key, self.key, timeout, "RIGHT", "RIGHT")
+    
+    def ack(self, member: str, message: str) -> bool:
+        """Drop a handled message; False if the reaper already re-queued it"""
+        return self.redis_client.eval(
+            RELIABLE_ACK_SCRIPT, [self.processing_key, self.inflight_key], [member, message]) == 1
+    
+    def reap(self, limit: int = 100) -> int:
+        """Re-queue messages in flight longer than the visibility timeout"""
+        requeued = self.redis_client.eval(
+            RELIABLE_REAP_SCRIPT, [self.inflight_key, self.key], [int(self.visibility_timeout * 1000), limit]) or 0
+        if requeued:
+            logger.warning("♻️ Re-queued %d messages in flight longer than %ss on %s",
+                           requeued, self.visibility_timeout, self.key)
+        return requeued
+    
+    def reap_if_due(self):
+        now = time.monotonic()
+        if now >= self._next_reap:
+            self._next_reap = now + max(1.0, self.visibility_timeout / 4)
+            self.reap()
 
 class RedisMessageListener:
     """
@@ -175,93 +634,257 @@ class RedisMessageListener:
         """Listen for messages and call callback_func for each message"""
         self.running = True
         
-        if self.redis_client.client_type == "standard":
+        if self.redis_client.client_type == "standard" and REDIS_TRANSPORT != "list":
             # Use proper pub/sub for standard Redis
             self._listen_pubsub(callback_func)
         else:
-            # Use polling for Upstash Redis REST API
+            # Use polling for Upstash Redis REST API (or REDIS_TRANSPORT=list)
             self._listen_polling(callback_func)
     
+    def _dispatch(self, transport: str, callback_func, data):
+        """Hand one decoded message to the callback, recording hand-off time and outcome"""
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            callback_func(data)
+            outcome = "ok"
+        finally:
+            elapsed = time.perf_counter() - started
+            LISTENER_HANDOFF_SECONDS.labels(transport).observe(elapsed)
+            LISTENER_MESSAGES.labels(transport, outcome).inc()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Message handed off (%s)", outcome,
+                             extra={"stage": "listener", "duration_ms": round(elapsed * 1000, 1)})
+    
     def _listen_pubsub(self, callback_func):
         """Listen using Redis pub/sub (standard Redis only)"""
-        pubsub = self.redis_client.subscribe(self.channel)
-        print(f"Agent listening on Redis channel {self.channel} (pub/sub)")
+        pubsub = self.redis_client.subscribe(self.channel, raw=True)
+        logger.info("Agent listening on Redis channel %s (pub/sub)", self.channel)
         
         for item in pubsub.listen():
             if not self.running:
                 break
             if item["type"] == "message":
                 try:
-                    data = json.loads(item["data"])
-                    callback_func(data)
+                    data = decode_message(item["data"])
+                    self._dispatch("pubsub", callback_func, data)
                 except Exception as exc:
-                    print("Error handling message:", exc)
+                    logger.exception("Error handling message: %s", exc)
     
     def _listen_polling(self, callback_func):
-        """Listen using polling (for Upstash REST API)"""
-        print(f"🎯 Agent listening on Redis channel {self.channel} (polling)")
+        """
+        Listen by popping from the list REDIS_CHANNEL (Upstash REST API, or REDIS_TRANSPORT=list)
+        
+        Each request pops up to POLL_BATCH_SIZE messages. When the list is
+        empty, standard Redis waits in BRPOP so the next message is handed over
+        as soon as it is pushed; Upstash cannot block over REST, so the idle
+        delay doubles from POLL_IDLE_MIN up to POLL_IDLE_MAX (with jitter, so
+        several agents do not poll in lockstep) and resets on the next message.
+        
+        With RELIABLE_QUEUE, messages go through a ReliableListQueue instead
+        and stay in this consumer's processing list until acknowledged.
+        """
+        blocking = self.redis_client.client_type == "standard"
+        reliable = ReliableListQueue(self.redis_client, self.channel) if RELIABLE_QUEUE else None
+        logger.info("🎯 Agent listening on Redis list %s (%s%s, up to %d per pop)", self.channel,
+                    "BRPOP" if blocking else "polling", ", reliable" if reliable else "", POLL_BATCH_SIZE)
         
         consecutive_errors = 0
         max_consecutive_errors = 5
+        idle_delay = POLL_IDLE_MIN
         
         while self.running:
             try:
-                # Use RPOP to get messages from the list (FIFO queue)
-                # Messages are added with LPUSH, so RPOP gives oldest first
-                message = self.redis_client.rpop(self.channel)
+                if reliable is not None:
+                    reliable.reap_if_due()
+                    messages = [(message, functools.partial(reliable.ack, member, message))
+                                for member, message in reliable.pop(POLL_BATCH_SIZE)]
+                    if not messages and blocking:
+                        # Wait for the next message, then take it atomically on the next pass
+                        reliable.wait(POLL_BLOCK_SECONDS)
+                        continue
+                else:
+                    # Messages are added with LPUSH, so RPOP gives oldest first
+                    popped = self.redis_client.rpop(self.channel, POLL_BATCH_SIZE, raw=True)
+                    messages = [(message, None) for message in popped or []]
+                    if not messages and blocking:
+                        message = self.redis_client.brpop(self.channel, POLL_BLOCK_SECONDS, raw=True)
+                        messages = [(message, None)] if message is not None else []
                 
                 # Reset error counter on successful Redis operation
                 consecutive_errors = 0
-                
-                if message:
-                    try:
-                        print(f"📨 Processing message from {self.channel}")
-                        
-                        # Handle different message formats
-                        if isinstance(message, list) and len(message) > 0:
-                            # Message is a list with JSON string as first element
-                            message_str = message[0]
-                        elif isinstance(message, str):
-                            # Message is already a string
-                            message_str = message
-                        else:
-                            # Message is already parsed
-                            data = message
-                            print(f"🔄 Calling callback for incident processing...")
-                            callback_func(data)
-                            print(f"✅ Message processed successfully")
-                            continue
-                        
-                        # Parse JSON string to dict
-                        data = json.loads(message_str)
-                        print(f"🔄 Calling callback for incident processing...")
-                        callback_func(data)
-                        print(f"✅ Message processed successfully")
-                        
-                    except Exception as exc:
-                        print(f"❌ Error handling message: {exc}")
-                        print(f"📄 Raw message: {message}")
-                        import traceback
-                        traceback.print_exc()
-                else:
-                    # No messages, wait a bit before checking again
-                    print("⏳ No messages, waiting...")
-                    time.sleep(2)
-                
             except Exception as e:
                 consecutive_errors += 1
-                print(f"❌ Error in polling loop (#{consecutive_errors}): {e}")
+                logger.error("❌ Error in polling loop (#%d): %s", consecutive_errors, e)
                 
                 if consecutive_errors >= max_consecutive_errors:
-                    print(f"🚨 Too many consecutive errors ({consecutive_errors}), stopping listener")
+                    logger.critical("🚨 Too many consecutive errors (%d), stopping listener", consecutive_errors)
                     break
                     
                 time.sleep(5)  # Wait longer on error
+                continue
+            
+            if not messages:
+                if not blocking:
+                    logger.debug("⏳ No messages, waiting %.2fs", idle_delay)
+                    time.sleep(random.uniform(idle_delay / 2, idle_delay))
+                    idle_delay = min(POLL_IDLE_MAX, idle_delay * 2)
+                continue
+            
+            idle_delay = POLL_IDLE_MIN
+            for message, ack in messages:
+                self._handle_list_message(callback_func, message, ack)
+    
+    def _handle_list_message(self, callback_func, message, ack=None):
+        """Decode and dispatch one list message; ack (reliable queue) is attached for acknowledge()"""
+        try:
+            logger.debug("📨 Processing message from %s", self.channel)
+            # Upstash may hand back already-parsed JSON
+            data = decode_message(message) if isinstance(message, (str, bytes)) else message
+        except ValueError as exc:
+            data, error = None, exc
+        else:
+            error = "not a JSON object"
+        
+        if ack is not None:
+            if not isinstance(data, dict):
+                # Never processable: acknowledge so the reaper does not re-queue it forever
+                logger.error("❌ Dropping malformed message: %s (raw message: %.200s)", error, message)
+                ack()
+                return
+            data["_ack"] = ack
+        try:
+            self._dispatch("polling", callback_func, data)
+        except Exception as exc:
+            # With the reliable queue the message stays in flight and is re-queued by the reaper
+            logger.exception("❌ Error handling message: %s (raw message: %.200s)", exc, message)
     
     def stop(self):
         """Stop listening"""
         self.running = False
 
+def stream_key(channel: str) -> str:
+    """Stream carrying a channel's messages when REDIS_TRANSPORT=streams"""
+    return f"{channel}:stream"
+
+class StreamMessageListener(RedisMessageListener):
+    """
+    Consumer-group listener on a Redis Stream (REDIS_TRANSPORT=streams)
+    
+    Every agent process joins STREAM_GROUP as its own consumer, so each entry
+    goes to exactly one agent and adding processes adds capacity. Entries stay
+    in the group's pending list until the handler acknowledges them with
+    acknowledge(data) after successful processing; entries left pending by a
+    crashed consumer for STREAM_CLAIM_IDLE_MS are taken over with XAUTOCLAIM.
+    On start the consumer first re-reads its own pending entries.
+    """
+    
+    def __init__(self, redis_client: UnifiedRedisClient, channel: str, group: str = STREAM_GROUP,
+                 consumer: str = STREAM_CONSUMER, block_ms: int = STREAM_BLOCK_MS,
+                 count: int = STREAM_READ_COUNT, claim_idle_ms: int = STREAM_CLAIM_IDLE_MS):
+        super().__init__(redis_client, channel)
+        self.key = stream_key(channel)
+        self.group = group
+        self.consumer = consumer
+        self.block_ms = block_ms
+        self.count = max(1, count)
+        self.claim_idle_ms = claim_idle_ms
+    
+    def listen(self, callback_func):
+        """Read entries for this consumer and call callback_func for each message"""
+        self.running = True
+        if not self.redis_client.xgroup_create(self.key, self.group):
+            raise ConnectionError(f"Could not create consumer group {self.group} on {self.key}")
+        logger.info("🎯 Agent listening on Redis stream %s as %s/%s", self.key, self.group, self.consumer)
+        
+        # "0-0" re-reads entries delivered to this consumer before a restart; ">" reads new ones
+        start_id = "0-0"
+        next_claim = time.monotonic()
+        consecutive_errors = 0
+        max_consecutive_errors = 5
+        
+        while self.running:
+            if self.claim_idle_ms > 0 and time.monotonic() >= next_claim:
+                next_claim = time.monotonic() + self.claim_idle_ms / 2000
+                try:
+                    self._claim_stale(callback_func)
+                except Exception as e:
+                    # e.g. Redis < 6.2 has no XAUTOCLAIM; reading new entries still works
+                    logger.warning("⚠️ Could not claim stale stream entries: %s", e)
+            
+            try:
+                block_ms = self.block_ms if start_id == ">" else None
+                entries = self.redis_client.xreadgroup(self.group, self.consumer, self.key, start_id,
+                                                       count=self.count, block_ms=block_ms)
+                consecutive_errors = 0
+            except Exception as e:
+                consecutive_errors += 1
+                logger.error("❌ Error reading Redis stream (#%d): %s", consecutive_errors, e)
+                if consecutive_errors >= max_consecutive_errors:
+                    logger.critical("🚨 Too many consecutive errors (%d), stopping listener", consecutive_errors)
+                    break
+                time.sleep(5)
+                continue
+            
+            if start_id != ">":
+                if not entries:
+                    start_id = ">"
+                    continue
+                # Page through the pending entries instead of re-reading the same ones
+                start_id = entries[-1][0]
+            elif not entries and self.redis_client.client_type == "upstash":
+                time.sleep(min(self.block_ms, 1000) / 1000)
+            
+            for entry_id, fields in entries:
+                self._deliver(callback_func, entry_id, fields)
+    
+    def ack(self, entry_id: str) -> bool:
+        return self.redis_client.xack(self.key, self.group, [entry_id]) > 0
+    
+    def _claim_stale(self, callback_func):
+        """Take over and process entries a crashed consumer left unacknowledged"""
+        start_id = "0-0"
+        claimed = 0
+        while self.running:
+            start_id, entries, deleted = self.redis_client.xautoclaim(
+                self.key, self.group, self.consumer, self.claim_idle_ms, start_id, count=self.count)
+            if deleted:
+                self.redis_client.xack(self.key, self.group, deleted)
+            for entry_id, fields in entries:
+                self._deliver(callback_func, entry_id, fields)
+            claimed += len(entries)
+            if start_id == "0-0" or not entries:
+                break
+        if claimed:
+            logger.warning("♻️ Claimed %d stale entries from %s", claimed, self.key)
+    
+    def _deliver(self, callback_func, entry_id: str, fields: Optional[Dict[str, str]]):
+        try:
+            data = decode_message(fields["data"]) if fields and "data" in fields else fields
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            # Never processable: acknowledge so it does not come back forever
+            logger.error("❌ Dropping malformed stream entry %s: %.200s", entry_id, fields)
+            self.ack(entry_id)
+            return
+        
+        data["_ack"] = functools.partial(self.ack, entry_id)
+        try:
+            self._dispatch("streams", callback_func, data)
+        except Exception as exc:
+            # Left pending: XAUTOCLAIM retries it after STREAM_CLAIM_IDLE_MS
+            logger.exception("Error handling stream entry %s: %s", entry_id, exc)
+
+def acknowledge(data: Any) -> bool:
+    """
+    Mark a received message as processed. A no-op for pub/sub and list
+    messages; for stream messages it XACKs the entry. Call it once the
+    message is fully handled (or can never be handled).
+    """
+    ack = data.pop("_ack", None) if isinstance(data, dict) else None
+    return ack() if ack is not None else False
+
 # Create global Redis client instance
 redis_client = UnifiedRedisClient()
 
@@ -269,11 +892,82 @@ def get_redis_client() -> UnifiedRedisClient:
     """Get the global Redis client instance"""
     return redis_client
 
+@functools.lru_cache(maxsize=None)
+def publish_format() -> str:
+    """
+    MESSAGE_FORMAT, except that msgpack (bytes) is only published where the
+    agent reads raw bytes: pub/sub and plain lists on standard Redis.
+    Decided on the first publish, so importing this module does not connect.
+    """
+    if MESSAGE_FORMAT != "msgpack":
+        return "json"
+    if (REDIS_TRANSPORT in ("streams", "postgres") or RELIABLE_QUEUE
+            or redis_client.client_type != "standard"):
+        logger.warning("⚠️ MESSAGE_FORMAT=msgpack needs standard Redis with the pubsub or list transport "
+                       "(and no RELIABLE_QUEUE); publishing JSON")
+        return "json"
+    return "msgpack"
+
+def publishes_to_list() -> bool:
+    """
+    True where agents consume the list REDIS_CHANNEL rather than pub/sub:
+    REDIS_TRANSPORT=list, and Upstash, which has no pub/sub to listen on
+    (mirrors RedisMessageListener.listen)
+    """
+    return REDIS_TRANSPORT == "list" or (REDIS_TRANSPORT == "pubsub" and redis_client.client_type != "standard")
+
 def publish_message(channel: str, data: Dict[str, Any]) -> int:
-    """Convenience function to publish JSON messages"""
-    message = json.dumps(data)
+    """
+    Convenience function to publish JSON messages on the configured transport.
+    Returns the number of subscribers reached (pub/sub) or 1 once the message
+    is stored in the stream or list (or sent with NOTIFY).
+    """
+    if REDIS_TRANSPORT == "postgres":
+        return publish_many(channel, [data])
+    message = encode_message(data, publish_format())
+    if REDIS_TRANSPORT == "streams":
+        return 1 if redis_client.xadd(stream_key(channel), {"data": message}, maxlen=STREAM_MAXLEN) else 0
+    if publishes_to_list():
+        return 1 if redis_client.lpush(channel, message) else 0
     return redis_client.publish(channel, message)
 
+def publish_many(channel: str, items: List[Dict[str, Any]]) -> int:
+    """
+    Publish several JSON messages on the configured transport in as few
+    round-trips as possible. Returns the number of messages stored in the
+    stream or list (or sent with NOTIFY), or the total subscribers reached (pub/sub).
+    """
+    if REDIS_TRANSPORT == "postgres":
+        try:
+            from .pg_notify import notify_many
+        except ImportError:
+            from pg_notify import notify_many
+        return notify_many(channel, items)
+    messages = [encode_message(data, publish_format()) for data in items]
+    pipe = redis_client.pipeline()
+    if publishes_to_list():
+        # One LPUSH per chunk; pushed in order, so consumers RPOP them in order
+        chunks = [messages[start:start + REDIS_PIPELINE_SIZE] for start in range(0, len(messages), REDIS_PIPELINE_SIZE)]
+        for chunk in chunks:
+            pipe.lpush(channel, *chunk)
+        return sum(len(chunk) for chunk, result in zip(chunks, pipe.execute()) if not isinstance(result, Exception) and result)
+    if REDIS_TRANSPORT == "streams":
+        for message in messages:
+            pipe.xadd(stream_key(channel), {"data": message}, maxlen=STREAM_MAXLEN)
+        return sum(1 for result in pipe.execute() if result and not isinstance(result, Exception))
+    for message in messages:
+        pipe.publish(channel, message)
+    return sum(result for result in pipe.execute() if not isinstance(result, Exception))
+
 def create_message_listener(channel: str) -> RedisMessageListener:
-    """Create a message listener for the specified channel"""
+    """Create a message listener for the specified channel on the configured transport"""
+    if REDIS_TRANSPORT == "postgres":
+        # Imported here: only this transport needs psycopg in the listener
+        try:
+            from .pg_notify import PostgresNotifyListener
+        except ImportError:
+            from pg_notify import PostgresNotifyListener
+        return PostgresNotifyListener(channel)
+    if REDIS_TRANSPORT == "streams":
+        return StreamMessageListener(redis_client, channel)
     return RedisMessageListener(redis_client, channel)
\ No newline at end of file
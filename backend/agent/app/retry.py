@@ -0,0 +1,306 @@
+"""
+Retries and dead letters for incidents whose processing failed
+
+Without this, an exception in any stage was logged and the incident dropped.
+With RETRY_ENABLED the agent hands the failed message to RetryScheduler.fail():
+
+1. The error is classified. Timeouts, connection and database availability
+   errors, rate limits and 5xx responses (TransientError) are worth retrying;
+   rejected requests (PermanentError), bad data and programming errors are
+   not. Unknown errors count as transient, so they get a bounded number of
+   retries.
+2. A transient failure is added to the sorted set "<channel>:retry", scored
+   by the time it is due: RETRY_BASE_DELAY * 2^(attempt - 1), capped at
+   RETRY_MAX_DELAY and jittered, so an outage is probed less and less often
+   and a burst of failures does not come back as a burst.
+3. Permanent failures, and messages that failed RETRY_MAX_ATTEMPTS times, are
+   pushed onto the dead-letter list "<channel>:dead" with the error, to be
+   inspected and requeued with tests/dead_letters.py.
+
+Once a message is stored in either place the original delivery is
+acknowledged. A background thread in every agent re-publishes retries when
+they fall due. A due entry is claimed first (its score moved CLAIM_SECONDS
+ahead) and only removed after it was re-published, so an agent that dies in
+between leaves it for the next poll instead of losing it.
+
+The retry state travels in the message itself:
+
+    {"incident_id": 123, "retry": {"attempt": 2, "first_failed_at": 1714564800.0,
+                                   "last_error": "TransientError: OpenAI API error: 503 - ..."}}
+
+Other keys the caller put in "retry" are kept across attempts; the agent
+records the notification results there once Slack/email went out, so a retry
+of a later failure does not notify again.
+
+The incident row stays "open" while it waits for a retry or sits on the
+dead-letter list, so the scheduler also records its state under
+"<channel>:failed:<incident_id>" (the retry state, "retry" or "dead", and when
+a retry is due). The sweeper reads it to leave those incidents alone; the
+agent deletes it once a retried incident is processed, and requeue() when an
+entry leaves the dead-letter list.
+"""
+
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Handle both relative and absolute imports
+try:
+    from .config import (
+        REDIS_CHANNEL, RETRY_ENABLED, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+        RETRY_POLL_INTERVAL, RETRY_BATCH_SIZE
+    )
+    from .metrics import RETRY_EVENTS
+    from .structured_logging import get_logger
+    from . import codec
+except ImportError:
+    from config import (
+        REDIS_CHANNEL, RETRY_ENABLED, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+        RETRY_POLL_INTERVAL, RETRY_BATCH_SIZE
+    )
+    from metrics import RETRY_EVENTS
+    from structured_logging import get_logger
+    import codec
+
+logger = get_logger("retry")
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+# Seconds a claimed retry stays hidden from other agents while it is re-published
+CLAIM_SECONDS = 60
+
+# Seconds a failed incident's state is kept (well past SWEEPER_MAX_AGE)
+FAILED_STATE_TTL = 7 * 86400
+
+
+class TransientError(Exception):
+    """A failure worth retrying: an upstream timeout, rate limit or 5xx response"""
+
+
+class PermanentError(Exception):
+    """A failure retrying cannot fix: a rejected request or unusable data"""
+
+
+# Exception class names (anywhere in the hierarchy) that retrying will not fix
+_PERMANENT_ERROR_NAMES = {
+    "DataError", "IntegrityError", "ProgrammingError", "NotSupportedError",  # psycopg
+    "ValueError", "TypeError", "KeyError", "AttributeError", "IndexError",
+}
+
+
+def classify_error(exc: BaseException) -> str:
+    """TRANSIENT or PERMANENT"""
+    if isinstance(exc, PermanentError):
+        return PERMANENT
+    if isinstance(exc, TransientError):
+        return TRANSIENT
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    return PERMANENT if names & _PERMANENT_ERROR_NAMES else TRANSIENT
+
+
+# Take up to ARGV[3] entries due by ARGV[1] (ms) and hide them until ARGV[2]
+CLAIM_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+for _, member in ipairs(due) do
+    redis.call('ZADD', KEYS[1], 'XX', ARGV[2], member)
+end
+return due
+"""
+
+
+class RetryScheduler:
+    """Delayed retries in a Redis sorted set, plus a dead-letter list"""
+
+    def __init__(self, redis_client, channel: str, publish: Callable[[str, List[Dict[str, Any]]], int],
+                 max_attempts: int = 5, base_delay: float = 5.0, max_delay: float = 300.0,
+                 poll_interval: float = 1.0, batch_size: int = 100):
+        self.redis = redis_client
+        self.channel = channel
+        self.publish = publish
+        self.retry_key = f"{channel}:retry"
+        self.dead_key = f"{channel}:dead"
+        self.failed_prefix = f"{channel}:failed:"
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+        self.poll_interval = max(0.05, float(poll_interval))
+        self.batch_size = max(1, int(batch_size))
+        self.thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._counts = {"scheduled": 0, "dead_lettered": 0, "republished": 0, "requeued": 0, "store_failed": 0}
+
+    def _count(self, outcome: str, amount: int = 1):
+        RETRY_EVENTS.labels(outcome).inc(amount)
+        with self._lock:
+            self._counts[outcome] += amount
+
+    def delay(self, attempt: int) -> float:
+        """Seconds before retry number `attempt`: exponential, capped, between half and all of it"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def fail(self, data: Any, exc: BaseException) -> bool:
+        """
+        Schedule a retry of a failed message, or dead-letter it. Returns True
+        once it is stored in Redis, after which the original delivery can be
+        acknowledged; False leaves it to the transport's own redelivery.
+        """
+        if not isinstance(data, dict):
+            return False
+        # Drop transport bookkeeping such as the _ack callback
+        message = {key: value for key, value in data.items() if not key.startswith("_")}
+        retry = message.get("retry") if isinstance(message.get("retry"), dict) else {}
+        attempt = int(retry.get("attempt", 0) or 0) + 1
+        kind = classify_error(exc)
+        error = f"{type(exc).__name__}: {exc}"[:500]
+        now = time.time()
+        message["retry"] = {**retry, "attempt": attempt, "first_failed_at": retry.get("first_failed_at", now),
+                            "last_error": error}
+        incident_id = message.get("incident_id")
+
+        try:
+            if kind == PERMANENT or attempt >= self.max_attempts:
+                entry = {"message": message, "kind": kind, "attempts": attempt, "error": error, "dead_at": now}
+                if not self.redis.lpush(self.dead_key, codec.dumps(entry)):
+                    raise ConnectionError("LPUSH failed")
+                self._count("dead_lettered")
+                self._record(incident_id, "dead", message["retry"])
+                logger.error("☠️ Incident dead-lettered after %d attempt(s) (%s error): %s", attempt, kind, error,
+                             extra={"incident_id": incident_id})
+            else:
+                delay = self.delay(attempt)
+                self.redis.zadd(self.retry_key, {codec.dumps(message): int((now + delay) * 1000)})
+                self._count("scheduled")
+                self._record(incident_id, "retry", message["retry"], due_at=now + delay)
+                logger.warning("🔁 Retry %d of %d in %.1fs: %s", attempt, self.max_attempts - 1, delay, error,
+                               extra={"incident_id": incident_id})
+            return True
+        except Exception as e:
+            self._count("store_failed")
+            logger.error("❌ Could not store failed incident for retry: %s (original error: %s)", e, error,
+                         extra={"incident_id": incident_id})
+            return False
+
+    def _record(self, incident_id: Any, state: str, retry: Dict[str, Any], due_at: Optional[float] = None):
+        """Remember that an incident waits for a retry or was dead-lettered (see failed_states())"""
+        try:
+            incident_id = int(incident_id)
+        except (TypeError, ValueError):
+            return
+        value = codec.dumps({"state": state, "retry": retry, "due_at": due_at})
+        if not self.redis.set(f"{self.failed_prefix}{incident_id}", value, ex=FAILED_STATE_TTL):
+            logger.warning("⚠️ Could not record %s state; the sweeper may re-publish the incident", state,
+                           extra={"incident_id": incident_id})
+
+    def failed_states(self, incident_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        {incident_id: {"state": "retry" | "dead", "retry": {...}, "due_at": ts}}
+        for the incidents among incident_ids that failed and are not resolved
+        """
+        if not incident_ids:
+            return {}
+        values = self.redis.mget([f"{self.failed_prefix}{incident_id}" for incident_id in incident_ids])
+        return {incident_id: codec.loads(value) for incident_id, value in zip(incident_ids, values) if value}
+
+    def resolve(self, incident_ids: List[int]):
+        """Forget the failed state of incidents that were processed after all"""
+        if not incident_ids:
+            return
+        pipe = self.redis.pipeline()
+        for incident_id in incident_ids:
+            pipe.delete(f"{self.failed_prefix}{incident_id}")
+        pipe.execute()
+
+    def release_due(self) -> int:
+        """Re-publish retries that are due (up to batch_size); returns how many"""
+        now_ms = int(time.time() * 1000)
+        members = self.redis.eval(CLAIM_DUE_SCRIPT, [self.retry_key],
+                                  [now_ms, now_ms + CLAIM_SECONDS * 1000, self.batch_size])
+        if not members:
+            return 0
+        messages = [codec.loads(member) for member in members]
+        published = self.publish(self.channel, messages)
+        if published < len(messages):
+            # Still claimed: the entries become due again after CLAIM_SECONDS. Publishers
+            # only report a count, so a partly published batch is re-published whole;
+            # the dedupe lease and ledger absorb the duplicates
+            logger.warning("⚠️ Re-published only %d of %d due retries; trying them again in %ds",
+                           published, len(messages), CLAIM_SECONDS)
+            return 0
+        self.redis.zrem(self.retry_key, *members)
+        self._count("republished", len(members))
+        return len(members)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="retry-scheduler", daemon=True)
+        self.thread.start()
+        logger.info("🔁 Retry scheduler started (%d attempts, %.0f-%.0fs backoff)",
+                    self.max_attempts, self.base_delay, self.max_delay)
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        if self.thread is None:
+            return
+        self._stop_event.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                # A full batch means more are probably due: keep going
+                while self.release_due() >= self.batch_size and not self._stop_event.is_set():
+                    pass
+            except Exception as e:
+                logger.error("❌ Retry scheduler poll failed: %s", e)
+
+    # Dead letters
+
+    def dead_letters(self, start: int = 0, count: int = 50) -> List[Tuple[str, Dict[str, Any]]]:
+        """Dead-lettered entries, newest first, as (raw entry, decoded entry)"""
+        raws = self.redis.lrange(self.dead_key, start, start + count - 1)
+        return [(raw, codec.loads(raw)) for raw in raws]
+
+    def requeue(self, raw: str) -> bool:
+        """Publish a dead-lettered message again with a fresh retry budget, then remove the entry"""
+        message = dict(codec.loads(raw)["message"])
+        retry = message.pop("retry", None)
+        if isinstance(retry, dict) and "notified" in retry:
+            # Still must not notify twice
+            message["retry"] = {"notified": retry["notified"]}
+        if not self.publish(self.channel, [message]):
+            return False
+        self.redis.lrem(self.dead_key, 1, raw)
+        if message.get("incident_id") is not None:
+            # In flight again; a purge instead keeps it marked dead so the sweeper leaves it alone
+            self.resolve([message["incident_id"]])
+        self._count("requeued")
+        return True
+
+    def purge(self, raw: str) -> bool:
+        """Delete a dead-lettered entry for good"""
+        return self.redis.lrem(self.dead_key, 1, raw) > 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        return {**counts, "pending_retries": self.redis.zcard(self.retry_key), "dead_letters": self.redis.llen(self.dead_key)}
+
+
+def get_retry_scheduler(redis_client, publish) -> Optional[RetryScheduler]:
+    """Build the retry scheduler from config, or None when RETRY_ENABLED is off"""
+    if not RETRY_ENABLED:
+        return None
+    return RetryScheduler(
+        redis_client, REDIS_CHANNEL, publish,
+        max_attempts=RETRY_MAX_ATTEMPTS,
+        base_delay=RETRY_BASE_DELAY,
+        max_delay=RETRY_MAX_DELAY,
+        poll_interval=RETRY_POLL_INTERVAL,
+        batch_size=RETRY_BATCH_SIZE
+    )
@@ -0,0 +1,183 @@
+"""
+Semantic search over past incidents
+
+Finds memory_item rows whose summary embedding is close to a query text:
+
+1. Converts the query to an embedding using OpenAI
+2. Finds similar incidents using pgvector cosine distance
+3. Filters the candidates so that one failure pattern doesn't crowd out the rest
+
+The agent calls search_similar_incidents() in-process; the FastAPI
+/semantic-search endpoint in handlers.py is a thin wrapper around it. The
+async agent reuses the request and row helpers with its own clients.
+"""
+
+# Handle both relative and absolute imports
+try:
+    from .config import OPENAI_API_KEY, OPENAI_BASE_URL
+    from .db import get_conn
+    from .http_client import get_http_client
+    from .metrics import observe
+except ImportError:
+    from config import OPENAI_API_KEY, OPENAI_BASE_URL
+    from db import get_conn
+    from http_client import get_http_client
+    from metrics import observe
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Over-fetch so diversity filtering still has enough candidates to choose from
+CANDIDATE_MULTIPLIER = 3
+
+SIMILAR_INCIDENTS_SQL = """
+    SELECT id, summary, labels, service, incident_type, solution,
+           1 - (embedding <=> %s::vector) as similarity
+    FROM memory_item
+    WHERE embedding IS NOT NULL
+    AND 1 - (embedding <=> %s::vector) > %s
+    ORDER BY embedding <=> %s::vector
+    LIMIT %s
+"""
+
+def extract_diversity_key(summary, service):
+    """Extract diversity key based on incident patterns."""
+    if summary and service:
+        # For SQL injection, look for different types
+        if "sql" in summary.lower() or "injection" in summary.lower():
+            if "union" in summary.lower():
+                return f"{service}_sql_union"
+            elif "blind" in summary.lower():
+                return f"{service}_sql_blind"
+            elif "time" in summary.lower() or "delay" in summary.lower():
+                return f"{service}_sql_time"
+            else:
+                return f"{service}_sql_generic"
+
+        # For other incidents, use service + key terms
+        key_terms = ["auth", "permission", "timeout", "error", "crash", "memory", "performance"]
+        for term in key_terms:
+            if term in summary.lower():
+                return f"{service}_{term}"
+
+    return f"{service or 'unknown'}_general"
+
+def filter_diverse_results(incidents, max_per_key=1):
+    """Filter incidents to ensure diversity in patterns."""
+    diversity_map = {}
+    filtered_results = []
+
+    for incident in incidents:
+        summary = incident.get('summary', '')
+        service = incident.get('service', '')
+        diversity_key = extract_diversity_key(summary, service)
+
+        if diversity_key not in diversity_map:
+            diversity_map[diversity_key] = 0
+
+        if diversity_map[diversity_key] < max_per_key:
+            filtered_results.append(incident)
+            diversity_map[diversity_key] += 1
+
+    return filtered_results
+
+def embedding_request(query_text):
+    """URL, headers and JSON body for an OpenAI embeddings call"""
+    headers = {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "input": query_text,
+        "model": EMBEDDING_MODEL
+    }
+    return f"{OPENAI_BASE_URL}/embeddings", headers, data
+
+def similar_incidents_params(query_embedding, limit, similarity_threshold):
+    """Parameters for SIMILAR_INCIDENTS_SQL"""
+    initial_limit = limit * CANDIDATE_MULTIPLIER
+    return (query_embedding, query_embedding, similarity_threshold, query_embedding, initial_limit)
+
+def select_diverse_rows(rows, limit):
+    """
+    Pick up to `limit` results from SIMILAR_INCIDENTS_SQL rows, preferring
+    incidents with distinct diversity keys once half the slots are filled
+    """
+    results = []
+    used_patterns = set()
+
+    for row in rows:
+        if len(results) >= limit:
+            break
+
+        summary = row[1] or ""
+        service = row[3] or "unknown"
+
+        # Create a diversity key based on service and summary patterns
+        diversity_key = extract_diversity_key(summary, service)
+
+        # If we haven't seen this pattern type yet, or if we have few results, include it
+        if diversity_key not in used_patterns or len(results) < limit // 2:
+            results.append({
+                'incident_id': row[0],
+                'summary': summary,
+                'labels': row[2] or [],
+                'service': service,
+                'incident_type': row[4] or "incident",
+                'solution': row[5],
+                'similarity': round(row[6], 3),
+                'has_solution': bool(row[5] and row[5].strip())
+            })
+            used_patterns.add(diversity_key)
+
+    return results
+
+def to_related_items(results):
+    """Convert search results into the related-incident format used by the agent and prompts"""
+    return [{
+        'memory_id': item.get('incident_id'),
+        'summary': item.get('summary'),
+        'labels': item.get('labels', []),
+        'service': item.get('service'),
+        'incident_type': item.get('incident_type'),
+        'solution': item.get('solution'),
+        'similarity': item.get('similarity', 0)
+    } for item in results]
+
+@observe("openai_embedding")
+def get_query_embedding(query_text):
+    """Embed the query text with OpenAI. Raises on API errors."""
+    url, headers, data = embedding_request(query_text)
+    response = get_http_client().post(url, headers=headers, json=data)
+
+    if response.status_code != 200:
+        raise RuntimeError(f"Embedding API error: {response.text}")
+
+    return response.json()['data'][0]['embedding']
+
+@observe("semantic_search")
+def search_similar_incidents(query_text, limit=3, similarity_threshold=0.7):
+    """
+    Find past incidents similar to the query text
+
+    Args:
+        query_text: Incident summary to search for
+        limit: Maximum number of results
+        similarity_threshold: Minimum cosine similarity (0-1)
+
+    Returns:
+        list: Result dicts with incident_id, summary, labels, service,
+        incident_type, solution, similarity and has_solution
+
+    Raises:
+        Exception: If the embedding call or the database query fails
+    """
+    query_embedding = get_query_embedding(query_text)
+
+    # Search similar incidents using pgvector based on summary similarity
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SIMILAR_INCIDENTS_SQL, similar_incidents_params(query_embedding, limit, similarity_threshold))
+            all_rows = cursor.fetchall()
+
+    # Apply diversity filtering to get varied results
+    return select_diverse_rows(all_rows, limit)
@@ -0,0 +1,186 @@
+"""
+Structured, non-blocking logging for the agent
+
+The agent used to print() dozens of lines per incident straight to stdout
+from the thread doing the work. Loggers from get_logger() instead:
+
+1. Drop records below the configured level before any formatting happens
+   (LOG_LEVEL, with per-module overrides in LOG_LEVELS)
+2. Sample DEBUG records (LOG_DEBUG_SAMPLE) and cap them at LOG_DEBUG_RATE per
+   second per call site, so chatty loops cannot flood the output
+3. Put the record on a bounded queue and return; a QueueListener thread does
+   the %-formatting, JSON encoding and the write to stdout. When the queue is
+   full the record is dropped and counted instead of blocking the caller.
+
+With LOG_FORMAT=json every line is one JSON object with ts, level, logger and
+msg, plus any fields passed through `extra` (incident_id, stage, duration_ms):
+
+    logger.info("Incident processed", extra={"incident_id": 42, "duration_ms": 812.5})
+
+Use %-style arguments rather than f-strings on hot paths so nothing is
+formatted for records that are filtered out.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict
+
+# Handle both relative and absolute imports
+try:
+    from .config import LOG_LEVEL, LOG_FORMAT, LOG_LEVELS, LOG_QUEUE_SIZE, LOG_DEBUG_RATE, LOG_DEBUG_SAMPLE
+except ImportError:
+    from config import LOG_LEVEL, LOG_FORMAT, LOG_LEVELS, LOG_QUEUE_SIZE, LOG_DEBUG_RATE, LOG_DEBUG_SAMPLE
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def _extra_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, msg and the `extra` fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_extra_fields(record)
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local runs, with `extra` fields as key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class DebugRateLimitFilter(logging.Filter):
+    """Samples DEBUG records and caps them per call site; other levels pass untouched"""
+
+    def __init__(self, rate: float = 5.0, sample: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.sample = sample
+        self._lock = threading.Lock()
+        self._windows: Dict[tuple, list] = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.sample < 1.0 and random.random() >= self.sample:
+            self.suppressed += 1
+            return False
+        if self.rate <= 0:
+            return True
+
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(site)
+            if window is None or now - window[0] >= 1.0:
+                self._windows[site] = [now, 1]
+                return True
+            if window[1] < self.rate:
+                window[1] += 1
+                return True
+        self.suppressed += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the logging thread.
+
+    Unlike the stock handler, prepare() leaves msg and args alone so the
+    %-formatting happens on the listener thread. Only the traceback is
+    rendered here, while it still exists.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_handler = None
+_setup_lock = threading.Lock()
+
+def setup_logging(level: str = None, fmt: str = None, stream=None):
+    """Route the root logger through the background queue (safe to call more than once)"""
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+
+        _handler = NonBlockingQueueHandler(queue.Queue(maxsize=max(1, LOG_QUEUE_SIZE)))
+        _handler.addFilter(DebugRateLimitFilter(rate=LOG_DEBUG_RATE, sample=LOG_DEBUG_SAMPLE))
+
+        root = logging.getLogger()
+        root.setLevel(level or LOG_LEVEL)
+        root.addHandler(_handler)
+        for name, module_level in LOG_LEVELS.items():
+            logging.getLogger(name).setLevel(module_level)
+
+        _listener = logging.handlers.QueueListener(_handler.queue, output)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Write every queued record and stop the listener thread"""
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        logging.getLogger().removeHandler(_handler)
+        if _handler.dropped:
+            print(f"⚠️ {_handler.dropped} log records dropped (log queue full)", file=sys.stderr)
+        _listener = None
+        _handler = None
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Logger for one agent module, e.g. get_logger("db").
+    Names match the LOG_LEVELS keys. Does not touch the root logger: entry
+    points (agent.py, async_agent.py) call setup_logging(), so importing agent
+    modules into another app (e.g. the FastAPI handlers) keeps its logging.
+    """
+    return logging.getLogger(name)
@@ -0,0 +1,215 @@
+"""
+Sweeper for incidents whose incident_ready message was never handled
+
+Pub/sub delivers nothing that was published while no agent was subscribed,
+so incidents created during a deploy or restart used to stay "open" until
+someone re-published them by hand. The sweeper reconciles from Postgres
+instead: every SWEEPER_INTERVAL it reads incidents still open more than
+SWEEPER_GRACE_PERIOD seconds after they were created (and younger than
+SWEEPER_MAX_AGE), oldest first, SWEEPER_BATCH_SIZE rows per query on the
+(status, created_at) index, and re-publishes them on REDIS_CHANNEL as
+version 2 messages, so they go through the normal pipeline (dedupe, retries,
+load shedding) without a second DB read. Publishing is paced to SWEEPER_RATE
+incidents per second so a large backlog does not swamp the agents.
+
+With several agents only one sweeps per interval: the sweep takes the Redis
+key "<channel>:sweeper" with SET NX and leaves it to expire. Each incident
+re-published gets a "<channel>:swept:<id>" marker for SWEEPER_RESWEEP_AFTER
+seconds, so an incident that is still in flight is not re-published on every
+sweep. Incidents the dedupe ledger already records as processed are skipped
+by the agent as usual.
+
+Failed incidents stay open too, so the sweeper asks the retry scheduler for
+their state (RetryScheduler.failed_states()): dead-lettered incidents are left
+for tests/dead_letters.py, and incidents waiting for a retry are left to the
+scheduler. Only a retry still open SWEEPER_GRACE_PERIOD seconds after it fell
+due (its agent died mid-way) is re-published, with its retry state, so the
+attempt count and the record of sent notifications carry on.
+"""
+
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Handle both relative and absolute imports
+try:
+    from .config import (
+        REDIS_CHANNEL, SWEEPER_ENABLED, SWEEPER_INTERVAL, SWEEPER_GRACE_PERIOD, SWEEPER_MAX_AGE,
+        SWEEPER_BATCH_SIZE, SWEEPER_RATE, SWEEPER_RESWEEP_AFTER
+    )
+    from .db import create_incident_status_index, get_stale_incidents
+    from .messages import build_incident_message
+    from .metrics import SWEEPER_EVENTS
+    from .structured_logging import get_logger
+except ImportError:
+    from config import (
+        REDIS_CHANNEL, SWEEPER_ENABLED, SWEEPER_INTERVAL, SWEEPER_GRACE_PERIOD, SWEEPER_MAX_AGE,
+        SWEEPER_BATCH_SIZE, SWEEPER_RATE, SWEEPER_RESWEEP_AFTER
+    )
+    from db import create_incident_status_index, get_stale_incidents
+    from messages import build_incident_message
+    from metrics import SWEEPER_EVENTS
+    from structured_logging import get_logger
+
+logger = get_logger("sweeper")
+
+# Seconds before the first sweep, so the agent's own listener is subscribed
+# (a pub/sub message published with no subscriber is lost)
+STARTUP_DELAY = 5.0
+
+
+class IncidentSweeper:
+    """Periodically re-publishes incidents left open past a grace period"""
+
+    def __init__(self, redis_client, channel: str, publish: Callable[[str, List[Dict[str, Any]]], int],
+                 interval: float = 60.0, grace_period: int = 300, max_age: int = 86400,
+                 batch_size: int = 100, rate: float = 20.0, resweep_after: int = 3600, retries=None):
+        self.redis = redis_client
+        self.channel = channel
+        self.publish = publish
+        # RetryScheduler whose failed incidents are skipped (None when retries are off)
+        self.retries = retries
+        self.lock_key = f"{channel}:sweeper"
+        self.marker_prefix = f"{channel}:swept:"
+        self.interval = max(1.0, float(interval))
+        self.grace_period = max(0, int(grace_period))
+        self.max_age = max(0, int(max_age))
+        self.batch_size = max(1, int(batch_size))
+        self.rate = float(rate)
+        self.resweep_after = max(1, int(resweep_after))
+        self.thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._counts = {"sweeps": 0, "republished": 0, "skipped_recent": 0, "skipped_failed": 0, "publish_failed": 0}
+        self.last_sweep_at: Optional[float] = None
+        create_incident_status_index()
+
+    def _count(self, outcome: str, amount: int = 1):
+        if outcome != "sweeps":
+            SWEEPER_EVENTS.labels(outcome).inc(amount)
+        with self._lock:
+            self._counts[outcome] += amount
+
+    def _mark(self, incidents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The incidents not re-published within resweep_after, now marked as swept"""
+        pipe = self.redis.pipeline()
+        for incident in incidents:
+            pipe.set(f"{self.marker_prefix}{incident['id']}", "1", ex=self.resweep_after, nx=True)
+        return [incident for incident, marked in zip(incidents, pipe.execute()) if marked is True]
+
+    def _unmark(self, incidents: List[Dict[str, Any]]):
+        pipe = self.redis.pipeline()
+        for incident in incidents:
+            pipe.delete(f"{self.marker_prefix}{incident['id']}")
+        pipe.execute()
+
+    def _without_failed(self, incidents: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[int, Any]]:
+        """
+        The incidents the retry scheduler is not handling, and the retry state
+        of those among them whose retry was lost
+        """
+        if self.retries is None or not incidents:
+            return incidents, {}
+        states = self.retries.failed_states([incident["id"] for incident in incidents])
+        now = time.time()
+        kept, resumed = [], {}
+        for incident in incidents:
+            state = states.get(incident["id"])
+            if state is not None:
+                if state.get("state") != "retry" or now < (state.get("due_at") or 0) + self.grace_period:
+                    continue
+                resumed[incident["id"]] = state.get("retry")
+            kept.append(incident)
+        if len(kept) < len(incidents):
+            self._count("skipped_failed", len(incidents) - len(kept))
+        return kept, resumed
+
+    def sweep(self) -> int:
+        """
+        Re-publish stale open incidents, unless another agent swept within the
+        last interval; returns how many were re-published
+        """
+        if not self.redis.set(self.lock_key, uuid.uuid4().hex, px=int(self.interval * 1000), nx=True):
+            return 0
+        self._count("sweeps")
+        self.last_sweep_at = time.time()
+        republished = 0
+        cursor = None
+        while not self._stop_event.is_set():
+            incidents, cursor = get_stale_incidents(self.grace_period, self.max_age, after=cursor,
+                                                    limit=self.batch_size)
+            candidates, resumed = self._without_failed(incidents)
+            fresh = self._mark(candidates) if candidates else []
+            if len(fresh) < len(candidates):
+                self._count("skipped_recent", len(candidates) - len(fresh))
+            if fresh:
+                messages = [build_incident_message(incident["id"], incident) for incident in fresh]
+                for message in messages:
+                    if resumed.get(message["incident_id"]):
+                        message["retry"] = resumed[message["incident_id"]]
+                # Fewer than one per message: some were not stored (or reached no subscriber)
+                published = self.publish(self.channel, messages)
+                if published < len(messages):
+                    # Unmarked so the next sweep tries them again
+                    self._unmark(fresh)
+                    self._count("publish_failed", len(fresh))
+                    logger.error("❌ Re-published only %d of %d stale incidents on %s; retrying them next sweep in %.0fs",
+                                 published, len(fresh), self.channel, self.interval)
+                    break
+                republished += len(fresh)
+                self._count("republished", len(fresh))
+                if self.rate > 0:
+                    self._stop_event.wait(len(fresh) / self.rate)
+            if len(incidents) < self.batch_size:
+                break
+        if republished:
+            logger.info("🧹 Re-published %d incidents left open for over %ds", republished, self.grace_period)
+        return republished
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="incident-sweeper", daemon=True)
+        self.thread.start()
+        logger.info("🧹 Incident sweeper started (every %.0fs, grace %ds, %.0f/s)",
+                    self.interval, self.grace_period, self.rate)
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        if self.thread is None:
+            return
+        self._stop_event.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _run(self):
+        # Sweep soon after starting: a restart is exactly when messages were missed
+        self._stop_event.wait(min(STARTUP_DELAY, self.interval))
+        while not self._stop_event.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error("❌ Incident sweep failed: %s", e)
+            self._stop_event.wait(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        return {**counts, "last_sweep_age": time.time() - self.last_sweep_at if self.last_sweep_at else None}
+
+
+def get_incident_sweeper(redis_client, publish, retries=None) -> Optional[IncidentSweeper]:
+    """Build the incident sweeper from config, or None when SWEEPER_ENABLED is off"""
+    if not SWEEPER_ENABLED:
+        return None
+    return IncidentSweeper(
+        redis_client, REDIS_CHANNEL, publish,
+        interval=SWEEPER_INTERVAL,
+        grace_period=SWEEPER_GRACE_PERIOD,
+        max_age=SWEEPER_MAX_AGE,
+        batch_size=SWEEPER_BATCH_SIZE,
+        rate=SWEEPER_RATE,
+        resweep_after=SWEEPER_RESWEEP_AFTER,
+        retries=retries
+    )
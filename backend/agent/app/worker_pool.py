@@ -0,0 +1,207 @@
+"""
+Bounded worker pool for incident processing
+
+The Redis listener delivers messages one at a time. In serial mode every
+message is handled inline, so a single slow OpenAI call blocks every incident
+queued behind it. The worker pool decouples the listener from the handlers:
+
+1. The listener calls submit() which places the message on a bounded queue
+2. A fixed number of worker threads run the incident handler concurrently
+3. Messages for the same incident_id always land on the same worker, so
+   re-deliveries and updates for one incident are processed in order
+
+When every queue is full, submit() blocks the listener, which pushes
+backpressure onto Redis instead of growing memory without limit.
+
+With a batch_handler and batch_size > 1, a worker takes every message already
+waiting on its queue (up to batch_size) and hands them over together, so the
+handler can fetch their incidents in one round-trip while draining a backlog.
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Handle both relative and absolute imports
+try:
+    from .structured_logging import get_logger
+except ImportError:
+    from structured_logging import get_logger
+
+logger = get_logger("worker_pool")
+
+# Sentinel placed on each worker queue to request shutdown
+_STOP = object()
+
+
+class IncidentWorkerPool:
+    """
+    Fixed-size pool of worker threads fed by per-worker bounded queues.
+
+    Each worker owns one queue (a shard). Messages are routed to a shard by
+    incident_id, which keeps per-incident ordering while incidents with
+    different ids run in parallel.
+    """
+
+    def __init__(self, handler: Callable[[Any], None], num_workers: int = 4, queue_size: int = 100,
+                 batch_handler: Optional[Callable[[List[Any]], None]] = None, batch_size: int = 1):
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self.batch_size = max(1, int(batch_size)) if batch_handler else 1
+        self.num_workers = max(1, int(num_workers))
+        # Split the total queue bound across the shards (at least one slot each)
+        shard_size = max(1, -(-int(queue_size) // self.num_workers))
+        self.queues: List[queue.Queue] = [queue.Queue(maxsize=shard_size) for _ in range(self.num_workers)]
+        self.threads: List[threading.Thread] = []
+        self.running = False
+
+        self._lock = threading.Lock()
+        # submit() calls past the running check; stop() waits for them before queueing sentinels
+        self._submit_cond = threading.Condition()
+        self._submitting = 0
+        self._processed = 0
+        self._failed = 0
+        self._busy_workers = 0
+
+    def start(self):
+        """Start the worker threads"""
+        if self.running:
+            return
+        self.running = True
+        for index in range(self.num_workers):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(index,),
+                name=f"incident-worker-{index}",
+                daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+        logger.info("👷 Worker pool started: %d workers, %d queued messages per worker",
+                    self.num_workers, self.queues[0].maxsize)
+
+    def submit(self, data: Any, timeout: Optional[float] = None) -> bool:
+        """
+        Queue a message for processing.
+
+        Blocks while the target shard is full. Returns False if the pool is
+        stopped or the optional timeout expires before space frees up.
+        """
+        with self._submit_cond:
+            if not self.running:
+                logger.warning("⚠️ Worker pool is not running, dropping message")
+                return False
+            self._submitting += 1
+
+        shard = self._shard_for(data)
+        try:
+            self.queues[shard].put(data, timeout=timeout)
+            return True
+        except queue.Full:
+            logger.warning("⚠️ Worker queue %d full, message not accepted: %.100s", shard, data)
+            return False
+        finally:
+            with self._submit_cond:
+                self._submitting -= 1
+                self._submit_cond.notify_all()
+
+    def stop(self, drain: bool = True, timeout: Optional[float] = None):
+        """
+        Stop the pool.
+
+        With drain=True the workers finish everything already queued before
+        exiting; otherwise pending messages are discarded.
+        """
+        with self._submit_cond:
+            if not self.running:
+                return
+            self.running = False
+            # A blocked put() completes while the workers drain, so this does not deadlock
+            self._submit_cond.wait_for(lambda: self._submitting == 0)
+
+        if not drain:
+            for q in self.queues:
+                try:
+                    while True:
+                        q.get_nowait()
+                        q.task_done()
+                except queue.Empty:
+                    pass
+
+        for q in self.queues:
+            q.put(_STOP)
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self.threads:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            thread.join(remaining)
+        self.threads = []
+        logger.info("👷 Worker pool stopped (%d processed, %d failed)", self._processed, self._failed)
+
+    def backlog(self) -> int:
+        """Messages queued and not yet picked up by a worker"""
+        return sum(q.qsize() for q in self.queues)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depths and processing counters"""
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "busy_workers": self._busy_workers,
+                "queue_depths": [q.qsize() for q in self.queues],
+                "queued": sum(q.qsize() for q in self.queues),
+                "processed": self._processed,
+                "failed": self._failed
+            }
+
+    def _shard_for(self, data: Any) -> int:
+        """Route a message to a worker by incident_id to keep per-incident ordering"""
+        incident_id = data.get("incident_id") if isinstance(data, dict) else None
+        try:
+            key = int(incident_id)
+        except (ValueError, TypeError):
+            # Malformed messages are rejected by the handler; spread them evenly
+            key = hash(str(data))
+        return key % self.num_workers
+
+    def _take(self, q: queue.Queue) -> list:
+        """Block for one message, then take whatever else is already queued up to batch_size"""
+        items = [q.get()]
+        while len(items) < self.batch_size:
+            try:
+                items.append(q.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _worker(self, index: int):
+        q = self.queues[index]
+        while True:
+            items = self._take(q)
+            # stop() queues the sentinel after every accepted message, but never drop one behind it
+            stop = any(item is _STOP for item in items)
+            batch = [item for item in items if item is not _STOP] if stop else items
+
+            if batch:
+                with self._lock:
+                    self._busy_workers += 1
+                try:
+                    if len(batch) > 1:
+                        self.batch_handler(batch)
+                    else:
+                        self.handler(batch[0])
+                    with self._lock:
+                        self._processed += len(batch)
+                except Exception as exc:
+                    with self._lock:
+                        self._failed += len(batch)
+                    logger.exception("❌ Worker %d failed to handle message: %s", index, exc)
+                finally:
+                    with self._lock:
+                        self._busy_workers -= 1
+
+            for _ in items:
+                q.task_done()
+            if stop:
+                break
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark: sync agent stages vs the asyncio agent
+
+Runs the network-bound stages of incident processing (semantic search, OpenAI
+chat completion, Slack post) for N synthetic incidents against local stand-in
+servers (tests/fake_services.py), once with the blocking clients used by
+app/agent.py and once with the async clients used by app/async_agent.py.
+
+Postgres and Redis are not involved, so the numbers isolate the effect of
+keeping many HTTP calls in flight at once.
+
+Usage:
+    python tests/benchmark_async_agent.py [--incidents 200] [--latency-ms 200] [--in-flight 200]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from fake_services import FakeServices, Latency
+
+# config.py validates these on import; the stand-in servers ignore the values
+for _var in ("DATABASE_URL", "OPENAI_API_KEY", "SLACK_BOT_TOKEN", "SLACK_SIGNING_SECRET"):
+    os.environ.setdefault(_var, f"benchmark-{_var.lower()}")
+
+
+def synthetic_incident(incident_id: int) -> dict:
+    return {
+        "id": incident_id,
+        "labels": ["latency", "benchmark"],
+        "summary_text": f"Synthetic incident {incident_id}: p99 latency above SLO on checkout",
+        "anomaly_score": 0.8,
+        "confidence": 0.9,
+        "evidence": {"service": "checkout"},
+        "status": "open",
+        "created_at": None
+    }
+
+
+def run_sync(incidents: list) -> float:
+    """Process incidents one after another with the blocking clients"""
+    import requests
+    from slack_sdk import WebClient
+    from config import SEMANTIC_SEARCH_URL, SLACK_BOT_TOKEN, SLACK_API_URL
+    from llm_client import get_openai_client, build_analysis_prompt
+
+    client = get_openai_client()
+    slack = WebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL)
+
+    start = time.perf_counter()
+    for incident in incidents:
+        requests.post(SEMANTIC_SEARCH_URL, json={"query": incident["summary_text"], "limit": 3}, timeout=30)
+        client.chat_completions_create(messages=[{"role": "user", "content": build_analysis_prompt(incident, [])}])
+        slack.chat_postMessage(channel="#benchmark", text=f"Incident {incident['id']} notification")
+    return time.perf_counter() - start
+
+
+async def run_async(incidents: list, max_in_flight: int) -> float:
+    """Process incidents concurrently with the asyncio agent's clients"""
+    import httpx
+    from slack_sdk.web.async_client import AsyncWebClient
+    from config import SLACK_BOT_TOKEN, SLACK_API_URL
+    from async_agent import AsyncIncidentAgent
+
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as http:
+        slack = AsyncWebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL)
+        agent = AsyncIncidentAgent(http, slack, max_in_flight=max_in_flight)
+        slots = asyncio.Semaphore(max_in_flight)
+
+        async def process(incident):
+            async with slots:
+                related = await agent.search_similar(incident)
+                await agent.analyze(incident, related)
+                await slack.chat_postMessage(channel="#benchmark", text=f"Incident {incident['id']} notification")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(process(incident) for incident in incidents))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and asyncio agent throughput against local stand-ins")
+    parser.add_argument("--incidents", type=int, default=200)
+    parser.add_argument("--latency-ms", default="200", help='Per-call latency spec, e.g. "200", "200:50", "800:0.6:lognormal"')
+    parser.add_argument("--in-flight", type=int, default=200, help="Maximum concurrent incidents for the async run")
+    parser.add_argument("--skip-sync", action="store_true", help="Only run the async agent")
+    args = parser.parse_args()
+
+    latency = Latency.parse(args.latency_ms)
+    services = FakeServices(latencies={"openai_chat": latency, "semantic_search": latency, "slack": latency}).start()
+    os.environ.update(services.env())
+    sys.path.insert(0, str(Path(__file__).parent.parent / 'app'))
+
+    incidents = [synthetic_incident(i) for i in range(1, args.incidents + 1)]
+    print(f"🏁 Benchmark: {args.incidents} incidents, 3 calls each, latency {args.latency_ms} ms per call")
+
+    try:
+        results = {}
+        if not args.skip_sync:
+            results["sync"] = run_sync(incidents)
+        results["async"] = asyncio.run(run_async(incidents, args.in_flight))
+    finally:
+        services.stop()
+
+    print("=" * 50)
+    for name, elapsed in results.items():
+        print(f"{name:6} {elapsed:8.2f}s  {args.incidents / elapsed:8.1f} incidents/s")
+    if "sync" in results:
+        print(f"Speed-up: {results['sync'] / results['async']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Inspect and requeue dead-lettered incidents
+
+Incidents whose processing failed permanently, or kept failing for
+RETRY_MAX_ATTEMPTS attempts, are kept on the Redis list "<REDIS_CHANNEL>:dead"
+(see app/retry.py). Entries are numbered newest first.
+
+Usage:
+    python tests/dead_letters.py stats
+    python tests/dead_letters.py list [--limit 20]
+    python tests/dead_letters.py show 0
+    python tests/dead_letters.py requeue 0 [3 ...]   # publish again with a fresh retry budget
+    python tests/dead_letters.py requeue --all
+    python tests/dead_letters.py purge 2 [...]       # delete for good
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path to import config
+sys.path.insert(0, str(Path(__file__).parent.parent / 'app'))
+from config import REDIS_CHANNEL, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from redis_client import get_redis_client, publish_many
+from retry import RetryScheduler
+from structured_logging import setup_logging
+
+
+def format_time(timestamp) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) if timestamp else "?"
+
+
+def print_entry(index: int, entry: dict, full: bool = False):
+    message = entry.get("message", {})
+    print(f"[{index}] incident {message.get('incident_id')} | {entry.get('kind')} | "
+          f"{entry.get('attempts')} attempt(s) | dead since {format_time(entry.get('dead_at'))}")
+    print(f"     {entry.get('error')}")
+    if full:
+        print(json.dumps(entry, indent=2, default=str))
+
+
+def selected(scheduler: RetryScheduler, indexes: list, select_all: bool) -> list:
+    """(index, raw, entry) for the requested entries, read before any is changed"""
+    if select_all:
+        return [(i, raw, entry) for i, (raw, entry) in enumerate(scheduler.dead_letters(0, 100000))]
+    entries = []
+    for index in indexes:
+        found = scheduler.dead_letters(index, 1)
+        if not found:
+            print(f"⚠️ No dead letter at index {index}")
+            continue
+        entries.append((index, *found[0]))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and requeue dead-lettered incidents")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Pending retries and dead letters")
+    list_parser = commands.add_parser("list", help="List dead letters, newest first")
+    list_parser.add_argument("--limit", type=int, default=20)
+    show_parser = commands.add_parser("show", help="Show one dead letter in full")
+    show_parser.add_argument("index", type=int)
+    for name, help_text in (("requeue", "Publish dead letters again"), ("purge", "Delete dead letters")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("indexes", type=int, nargs="*")
+        command.add_argument("--all", action="store_true")
+    args = parser.parse_args()
+
+    redis_client = get_redis_client()
+    if not redis_client.ping():
+        print("Error: Cannot connect to Redis")
+        sys.exit(1)
+    scheduler = RetryScheduler(redis_client, REDIS_CHANNEL, publish_many, max_attempts=RETRY_MAX_ATTEMPTS,
+                               base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY)
+
+    if args.command == "stats":
+        stats = scheduler.stats()
+        print(f"Channel: {REDIS_CHANNEL}")
+        print(f"  pending retries ({scheduler.retry_key}): {stats['pending_retries']}")
+        print(f"  dead letters ({scheduler.dead_key}): {stats['dead_letters']}")
+
+    elif args.command == "list":
+        entries = scheduler.dead_letters(0, args.limit)
+        if not entries:
+            print("No dead letters 🎉")
+        for index, (_, entry) in enumerate(entries):
+            print_entry(index, entry)
+
+    elif args.command == "show":
+        found = scheduler.dead_letters(args.index, 1)
+        if not found:
+            print(f"No dead letter at index {args.index}")
+            sys.exit(1)
+        print_entry(args.index, found[0][1], full=True)
+
+    else:
+        if not args.indexes and not args.all:
+            parser.error(f"{args.command} needs entry indexes or --all")
+        done = 0
+        for index, raw, entry in selected(scheduler, args.indexes, args.all):
+            incident_id = entry.get("message", {}).get("incident_id")
+            if args.command == "requeue":
+                ok = scheduler.requeue(raw)
+                print(f"{'✅ Requeued' if ok else '❌ Could not requeue'} [{index}] incident {incident_id}")
+            else:
+                ok = scheduler.purge(raw)
+                print(f"{'🗑️ Purged' if ok else '⚠️ Already gone:'} [{index}] incident {incident_id}")
+            done += ok
+        print(f"{done} dead letter(s) {args.command}d")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Local stand-in servers for OpenAI, Slack and the semantic search API
+
+Used by the benchmark scripts so the agent can be exercised without real
+API keys or network access. Every route answers with a minimal valid payload
+after a configurable latency.
+
+Usage:
+    python tests/fake_services.py [--latency-ms 200] [--port 8099]
+
+Then point the agent at it:
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1
+    SEMANTIC_SEARCH_URL=http://127.0.0.1:8099/semantic-search
+    SLACK_API_URL=http://127.0.0.1:8099/api/
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANALYSIS = {
+    "summary": "Synthetic analysis from the fake OpenAI service",
+    "root_causes": [{"cause": "Synthetic cause", "fixes": ["Restart the service"], "rollback": "None"}],
+    "confidence": "medium"
+}
+
+
+class Latency:
+    """
+    Latency distribution for one route.
+
+    kind is "constant", "uniform" (mean +/- jitter) or "lognormal" (median
+    mean_ms with sigma jitter, which gives the long tail typical of LLM APIs).
+    """
+
+    def __init__(self, mean_ms: float = 0.0, jitter: float = 0.0, kind: str = "constant"):
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+        self.kind = kind
+
+    def sample_seconds(self) -> float:
+        if self.mean_ms <= 0:
+            return 0.0
+        if self.kind == "uniform":
+            value = random.uniform(self.mean_ms - self.jitter, self.mean_ms + self.jitter)
+        elif self.kind == "lognormal":
+            value = random.lognormvariate(0.0, self.jitter or 0.5) * self.mean_ms
+        else:
+            value = self.mean_ms
+        return max(0.0, value) / 1000.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        """Parse "200", "200:50" (uniform) or "200:0.6:lognormal" into a Latency"""
+        parts = str(spec).split(":")
+        mean_ms = float(parts[0])
+        jitter = float(parts[1]) if len(parts) > 1 else 0.0
+        kind = parts[2] if len(parts) > 2 else ("uniform" if jitter else "constant")
+        return cls(mean_ms, jitter, kind)
+
+
+class FakeServices:
+    """Threaded HTTP server answering the OpenAI, Slack and semantic search routes"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latencies: dict = None):
+        self.latencies = {
+            "openai_chat": Latency(),
+            "openai_embeddings": Latency(),
+            "semantic_search": Latency(),
+            "slack": Latency(),
+        }
+        self.latencies.update(latencies or {})
+        self.counts = {name: 0 for name in self.latencies}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> dict:
+        """Environment variables that point the agent at this server"""
+        return {
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "SEMANTIC_SEARCH_URL": f"{self.base_url}/semantic-search",
+            "SLACK_API_URL": f"{self.base_url}/api/",
+        }
+
+    def start(self) -> "FakeServices":
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-services", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _respond(self, route: str, body: dict) -> dict:
+        with self._lock:
+            self.counts[route] += 1
+        time.sleep(self.latencies[route].sample_seconds())
+
+        if route == "openai_chat":
+            return {
+                "choices": [{"message": {"role": "assistant", "content": json.dumps(ANALYSIS)}}],
+                "usage": {"prompt_tokens": 350, "completion_tokens": 80, "total_tokens": 430}
+            }
+        if route == "openai_embeddings":
+            return {"data": [{"embedding": [0.0] * 1536}], "usage": {"prompt_tokens": 10, "total_tokens": 10}}
+        if route == "semantic_search":
+            return {"status": "success", "query": body.get("query", ""), "incidents": [], "total_found": 0}
+        return {"ok": True, "channel": "C0FAKE", "ts": f"{time.time():.6f}", "message": {"text": body.get("text", "")}}
+
+    def _make_handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    body = json.loads(raw) if raw and raw[:1] in (b"{", b"[") else {}
+                except ValueError:
+                    body = {}
+
+                if self.path.endswith("/chat/completions"):
+                    route = "openai_chat"
+                elif self.path.endswith("/embeddings"):
+                    route = "openai_embeddings"
+                elif self.path.endswith("/semantic-search"):
+                    route = "semantic_search"
+                elif "/api/" in self.path:
+                    route = "slack"
+                else:
+                    self.send_error(404)
+                    return
+
+                payload = json.dumps(services._respond(route, body)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local stand-ins for OpenAI, Slack and semantic search")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", default="200", help='Latency spec, e.g. "200", "200:50", "800:0.6:lognormal"')
+    args = parser.parse_args()
+
+    latency = Latency.parse(args.latency_ms)
+    services = FakeServices(port=args.port, latencies={name: latency for name in ("openai_chat", "openai_embeddings", "semantic_search", "slack")})
+    services.start()
+    print(f"🧪 Fake services listening on {services.base_url}")
+    for key, value in services.env().items():
+        print(f"   {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        services.stop()
+
+
+if __name__ == "__main__":
+    main()
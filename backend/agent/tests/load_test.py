@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test for the agent
+
+1. Seeds N synthetic incidents in Postgres (labelled "loadtest")
+2. Starts local stand-ins for OpenAI, Slack and semantic search
+   (tests/fake_services.py) with configurable latency distributions
+3. Runs app/agent.py as a subprocess pointed at them, in the AGENT_MODE
+   (and any other settings) of the current environment
+4. Publishes one incident_ready message per incident to REDIS_CHANNEL at
+   --rate messages per second (with --fat, version 2 messages embedding the
+   incident, so the agent skips the DB read)
+5. Waits until every incident has its "acknowledged" audit row, then reports
+   throughput, p50/p95/p99 end-to-end latency (publish -> acknowledged) and
+   per-operation / per-stage timings scraped from the agent's /metrics
+
+Needs the same DATABASE_URL and REDIS_URL as the agent; no real API keys or
+network access. Per-stage timings need prometheus_client in the agent's
+environment (staged mode adds queue waits per stage). Seeded rows are
+deleted afterwards unless --keep is given.
+
+Usage:
+    python tests/load_test.py [--incidents 500] [--rate 50] [--openai-latency 800:0.6:lognormal] [--fat]
+    AGENT_MODE=staged python tests/load_test.py --incidents 2000 --rate 200
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+import psycopg
+
+sys.path.insert(0, str(Path(__file__).parent))
+from fake_services import FakeServices, Latency
+
+APP_DIR = Path(__file__).parent.parent / 'app'
+sys.path.insert(0, str(APP_DIR))
+from config import DATABASE_URL, REDIS_CHANNEL
+from redis_client import publish_message
+from messages import build_incident_message
+
+SERVICES = ["checkout", "payments", "search", "inventory", "auth"]
+LABEL_SETS = [["latency"], ["errors"], ["latency", "errors"], ["saturation"]]
+
+
+def seed_incidents(conn, count: int) -> dict:
+    """Insert synthetic open incidents; returns {id: incident fields} in insertion order"""
+    rows = []
+    for i in range(count):
+        service = random.choice(SERVICES)
+        labels = random.choice(LABEL_SETS)
+        rows.append((
+            i, ["loadtest"] + labels,
+            f"Load test incident {i}: {' and '.join(labels)} above threshold on {service}",
+            round(random.random(), 3), round(random.uniform(0.5, 1.0), 3),
+            json.dumps({"service": service, "metric": labels[0], "value": random.randint(80, 100)})
+        ))
+    incidents = {}
+    with conn.cursor() as cur:
+        for row in rows:
+            cur.execute("""
+                INSERT INTO incidents (event_id, labels, summary_text, anomaly_score, confidence, evidence, status)
+                VALUES (%s, %s, %s, %s, %s, %s, 'open') RETURNING id, created_at
+            """, row)
+            incident_id, created_at = cur.fetchone()
+            incidents[incident_id] = {
+                "event_id": row[0], "labels": row[1], "summary_text": row[2], "anomaly_score": row[3],
+                "confidence": row[4], "evidence": json.loads(row[5]), "status": "open", "created_at": created_at
+            }
+    conn.commit()
+    return incidents
+
+
+def cleanup(conn, ids: list):
+    """Delete everything the run wrote for the seeded incidents"""
+    statements = [
+        ("DELETE FROM audit_logs WHERE incident_id = ANY(%s)", ids),
+        ("DELETE FROM slack_messages WHERE incident_id = ANY(%s)", ids),
+        ("DELETE FROM memory_item WHERE id = ANY(%s)", [str(i) for i in ids]),
+        ("DELETE FROM processed_incidents WHERE incident_id = ANY(%s)", ids),
+        ("DELETE FROM incidents WHERE id = ANY(%s)", ids),
+    ]
+    for sql, params in statements:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, (params,))
+            conn.commit()
+        except Exception as e:
+            # processed_incidents only exists with DEDUPE_LEDGER=postgres
+            conn.rollback()
+            print(f"⚠️ Cleanup skipped: {sql.split(' WHERE')[0]} ({e.__class__.__name__})")
+
+
+def start_agent(env: dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen([sys.executable, str(APP_DIR / 'agent.py')], env=env, stdout=log,
+                            stderr=subprocess.STDOUT, cwd=str(APP_DIR.parent))
+
+
+def wait_for_agent(agent: subprocess.Popen, log_path: str, timeout: float = 60.0) -> bool:
+    """Wait until the agent has subscribed to the channel"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if agent.poll() is not None:
+            return False
+        with open(log_path) as f:
+            if "Starting to listen" in f.read():
+                # Give the pub/sub subscription a moment to register
+                time.sleep(1.0)
+                return True
+        time.sleep(0.2)
+    return False
+
+
+def publish(ids: list, rate: float, incidents: dict = None) -> dict:
+    """
+    Publish one incident_ready per id at `rate` per second (0 = as fast as possible),
+    embedding each incident when `incidents` is given
+    """
+    published_at = {}
+    start = time.monotonic()
+    for n, incident_id in enumerate(ids):
+        if rate > 0:
+            delay = start + n / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        published_at[incident_id] = time.monotonic()
+        publish_message(REDIS_CHANNEL, build_incident_message(incident_id, incidents and incidents[incident_id]))
+    return published_at
+
+
+def wait_for_acknowledged(conn, published_at: dict, timeout: float, poll_interval: float = 0.05) -> dict:
+    """
+    Poll audit_logs until every incident is acknowledged (or the timeout passes).
+    Completion times are observed by this poller, so they carry up to one
+    poll_interval of error but no clock skew between hosts.
+    """
+    pending = set(published_at)
+    done_at = {}
+    deadline = time.monotonic() + timeout
+    last_report = time.monotonic()
+    while pending and time.monotonic() < deadline:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT DISTINCT incident_id FROM audit_logs
+                WHERE action = 'acknowledged' AND incident_id = ANY(%s)
+            """, (list(pending),))
+            finished = [row[0] for row in cur.fetchall()]
+        conn.commit()
+        now = time.monotonic()
+        for incident_id in finished:
+            done_at[incident_id] = now
+            pending.discard(incident_id)
+        if now - last_report >= 5:
+            print(f"   ... {len(done_at)}/{len(published_at)} acknowledged")
+            last_report = now
+        time.sleep(poll_interval)
+    return done_at
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+_SAMPLE = re.compile(r'^(\w+)\{([^}]*)\} (\S+)$')
+
+def scrape_histograms(url: str) -> dict:
+    """
+    Parse agent histograms from a Prometheus text scrape into
+    {(metric, label): {"count", "sum", "buckets": [(le, cumulative count)]}}
+    """
+    try:
+        text = urllib.request.urlopen(url, timeout=5).read().decode()
+    except Exception as e:
+        print(f"⚠️ Could not scrape {url}: {e}")
+        return {}
+
+    histograms = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if not match:
+            continue
+        name, raw_labels, value = match.groups()
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', raw_labels))
+        for base in ("agent_operation_seconds", "agent_stage_seconds", "agent_stage_wait_seconds"):
+            if not name.startswith(base + "_"):
+                continue
+            suffix = name[len(base) + 1:]
+            if base == "agent_operation_seconds":
+                if labels.get("outcome") != "ok":
+                    break
+                key = (base, labels["operation"])
+            else:
+                key = (base, labels["stage"])
+            entry = histograms.setdefault(key, {"count": 0.0, "sum": 0.0, "buckets": []})
+            if suffix == "bucket":
+                entry["buckets"].append((float(labels["le"]), float(value)))
+            elif suffix in ("count", "sum"):
+                entry[suffix] = float(value)
+            break
+    return histograms
+
+
+def histogram_quantile(buckets: list, count: float, q: float) -> float:
+    """Upper bound of the bucket holding quantile q (what Prometheus would interpolate within)"""
+    rank = q * count
+    for le, cumulative in sorted(buckets):
+        if cumulative >= rank:
+            return le
+    return float("inf")
+
+
+def print_report(published_at: dict, done_at: dict, histograms: dict, services: FakeServices):
+    latencies = [done_at[i] - published_at[i] for i in done_at]
+    print("=" * 60)
+    print(f"Incidents: {len(published_at)} published, {len(done_at)} acknowledged")
+    if latencies:
+        first = min(published_at.values())
+        elapsed = max(done_at.values()) - first
+        print(f"Throughput: {len(done_at) / elapsed:.1f} incidents/s over {elapsed:.1f}s")
+        print(f"End-to-end latency: p50={percentile(latencies, 50) * 1000:.0f}ms "
+              f"p95={percentile(latencies, 95) * 1000:.0f}ms p99={percentile(latencies, 99) * 1000:.0f}ms "
+              f"max={max(latencies) * 1000:.0f}ms")
+
+    print(f"Fake service calls: {services.counts}")
+
+    if not histograms:
+        print("No agent metrics (install prometheus_client in the agent's environment for per-stage timings)")
+        return
+    titles = {
+        "agent_operation_seconds": "Operations (ok)",
+        "agent_stage_seconds": "Stage service time (per item or batch)",
+        "agent_stage_wait_seconds": "Stage queue wait",
+    }
+    for base, title in titles.items():
+        rows = sorted((label, entry) for (metric, label), entry in histograms.items() if metric == base and entry["count"])
+        if not rows:
+            continue
+        print(f"\n{title}:")
+        print(f"   {'name':30} {'count':>8} {'mean':>9} {'~p95':>9} {'~p99':>9}")
+        for label, entry in rows:
+            mean = entry["sum"] / entry["count"] * 1000
+            p95 = histogram_quantile(entry["buckets"], entry["count"], 0.95) * 1000
+            p99 = histogram_quantile(entry["buckets"], entry["count"], 0.99) * 1000
+            print(f"   {label:30} {int(entry['count']):8d} {mean:8.1f}ms {p95:8.0f}ms {p99:8.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the agent end to end against local API stand-ins")
+    parser.add_argument("--incidents", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=50, help="Messages published per second (0 = no limit)")
+    parser.add_argument("--openai-latency", default="800:0.6:lognormal",
+                        help='Chat completion latency spec, e.g. "800", "800:200", "800:0.6:lognormal"')
+    parser.add_argument("--embedding-latency", default="50:20")
+    parser.add_argument("--search-latency", default="30:10")
+    parser.add_argument("--slack-latency", default="150:50")
+    parser.add_argument("--in-process-search", action="store_true",
+                        help="Let the agent search pgvector itself (fake embeddings) instead of the fake search API")
+    parser.add_argument("--metrics-port", type=int, default=9109)
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for every incident")
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded incidents and their rows")
+    parser.add_argument("--fat", action="store_true", help="Embed the incident in each message (version 2)")
+    args = parser.parse_args()
+
+    services = FakeServices(latencies={
+        "openai_chat": Latency.parse(args.openai_latency),
+        "openai_embeddings": Latency.parse(args.embedding_latency),
+        "semantic_search": Latency.parse(args.search_latency),
+        "slack": Latency.parse(args.slack_latency),
+    }).start()
+
+    env = {**os.environ, **services.env(), "METRICS_PORT": str(args.metrics_port), "PYTHONUNBUFFERED": "1"}
+    if args.in_process_search:
+        env["SEMANTIC_SEARCH_URL"] = ""
+
+    conn = psycopg.connect(DATABASE_URL)
+    incidents = seed_incidents(conn, args.incidents)
+    ids = list(incidents)
+    print(f"🌱 Seeded {len(ids)} incidents ({ids[0]}..{ids[-1]})")
+
+    log_path = os.path.join(tempfile.gettempdir(), f"agent-load-test-{os.getpid()}.log")
+    agent = start_agent(env, log_path)
+    print(f"🚀 Agent started in {env.get('AGENT_MODE', 'serial')} mode (log: {log_path})")
+
+    try:
+        if not wait_for_agent(agent, log_path):
+            print("❌ Agent did not start listening; see the log above")
+            sys.exit(1)
+
+        print(f"📤 Publishing {len(ids)} {'fat ' if args.fat else ''}messages to {REDIS_CHANNEL} at "
+              f"{args.rate if args.rate > 0 else 'max'} msg/s")
+        published_at = publish(ids, args.rate, incidents if args.fat else None)
+        done_at = wait_for_acknowledged(conn, published_at, args.timeout)
+        histograms = scrape_histograms(f"http://127.0.0.1:{args.metrics_port}/metrics")
+        print_report(published_at, done_at, histograms, services)
+    finally:
+        if agent.poll() is None:
+            agent.send_signal(signal.SIGINT)
+            try:
+                agent.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                agent.kill()
+        services.stop()
+        if not args.keep:
+            cleanup(conn, ids)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
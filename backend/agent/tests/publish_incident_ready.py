@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 """
 Test script to publish incident_ready messages to Redis
+(sent with Postgres NOTIFY instead when REDIS_TRANSPORT=postgres)
 
 Usage:
-    python tests/publish_incident_ready.py [incident_id]
+    python tests/publish_incident_ready.py [incident_id ...]
     
 Examples:
     python tests/publish_incident_ready.py 123
+    python tests/publish_incident_ready.py 123 124 125  # one pipelined batch
     python tests/publish_incident_ready.py  # prompts for incident_id
 """
 
@@ -16,8 +18,9 @@ from pathlib import Path
 
 # Add parent directory to path to import config
 sys.path.insert(0, str(Path(__file__).parent.parent / 'app'))
-from redis_client import get_redis_client
-from config import REDIS_CHANNEL
+from redis_client import get_redis_client, publish_message, publish_many
+from config import REDIS_CHANNEL, REDIS_TRANSPORT
+from structured_logging import setup_logging
 
 def publish_incident(incident_id):
     """Publish incident_ready message to Redis"""
@@ -32,7 +35,7 @@ def publish_incident(incident_id):
         redis_client = get_redis_client()
         
         # Test connection
-        if not redis_client.ping():
+        if REDIS_TRANSPORT != "postgres" and not redis_client.ping():
             print("Error: Cannot connect to Redis")
             return False
             
@@ -40,8 +43,8 @@ def publish_incident(incident_id):
         message = {"incident_id": incident_id}
         message_json = json.dumps(message)
         
-        # Publish message
-        result = redis_client.publish(REDIS_CHANNEL, message_json)
+        # Publish message (pub/sub, list, stream or NOTIFY, per REDIS_TRANSPORT)
+        result = publish_message(REDIS_CHANNEL, message)
         
         if result > 0:
             print(f"✅ Successfully published to Redis:")
@@ -61,6 +64,25 @@ def publish_incident(incident_id):
         print(f"Error connecting to Redis: {e}")
         return False
 
+def publish_incidents(incident_ids):
+    """Publish incident_ready for several incidents in one pipelined batch"""
+    try:
+        incident_ids = [int(incident_id) for incident_id in incident_ids]
+        if REDIS_TRANSPORT != "postgres" and not get_redis_client().ping():
+            print("Error: Cannot connect to Redis")
+            return False
+
+        result = publish_many(REDIS_CHANNEL, [{"incident_id": incident_id} for incident_id in incident_ids])
+        print(f"✅ Published {len(incident_ids)} messages to {REDIS_CHANNEL} (result: {result})")
+        return True
+
+    except ValueError:
+        print(f"Error: incident_ids must be integers, got {incident_ids}")
+        return False
+    except Exception as e:
+        print(f"Error connecting to Redis: {e}")
+        return False
+
 def main():
     print("🚀 Incident Ready Message Publisher")
     print("=" * 40)
@@ -77,8 +99,11 @@ def main():
         print("Error: incident_id is required")
         sys.exit(1)
     
-    # Publish the message
-    success = publish_incident(incident_id)
+    # Publish the message(s)
+    if len(sys.argv) > 2:
+        success = publish_incidents(sys.argv[1:])
+    else:
+        success = publish_incident(incident_id)
     
     if success:
         print("\n💡 Next steps:")
@@ -90,4 +115,5 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    setup_logging()
     main()
\ No newline at end of file
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Incident leases outlive slow processing
+
+The agent renews the dedupe lease between stages, so an incident that takes
+longer than DEDUPE_LEASE_MS in total is not picked up by a second consumer
+while the first is still working on it. If the lease was lost anyway, the
+agent stops working on the incident rather than notify a second time.
+
+Runs against an in-memory Redis (pip install fakeredis lupa):
+    python -m unittest tests/test_dedupe.py
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+for var in ("DATABASE_URL", "OPENAI_API_KEY", "SLACK_BOT_TOKEN", "SLACK_SIGNING_SECRET"):
+    os.environ.setdefault(var, "test")
+
+try:
+    import fakeredis
+    import redis
+    import psycopg  # noqa: F401 (dedupe imports db)
+    DEPENDENCIES_AVAILABLE = True
+except ImportError:
+    DEPENDENCIES_AVAILABLE = False
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'app'))
+
+
+class MemoryLedger:
+    def __init__(self):
+        self.processed = set()
+
+    def is_processed(self, incident_id):
+        return incident_id in self.processed
+
+    def mark_processed(self, incident_id, processed_by):
+        self.processed.add(incident_id)
+
+
+@unittest.skipUnless(DEPENDENCIES_AVAILABLE, "needs fakeredis and psycopg")
+class LeaseRenewalTest(unittest.TestCase):
+
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        patcher = mock.patch.object(redis.Redis, "from_url", staticmethod(
+            lambda url, decode_responses=False, **kwargs: fakeredis.FakeRedis(server=server, decode_responses=decode_responses)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        import redis_client
+        from dedupe import IncidentDeduplicator
+        self.redis = redis_client.UnifiedRedisClient()
+        self.first = IncidentDeduplicator(self.redis, MemoryLedger(), lease_ms=300)
+        self.second = IncidentDeduplicator(self.redis, MemoryLedger(), lease_ms=300)
+
+    def test_renewed_lease_outlasts_lease_ms(self):
+        token = self.first.claim(1)
+        self.assertTrue(token)
+        for _ in range(3):
+            time.sleep(0.2)
+            self.assertTrue(self.first.renew(1, token))
+        # 600ms after the claim the 300ms lease is still held
+        self.assertIsNone(self.second.claim(1))
+        self.assertEqual(self.first.stats()["renewed"], 3)
+        self.assertEqual(self.second.stats()["duplicates"], 1)
+
+    def test_renew_does_not_take_back_a_lost_lease(self):
+        token = self.first.claim(2)
+        time.sleep(0.4)
+        other = self.second.claim(2)
+        self.assertTrue(other)
+        self.assertFalse(self.first.renew(2, token))
+        self.assertEqual(self.first.stats()["lost"], 1)
+        # The new holder's lease is untouched
+        self.assertEqual(self.redis.get("agent:incident:lease:2"), other)
+
+    def test_agent_stops_an_incident_whose_lease_was_lost(self):
+        try:
+            import agent
+        except ImportError as e:
+            self.skipTest(f"agent dependencies missing: {e}")
+        acked = []
+        for name, value in (("deduplicator", self.first), ("retry_scheduler", None),
+                            ("acknowledge", acked.append)):
+            patcher = mock.patch.object(agent, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        ctx = {"data": {"incident_id": 3}, "incident_id": 3}
+        self.assertTrue(agent.claim_incident(ctx, 3))
+        ran = []
+        taken = []
+
+        def slow_stage(ctx):
+            time.sleep(0.4)
+            # The lease expired meanwhile and another agent took the incident
+            taken.append(self.second.claim(3))
+            ran.append("slow")
+            return ctx
+
+        def notify_stage(ctx):
+            ran.append("notify")
+            return ctx
+
+        agent._run_stages(ctx, [("slow", slow_stage), ("notify", notify_stage)])
+        self.assertEqual(ran, ["slow"])
+        self.assertEqual(acked, [])
+        self.assertEqual(self.first.stats()["lost"], 1)
+        # Still held by the other agent, and not recorded as processed
+        self.assertTrue(taken[0])
+        self.assertEqual(self.redis.get("agent:incident:lease:3"), taken[0])
+        self.assertFalse(self.first.ledger.is_processed(3))
+
+    def test_counters_are_exact_under_concurrency(self):
+        def claim_many(start):
+            for incident_id in range(start, start + 100):
+                self.first.claim(incident_id)
+
+        threads = [threading.Thread(target=claim_many, args=(1000 + index * 100,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.first.stats()["claimed"], 800)
+
+
+if __name__ == "__main__":
+    unittest.main()
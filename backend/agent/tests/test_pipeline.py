@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Stopping the staged pipeline while the listener is still submitting
+
+Every message submit() accepted must go through every stage before stop()
+returns, even when submit() and stop() race.
+
+    python -m unittest tests/test_pipeline.py
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+for var in ("DATABASE_URL", "OPENAI_API_KEY", "SLACK_BOT_TOKEN", "SLACK_SIGNING_SECRET"):
+    os.environ.setdefault(var, "test")
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'app'))
+
+from pipeline import PipelineStage, StagedPipeline
+
+
+class StopSubmitRaceTest(unittest.TestCase):
+
+    def test_every_accepted_message_is_handled(self):
+        for trial in range(50):
+            handled = []
+            pipeline = StagedPipeline([
+                PipelineStage("parse", lambda ctx: ctx, concurrency=2, queue_size=4),
+                PipelineStage("handle", lambda ctx: handled.append(ctx["data"]), concurrency=1, queue_size=4),
+            ])
+            pipeline.start()
+            accepted = []
+
+            def submit_many(base):
+                for offset in range(50):
+                    if pipeline.submit(base + offset):
+                        accepted.append(base + offset)
+
+            threads = [threading.Thread(target=submit_many, args=(index * 100,)) for index in range(3)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.0005 * (trial % 5))
+            pipeline.stop()
+            for thread in threads:
+                thread.join(10)
+                self.assertFalse(thread.is_alive(), "submit() blocked after stop()")
+
+            self.assertEqual(sorted(handled), sorted(accepted))
+            self.assertEqual(pipeline.backlog(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
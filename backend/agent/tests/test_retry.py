@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Retries reach the agent on the list transport
+
+RetryScheduler re-publishes due retries with publish_many(); they must land
+where the listener reads, i.e. the list REDIS_CHANNEL with REDIS_TRANSPORT=list
+and on Upstash (which has no pub/sub to listen on).
+
+Runs against an in-memory Redis (pip install fakeredis):
+    python -m unittest tests/test_retry.py
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+os.environ.update(REDIS_TRANSPORT="list", REDIS_CHANNEL="test_incident_ready", RELIABLE_QUEUE="false")
+for var in ("DATABASE_URL", "OPENAI_API_KEY", "SLACK_BOT_TOKEN", "SLACK_SIGNING_SECRET"):
+    os.environ.setdefault(var, "test")
+
+try:
+    import fakeredis
+    import redis
+    FAKEREDIS_AVAILABLE = True
+except ImportError:
+    FAKEREDIS_AVAILABLE = False
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'app'))
+
+
+@unittest.skipUnless(FAKEREDIS_AVAILABLE, "needs fakeredis")
+class RetryRedeliveryTest(unittest.TestCase):
+
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        patcher = mock.patch.object(redis.Redis, "from_url", staticmethod(
+            lambda url, decode_responses=False, **kwargs: fakeredis.FakeRedis(server=server, decode_responses=decode_responses)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        import redis_client
+        from retry import RetryScheduler, TransientError
+        self.rc = redis_client
+        # config may already have been imported (without the settings above) by another test module
+        for name, value in (("REDIS_TRANSPORT", "list"), ("RELIABLE_QUEUE", False)):
+            setting_patcher = mock.patch.object(redis_client, name, value)
+            setting_patcher.start()
+            self.addCleanup(setting_patcher.stop)
+        # A fresh (lazily connected) client on the fake server for every test
+        client_patcher = mock.patch.object(redis_client, "redis_client", redis_client.UnifiedRedisClient())
+        client_patcher.start()
+        self.addCleanup(client_patcher.stop)
+        self.channel = "test_incident_ready"
+        self.scheduler = RetryScheduler(redis_client.redis_client, self.channel, redis_client.publish_many,
+                                        max_attempts=3, base_delay=0.01, max_delay=0.01)
+        self.error = TransientError("OpenAI API error: 503")
+
+    def test_upstash_pubsub_publishes_to_the_list(self):
+        with mock.patch.object(self.rc, "REDIS_TRANSPORT", "pubsub"):
+            with mock.patch.object(self.rc.redis_client, "_client_type", "upstash"), \
+                    mock.patch.object(self.rc.redis_client, "_client", object()):
+                self.assertTrue(self.rc.publishes_to_list())
+            self.assertFalse(self.rc.publishes_to_list())
+
+    def test_republished_retry_is_consumed_by_the_listener(self):
+        self.assertTrue(self.scheduler.fail({"incident_id": 7, "_ack": lambda: None}, self.error))
+        time.sleep(0.05)
+        self.assertEqual(self.scheduler.release_due(), 1)
+        self.assertEqual(self.rc.redis_client.zcard(self.scheduler.retry_key), 0)
+
+        received = []
+        listener = self.rc.RedisMessageListener(self.rc.redis_client, self.channel)
+
+        def callback(data):
+            received.append(data)
+            listener.stop()
+
+        thread = threading.Thread(target=listener.listen, args=(callback,), daemon=True)
+        thread.start()
+        thread.join(10)
+        listener.stop()
+
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]["incident_id"], 7)
+        self.assertEqual(received[0]["retry"]["attempt"], 1)
+
+    def test_retries_end_in_the_dead_letter_list(self):
+        data = {"incident_id": 8}
+        for _ in range(3):
+            self.assertTrue(self.scheduler.fail(data, self.error))
+            time.sleep(0.05)
+            self.scheduler.release_due()
+            message = self.rc.redis_client.rpop(self.channel)
+            if message is None:
+                break
+            data = self.rc.decode_message(message)
+        self.assertEqual(self.rc.redis_client.llen(self.scheduler.dead_key), 1)
+        self.assertEqual(self.scheduler.dead_letters()[0][1]["attempts"], 3)
+
+    def test_partly_published_retries_stay_scheduled(self):
+        from retry import RetryScheduler
+        short = RetryScheduler(self.rc.redis_client, self.channel, lambda channel, messages: len(messages) - 1,
+                               max_attempts=3, base_delay=0.01, max_delay=0.01)
+        for incident_id in (10, 11):
+            self.assertTrue(short.fail({"incident_id": incident_id}, self.error))
+        time.sleep(0.05)
+        self.assertEqual(short.release_due(), 0)
+        # Both stay claimed, to come due again after CLAIM_SECONDS
+        self.assertEqual(self.rc.redis_client.zcard(short.retry_key), 2)
+
+    def test_sent_notifications_are_remembered_across_retries(self):
+        notified = {"slack_success": True, "notifications_sent": 1}
+        data = {"incident_id": 9, "retry": {"notified": notified}}
+        for _ in range(3):
+            self.assertTrue(self.scheduler.fail(data, self.error))
+            time.sleep(0.05)
+            self.scheduler.release_due()
+            message = self.rc.redis_client.rpop(self.channel)
+            if message is None:
+                break
+            data = self.rc.decode_message(message)
+            self.assertEqual(data["retry"]["notified"], notified)
+
+        raw, _ = self.scheduler.dead_letters()[0]
+        self.assertTrue(self.scheduler.requeue(raw))
+        requeued = self.rc.decode_message(self.rc.redis_client.rpop(self.channel))
+        self.assertEqual(requeued["retry"], {"notified": notified})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+The sweeper leaves failed incidents to the retry scheduler
+
+Incidents waiting for a retry or sitting on the dead-letter list are still
+"open" in Postgres; re-publishing them would start a second attempt chain
+(and notify again).
+
+Runs against an in-memory Redis (pip install fakeredis lupa):
+    python -m unittest tests/test_sweeper.py
+"""
+
+import os
+import sys
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+for var in ("DATABASE_URL", "OPENAI_API_KEY", "SLACK_BOT_TOKEN", "SLACK_SIGNING_SECRET"):
+    os.environ.setdefault(var, "test")
+
+try:
+    import fakeredis
+    import redis
+    import psycopg  # noqa: F401 (sweeper imports db)
+    DEPENDENCIES_AVAILABLE = True
+except ImportError:
+    DEPENDENCIES_AVAILABLE = False
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'app'))
+
+
+@unittest.skipUnless(DEPENDENCIES_AVAILABLE, "needs fakeredis and psycopg")
+class SweeperSkipsFailedIncidentsTest(unittest.TestCase):
+
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        patcher = mock.patch.object(redis.Redis, "from_url", staticmethod(
+            lambda url, decode_responses=False, **kwargs: fakeredis.FakeRedis(server=server, decode_responses=decode_responses)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        import redis_client
+        import sweeper
+        from retry import RetryScheduler, PermanentError, TransientError
+        self.redis = redis_client.UnifiedRedisClient()
+        self.published = []
+
+        def publish(channel, messages):
+            self.published.extend(messages)
+            return len(messages)
+
+        self.open_incidents = []
+        for name, value in (("create_incident_status_index", lambda: None),
+                            ("get_stale_incidents", lambda *args, **kwargs: (list(self.open_incidents), None))):
+            db_patcher = mock.patch.object(sweeper, name, value)
+            db_patcher.start()
+            self.addCleanup(db_patcher.stop)
+
+        self.retries = RetryScheduler(self.redis, "test_sweep", publish, max_attempts=3,
+                                      base_delay=600, max_delay=600)
+        self.sweeper = sweeper.IncidentSweeper(self.redis, "test_sweep", publish, grace_period=300, rate=0,
+                                               retries=self.retries)
+        self.permanent = PermanentError("OpenAI API error: 400")
+        self.transient = TransientError("OpenAI API error: 503")
+
+    def incident(self, incident_id):
+        return {"id": incident_id, "summary_text": "disk full", "labels": [], "status": "open"}
+
+    def test_dead_lettered_incident_is_not_republished(self):
+        self.open_incidents = [self.incident(1), self.incident(2)]
+        self.assertTrue(self.retries.fail({"incident_id": 1, "retry": {"notified": {"slack_success": True}}},
+                                          self.permanent))
+
+        self.assertEqual(self.sweeper.sweep(), 1)
+        self.assertEqual([message["incident_id"] for message in self.published], [2])
+        self.assertEqual(self.sweeper.stats()["skipped_failed"], 1)
+
+    def test_pending_retry_is_left_to_the_scheduler(self):
+        self.open_incidents = [self.incident(3)]
+        self.assertTrue(self.retries.fail({"incident_id": 3}, self.transient))
+
+        self.assertEqual(self.sweeper.sweep(), 0)
+        self.assertEqual(self.published, [])
+
+    def test_lost_retry_is_resumed_with_its_state(self):
+        self.open_incidents = [self.incident(4)]
+        self.assertTrue(self.retries.fail({"incident_id": 4, "retry": {"notified": {"slack_success": True}}},
+                                          self.transient))
+        # Fell due (600s) and the grace period (300s) passed, but the incident is still open
+        later = time.time() + 600 + 300 + 1
+        with mock.patch.object(time, "time", lambda: later):
+            self.assertEqual(self.sweeper.sweep(), 1)
+        retry = self.published[0]["retry"]
+        self.assertEqual(retry["attempt"], 1)
+        self.assertEqual(retry["notified"], {"slack_success": True})
+
+    def test_resolved_incident_is_swept_again(self):
+        self.open_incidents = [self.incident(5)]
+        self.assertTrue(self.retries.fail({"incident_id": 5}, self.permanent))
+        self.retries.resolve([5])
+        self.assertEqual(self.sweeper.sweep(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
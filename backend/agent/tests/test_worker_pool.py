@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Stopping the worker pool while the listener is still submitting
+
+Every message submit() accepted must be handled before stop() returns, even
+when submit() and stop() race.
+
+    python -m unittest tests/test_worker_pool.py
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+for var in ("DATABASE_URL", "OPENAI_API_KEY", "SLACK_BOT_TOKEN", "SLACK_SIGNING_SECRET"):
+    os.environ.setdefault(var, "test")
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'app'))
+
+from worker_pool import IncidentWorkerPool
+
+
+class StopSubmitRaceTest(unittest.TestCase):
+
+    def test_every_accepted_message_is_handled(self):
+        for trial in range(50):
+            handled = []
+            pool = IncidentWorkerPool(handled.append, num_workers=2, queue_size=4,
+                                      batch_handler=handled.extend, batch_size=3)
+            pool.start()
+            accepted = []
+
+            def submit_many(base):
+                for offset in range(50):
+                    if pool.submit({"incident_id": base + offset}):
+                        accepted.append(base + offset)
+
+            threads = [threading.Thread(target=submit_many, args=(index * 100,)) for index in range(3)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.0005 * (trial % 5))
+            pool.stop(drain=True, timeout=10)
+            for thread in threads:
+                thread.join(10)
+                self.assertFalse(thread.is_alive(), "submit() blocked after stop()")
+
+            self.assertEqual(sorted(message["incident_id"] for message in handled), sorted(accepted))
+            self.assertEqual(pool.backlog(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()